@@ -0,0 +1,252 @@
+import os
+import sys
+import gc
+import json
+import time
+import argparse
+import platform
+import tempfile
+import tracemalloc
+from pathlib import Path
+
+# rendering runs without a window
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+
+import numpy as np
+import pygame
+
+from winged_edge import EdgeMesh, CompactEdgeMesh, ObjData, parse_obj, save_mesh_to_obj
+import transformations as T
+import render
+
+# face counts used when --sizes is not given (up to 10_000_000 works, it just takes a while)
+DEFAULT_SIZES = (1_000, 10_000, 100_000)
+# the object-per-element EdgeMesh is only measured up to this many faces
+EDGE_MESH_MAX_FACES = 100_000
+# adjacency queries per case, on random vertices/faces (fixed seed)
+QUERY_COUNT = 1_000
+SEED = 1234
+RENDER_SIZE = (950, 800)
+
+# synthetic meshes: every generator returns an ObjData with about n_faces faces
+
+def make_grid(n_faces):
+    # flat open grid of quads on the XY plane, fits in [-1, 1]
+    side = max(int(round(np.sqrt(n_faces))), 1)
+    xs = np.linspace(-1, 1, side + 1)
+    x, y = np.meshgrid(xs, xs)
+    vertices = np.column_stack([x.ravel(), y.ravel(), np.zeros(x.size)])
+
+    rows = np.arange(side)
+    corner = (rows[:, None] * (side + 1) + rows[None, :]).ravel()
+    quads = np.column_stack([corner, corner + 1, corner + side + 2, corner + side + 1])
+    return _quad_data(vertices, quads)
+
+def make_torus(n_faces, major=0.7, minor=0.3):
+    # closed torus of quads (no boundary)
+    segments = max(int(round(np.sqrt(2 * n_faces))), 3)
+    rings = max(n_faces // segments, 3)
+    u = np.linspace(0, 2 * np.pi, segments, endpoint=False)
+    v = np.linspace(0, 2 * np.pi, rings, endpoint=False)
+    uu, vv = np.meshgrid(u, v)
+    vertices = np.column_stack([
+        ((major + minor * np.cos(vv)) * np.cos(uu)).ravel(),
+        ((major + minor * np.cos(vv)) * np.sin(uu)).ravel(),
+        (minor * np.sin(vv)).ravel(),
+    ])
+
+    r, s = np.meshgrid(np.arange(rings), np.arange(segments), indexing='ij')
+    r, s = r.ravel(), s.ravel()
+    r1, s1 = (r + 1) % rings, (s + 1) % segments
+    quads = np.column_stack([r * segments + s, r * segments + s1, r1 * segments + s1, r1 * segments + s])
+    return _quad_data(vertices, quads)
+
+def make_sphere(n_faces):
+    # closed UV sphere: quads between the rings and a fan of triangles at each pole
+    segments = max(int(round(np.sqrt(2 * n_faces))), 3)
+    rings = max(n_faces // segments, 2)
+    theta = np.linspace(0, np.pi, rings + 1)[1:-1]
+    phi = np.linspace(0, 2 * np.pi, segments, endpoint=False)
+    tt, pp = np.meshgrid(theta, phi, indexing='ij')
+    vertices = np.vstack([
+        [[0, 0, 1]],
+        np.column_stack([(np.sin(tt) * np.cos(pp)).ravel(), (np.sin(tt) * np.sin(pp)).ravel(), np.cos(tt).ravel()]),
+        [[0, 0, -1]],
+    ])
+    south = len(vertices) - 1
+
+    s = np.arange(segments)
+    s1 = (s + 1) % segments
+    top = np.column_stack([np.zeros(segments, dtype=np.int64), 1 + s, 1 + s1])
+    r, s = np.meshgrid(np.arange(rings - 2), np.arange(segments), indexing='ij')
+    r, s = r.ravel(), s.ravel()
+    s1 = (s + 1) % segments
+    quads = 1 + np.column_stack([r * segments + s, (r + 1) * segments + s, (r + 1) * segments + s1, r * segments + s1])
+    last = 1 + (rings - 2) * segments
+    bottom = np.column_stack([last + np.arange(segments), np.full(segments, south), last + (np.arange(segments) + 1) % segments])
+
+    sizes = np.concatenate([np.full(segments, 3), np.full(len(quads), 4), np.full(segments, 3)])
+    face_offsets = np.zeros(len(sizes) + 1, dtype=np.int64)
+    np.cumsum(sizes, out=face_offsets[1:])
+    face_vertices = np.concatenate([top.ravel(), quads.ravel(), bottom.ravel()]).astype(np.int32)
+    return ObjData(vertices.astype(np.float64), face_offsets, face_vertices)
+
+def _quad_data(vertices, quads):
+    face_offsets = np.arange(len(quads) + 1, dtype=np.int64) * 4
+    return ObjData(vertices.astype(np.float64), face_offsets, quads.ravel().astype(np.int32))
+
+GENERATORS = {'grid': make_grid, 'sphere': make_sphere, 'torus': make_torus}
+
+# timing
+
+def measure(function, repeat=3):
+    # best and median wall time of repeat runs, then one more run under tracemalloc for the peak
+    times = []
+    result = None
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+
+    gc.collect()
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'best_s': min(times),
+        'median_s': float(np.median(times)),
+        'peak_mb': peak / (1024 * 1024),
+    }, result
+
+def _mesh_from(data, cls):
+    mesh = cls()
+    mesh.build_from_arrays(data.vertices, data.face_offsets, data.face_vertices)
+    return mesh
+
+def _load(path, cls):
+    # same as load_obj, without logging the validation report
+    mesh = cls()
+    mesh.load_data(parse_obj(path), log_limit=None)
+    return mesh
+
+def _quiet(function):
+    # the savers print one line per call
+    def run():
+        stdout = sys.stdout
+        sys.stdout = open(os.devnull, 'w')
+        try:
+            return function()
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+    return run
+
+def benchmark_case(kind, n_faces, work_dir, repeat, surface):
+    data = GENERATORS[kind](n_faces)
+    n_real_faces = len(data.face_offsets) - 1
+    results = {'mesh': kind, 'faces': n_real_faces, 'vertices': len(data.vertices), 'timings': {}}
+    timings = results['timings']
+    rng = np.random.default_rng(SEED)
+
+    classes = [CompactEdgeMesh]
+    if n_real_faces <= EDGE_MESH_MAX_FACES:
+        classes.append(EdgeMesh)
+
+    path = Path(work_dir) / f"{kind}_{n_real_faces}.obj"
+    compact = _mesh_from(data, CompactEdgeMesh)
+    timings['build_compact'], _ = measure(lambda: _mesh_from(data, CompactEdgeMesh), repeat)
+    timings['save_obj'], _ = measure(_quiet(lambda: save_mesh_to_obj(compact, path)), repeat)
+
+    matrix = T.build_transformation_matrix([('rotateX', 30), ('rotateY', 45), ('translate', 0.1, 0.2, 0.3), ('scale', 1.5, 1.5, 1.5)])
+    for cls in classes:
+        name = 'compact' if cls is CompactEdgeMesh else 'edge_mesh'
+        timings[f'load_obj_{name}'], mesh = measure(lambda: _load(path, cls), repeat)
+        timings[f'transform_{name}'], _ = measure(lambda: mesh.transform(matrix), repeat)
+
+        v_ids = rng.integers(1, len(mesh.vertices) + 1, QUERY_COUNT).tolist()
+        f_ids = rng.integers(1, len(mesh.faces) + 1, QUERY_COUNT).tolist()
+        # the first call builds the cached indexes, it is measured on its own
+        timings[f'index_build_{name}'], _ = measure(lambda: (mesh.invalidate_topology(), mesh.faces_around_vertex(1), mesh.face_loops()), 1)
+        timings[f'faces_around_vertex_{name}'], _ = measure(lambda: [mesh.faces_around_vertex(v) for v in v_ids], repeat)
+        timings[f'edges_around_vertex_{name}'], _ = measure(lambda: [mesh.edges_around_vertex(v) for v in v_ids], repeat)
+        timings[f'face_edges_{name}'], _ = measure(lambda: [mesh.face_edge_keys(f) for f in f_ids], repeat)
+        timings[f'adjacent_faces_{name}'], _ = measure(lambda: [mesh.faces_adjacent_to_face(f) for f in f_ids], repeat)
+
+    timings['apply_model_transform'], _ = measure(lambda: compact.apply_model_transform(matrix), repeat)
+    compact.model_matrix = np.identity(4)
+
+    edges = compact.edge_index_array()
+    offset = (RENDER_SIZE[0] / 2, RENDER_SIZE[1] / 2)
+
+    def draw():
+        surface.fill((0, 0, 0))
+        points = render.project_orthographic_array(compact.coords_array(), 300, offset, matrix)
+        render.draw_edges(surface, points, edges, (255, 255, 255))
+    timings['render_frame'], _ = measure(draw, repeat)
+
+    path.unlink(missing_ok=True)
+    return results
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Time the mesh loader, writer, transforms, queries and rendering on synthetic meshes.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES),
+                        help="face counts to generate (default: %(default)s)")
+    parser.add_argument('--meshes', nargs='+', choices=sorted(GENERATORS), default=sorted(GENERATORS),
+                        help="which synthetic meshes to use (default: all)")
+    parser.add_argument('--repeat', type=int, default=3, help="runs per timing, the best one is reported (default: 3)")
+    parser.add_argument('--output', default='benchmark_results.json', help="JSON file for the results (default: %(default)s)")
+    parser.add_argument('--compare', default=None, help="an older results file, prints how every timing changed")
+    return parser.parse_args()
+
+def compare(old_results, new_results):
+    # ratio new/old of the best time for every case found in both runs
+    old = {(case['mesh'], case['faces'], name): t['best_s']
+           for case in old_results['cases'] for name, t in case['timings'].items()}
+    print(f"\n{'case':<52}{'old (ms)':>10}{'new (ms)':>10}{'ratio':>8}")
+    for case in new_results['cases']:
+        for name, t in case['timings'].items():
+            key = (case['mesh'], case['faces'], name)
+            if key in old and old[key] > 0:
+                label = f"{case['mesh']} {case['faces']} {name}"
+                print(f"{label:<52}{old[key] * 1000:>10.2f}{t['best_s'] * 1000:>10.2f}{t['best_s'] / old[key]:>8.2f}")
+
+def main():
+    args = parse_args()
+    pygame.init()
+    surface = pygame.Surface(RENDER_SIZE)
+
+    results = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pygame': pygame.version.ver,
+        'platform': platform.platform(),
+        'repeat': args.repeat,
+        'cases': [],
+    }
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        for n_faces in args.sizes:
+            for kind in args.meshes:
+                case = benchmark_case(kind, n_faces, work_dir, args.repeat, surface)
+                results['cases'].append(case)
+                print(f"{kind} ({case['faces']} faces, {case['vertices']} vertices)")
+                for name, t in case['timings'].items():
+                    print(f"  {name:<32}{t['best_s'] * 1000:>10.2f} ms{t['peak_mb']:>10.1f} MB")
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results saved to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
+
+    pygame.quit()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+import numpy as np
+
+# vertical field of view of the perspective projection, in degrees
+FIELD_OF_VIEW = 50
+# the perspective projection drops what is closer to the eye than this (in units)
+NEAR_PLANE = 0.01
+# radians turned per pixel the mouse moves while orbiting
+ORBIT_SPEED = 0.01
+# the distance to the target is divided by this for every step of the mouse wheel
+ZOOM_STEP = 1.1
+# the pitch stops just before the poles, where the up vector would flip
+MAX_PITCH = np.radians(89)
+
+class OrbitCamera:
+    # a camera that turns around a target point, at some distance from it
+    # yaw turns around the Y axis and pitch up and down; with both at 0 the camera is on
+    # the +Z side looking down -Z, which is the orthographic view the viewer always had
+    # orthographic: the projection keeps scale pixels per unit at every depth, where
+    # scale is the one the perspective projection has at the target, so switching
+    # between the two keeps the target plane the same size
+    # matrix() maps world points to homogeneous screen points (x * w, y * w, depth * w, w),
+    # depth only grows away from the camera (what render and raster use for the z-buffer)
+
+    def __init__(self, scale, offset, perspective=False, fov=FIELD_OF_VIEW):
+        self.offset = (float(offset[0]), float(offset[1]))
+        self.perspective = perspective
+        self.fov = fov
+        self.target = np.zeros(3)
+        self.yaw = 0.0
+        self.pitch = 0.0
+        # the starting distance is the one with `scale` pixels per unit at the target
+        self.distance = self.focal_length() / scale
+
+    def focal_length(self):
+        # pixels per unit at one unit of distance, for the height of the view
+        return self.offset[1] / np.tan(np.radians(self.fov) / 2)
+
+    def scale(self):
+        # pixels per unit at the target
+        return self.focal_length() / self.distance
+
+    def axes(self):
+        # (right, up, back) unit vectors of the camera, in world space
+        cos_p, sin_p = np.cos(self.pitch), np.sin(self.pitch)
+        back = np.array([cos_p * np.sin(self.yaw), sin_p, cos_p * np.cos(self.yaw)])
+        right = np.array([np.cos(self.yaw), 0.0, -np.sin(self.yaw)])
+        return right, np.cross(back, right), back
+
+    def eye(self):
+        # homogeneous position of the eye: a point for the perspective projection,
+        # the direction towards the viewer (w = 0) for the orthographic one
+        _, _, back = self.axes()
+        if self.perspective:
+            return np.append(self.target + self.distance * back, 1.0)
+        return np.append(back, 0.0)
+
+    def view_matrix(self):
+        # world -> camera space (X right, Y up, looking down -Z)
+        right, up, back = self.axes()
+        eye = self.target + self.distance * back
+        view = np.identity(4)
+        view[:3, :3] = np.stack([right, up, back])
+        view[:3, 3] = -view[:3, :3] @ eye
+        return view
+
+    def matrix(self):
+        # 4x4 world -> homogeneous screen matrix (pygame Y goes down)
+        ox, oy = self.offset
+        if self.perspective:
+            f = self.focal_length()
+            # w is the distance in front of the eye, depth / w = 1 - NEAR_PLANE / w
+            projection = np.array([
+                [f, 0,  -ox, 0],
+                [0, -f, -oy, 0],
+                [0, 0,  -1,  -NEAR_PLANE],
+                [0, 0,  -1,  0],
+            ], dtype=np.float64)
+        else:
+            s = self.scale()
+            projection = np.array([
+                [s, 0,  0,  ox],
+                [0, -s, 0,  oy],
+                [0, 0,  -1, 0],
+                [0, 0,  0,  1],
+            ], dtype=np.float64)
+        return projection @ self.view_matrix()
+
+    def orbit(self, dx, dy):
+        # turns around the target for a mouse movement of (dx, dy) pixels
+        self.yaw -= dx * ORBIT_SPEED
+        self.pitch = float(np.clip(self.pitch + dy * ORBIT_SPEED, -MAX_PITCH, MAX_PITCH))
+
+    def pan(self, dx, dy):
+        # moves the target with the mouse, (dx, dy) pixels in the target plane
+        right, up, _ = self.axes()
+        scale = self.scale()
+        self.target = self.target - right * (dx / scale) + up * (dy / scale)
+
+    def zoom(self, steps):
+        # positive steps move closer (and enlarge the orthographic view)
+        self.distance /= ZOOM_STEP ** steps
+
@@ -0,0 +1,485 @@
+import heapq
+import argparse
+import threading
+import numpy as np
+
+from winged_edge import CompactEdgeMesh, _triangulate, _walk_face_loop, save_mesh
+from mesh_cache import load_mesh
+import profiling
+
+# boundary edges also get the quadric of a plane standing on them, this much
+# stronger than the face planes, so the outline of an open mesh stays in place
+BOUNDARY_WEIGHT = 1000.0
+# a collapse is refused when it turns a face normal by more than 90 degrees
+# (cosine of the largest allowed turn)
+MIN_NORMAL_COS = 0.0
+# every level of build_lod_chain keeps this fraction of the faces of the one before
+LOD_RATIO = 0.25
+# and the chain stops before a level would have less faces than this
+LOD_MIN_FACES = 100
+# the viewer shows the finest level that has at least this many pixels of screen area per face
+LOD_PIXELS_PER_FACE = 16
+# a quadric with a smaller determinant (relative to its scale) has no single minimum
+SINGULAR_TOLERANCE = 1e-9
+# the 10 distinct coefficients of a symmetric 4x4 quadric (upper triangle, row by row)
+_UPPER = np.triu_indices(4)
+
+class _Decimator:
+    # quadric error edge collapse (Garland and Heckbert) on the winged-edge objects:
+    # the cheapest edge is collapsed into its best point, the two faces next to it and
+    # one of the two other edges of each face are removed, and the links of the edges
+    # around it (left/right faces, next/prev) are patched in place, so every collapse
+    # only touches the neighbourhood of the edge
+    # the priority queue is a heap with lazy deletion: an edge whose cost changed is
+    # pushed again with a new version and the older entries are skipped when popped
+
+    def __init__(self, mesh):
+        # the work is done on a triangulated copy, mesh itself is never changed
+        coords = mesh.coords_array()
+        offsets, v_ids = mesh.face_vertex_arrays()
+        triangles = _triangulate(offsets, mesh.vertex_rows(v_ids))
+        work = CompactEdgeMesh()
+        work.build_from_arrays(coords, np.arange(len(triangles) + 1) * 3, triangles.ravel())
+        self.mesh = work.to_edge_mesh()
+
+        # positions and quadrics are indexed by vertex id (row 0 is not used); during
+        # the collapses they are plain lists, a quadric as its 10 distinct coefficients
+        self.pos = [None] + coords.tolist()
+        quadrics = np.zeros((len(coords) + 1, 4, 4))
+        self._init_quadrics(quadrics, coords, triangles, work)
+        self.quadrics = quadrics[:, _UPPER[0], _UPPER[1]].tolist()
+
+        # the vertex ids of every triangle in loop order, kept up to date
+        faces = self.mesh.faces
+        self.face_vertices = {faces[row + 1]: tri for row, tri in enumerate((triangles + 1).tolist())}
+        self.vertex_edges = {v_id: set() for v_id in self.mesh.vertices}
+        for edge in self.mesh.edges.values():
+            self.vertex_edges[edge.vertex_start].add(edge)
+            self.vertex_edges[edge.vertex_end].add(edge)
+
+        self.versions = {}
+        self.targets = {}
+        self._counter = 0
+        self.heap = self._initial_queue(quadrics, np.vstack([np.zeros((1, 3)), coords]))
+
+    def _init_quadrics(self, quadrics, coords, triangles, work):
+        # sum of the squared distances to the planes of the faces around every vertex,
+        # weighted by the face areas
+        a, b, c = (coords[triangles[:, k]] for k in range(3))
+        normals = np.cross(b - a, c - a)
+        areas = np.linalg.norm(normals, axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            unit = np.nan_to_num(normals / areas[:, None])
+        planes = np.column_stack([unit, -(unit * a).sum(axis=1)])
+        face_quadrics = (areas / 2)[:, None, None] * planes[:, :, None] * planes[:, None, :]
+        for k in range(3):
+            np.add.at(quadrics, triangles[:, k] + 1, face_quadrics)
+
+        # one face only: the edge is on the boundary
+        left, right = work.edge_left_face, work.edge_right_face
+        boundary = np.flatnonzero((left < 0) != (right < 0))
+        if len(boundary) == 0:
+            return
+        starts = work.edge_vertex_start[boundary]
+        ends = work.edge_vertex_end[boundary]
+        faces = np.where(left[boundary] >= 0, left[boundary], right[boundary])
+        direction = coords[ends] - coords[starts]
+        side = np.cross(direction, unit[faces])
+        lengths = np.linalg.norm(side, axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            side = np.nan_to_num(side / lengths[:, None])
+        planes = np.column_stack([side, -(side * coords[starts]).sum(axis=1)])
+        weights = BOUNDARY_WEIGHT * (direction ** 2).sum(axis=1)
+        edge_quadrics = weights[:, None, None] * planes[:, :, None] * planes[:, None, :]
+        np.add.at(quadrics, starts + 1, edge_quadrics)
+        np.add.at(quadrics, ends + 1, edge_quadrics)
+
+    def _initial_queue(self, quadrics, pos):
+        # the cost and best point of every edge, computed in one batch, as a heap
+        edges = list(self.mesh.edges.values())
+        if not edges:
+            return []
+        starts = np.array([e.vertex_start for e in edges])
+        ends = np.array([e.vertex_end for e in edges])
+        quadrics = quadrics[starts] + quadrics[ends]
+        a, b = pos[starts], pos[ends]
+
+        # candidates: the minimum of the quadric (when it has one), both ends and the middle
+        candidates = [a, b, (a + b) / 2]
+        matrices = quadrics[:, :3, :3]
+        det = np.linalg.det(matrices)
+        scale = np.abs(np.trace(matrices, axis1=1, axis2=2)) / 3
+        solvable = np.abs(det) > SINGULAR_TOLERANCE * scale ** 3
+        if solvable.any():
+            best = (a + b) / 2
+            best[solvable] = np.linalg.solve(matrices[solvable], -quadrics[solvable, :3, 3][..., None])[..., 0]
+            candidates.append(best)
+
+        points = np.stack(candidates, axis=1)
+        homogeneous = np.concatenate([points, np.ones(points.shape[:2] + (1,))], axis=2)
+        costs = np.einsum('kci,kij,kcj->kc', homogeneous, quadrics, homogeneous)
+        choice = np.argmin(costs, axis=1)
+        rows = np.arange(len(edges))
+        costs = np.maximum(costs[rows, choice], 0.0).tolist()
+        points = points[rows, choice].tolist()
+
+        heap = []
+        for counter, (edge, cost, point) in enumerate(zip(edges, costs, points)):
+            self.versions[edge] = 1
+            self.targets[edge] = point
+            heap.append((cost, counter, edge, 1))
+        self._counter = len(heap)
+        heapq.heapify(heap)
+        return heap
+
+    def _push(self, edges):
+        # queues the edges again with their new cost, one at a time: after a collapse only
+        # a handful of edges change, too few to be worth a numpy batch
+        for edge in edges:
+            a, b = edge.vertex_start, edge.vertex_end
+            cost, point = _best_point([x + y for x, y in zip(self.quadrics[a], self.quadrics[b])], self.pos[a], self.pos[b])
+            version = self.versions.get(edge, 0) + 1
+            self.versions[edge] = version
+            self.targets[edge] = point
+            self._counter += 1
+            heapq.heappush(self.heap, (cost, self._counter, edge, version))
+
+    def _forget(self, edge):
+        self.versions.pop(edge, None)
+        self.targets.pop(edge, None)
+
+    def _face_corners(self, face):
+        return _walk_face_loop(face, 4)
+
+    def _can_collapse(self, edge, point):
+        a, b = edge.vertex_start, edge.vertex_end
+        faces = [f for f in (edge.left_face, edge.right_face) if f is not None]
+        if not faces:
+            return False
+
+        opposite = []
+        for face in faces:
+            vertices, edges = self._face_corners(face)
+            if len(edges) != 3 or edge not in edges:
+                # not a closed triangle (broken or non-manifold input)
+                return False
+            x = [v for v in vertices if v != a and v != b]
+            if len(x) != 1:
+                return False
+            opposite.append(x[0])
+            # the two other edges of the face must not both be on the boundary
+            if all(_other_face(e, face) is None for e in edges if e is not edge):
+                return False
+        if len(opposite) == 2 and opposite[0] == opposite[1]:
+            return False
+
+        # link condition: the only common neighbours of a and b are the opposite vertices
+        neighbours_a = {_other_end(e, a) for e in self.vertex_edges[a]}
+        neighbours_b = {_other_end(e, b) for e in self.vertex_edges[b]}
+        if neighbours_a & neighbours_b != set(opposite):
+            return False
+
+        # an interior edge between two boundary vertices would pinch the mesh
+        if len(faces) == 2 and self._on_boundary(a) and self._on_boundary(b):
+            return False
+
+        # the faces that stay must not end up with the same edges as another face,
+        # or turned over by the new position
+        for face in faces:
+            _, edges = self._face_corners(face)
+            others = [e for e in edges if e is not edge]
+            if _other_face(others[0], face) is not None and _other_face(others[0], face) is _other_face(others[1], face):
+                return False
+
+        removed = set(faces)
+        seen = set()
+        for v in (a, b):
+            for e in self.vertex_edges[v]:
+                for face in (e.left_face, e.right_face):
+                    if face is None or face in removed or face in seen:
+                        continue
+                    seen.add(face)
+                    vertices = self.face_vertices[face]
+                    before = [self.pos[u] for u in vertices]
+                    after = [point if u in (a, b) else self.pos[u] for u in vertices]
+                    n0 = _normal(*before)
+                    n1 = _normal(*after)
+                    if _dot(n0, n1) <= MIN_NORMAL_COS * _length(n0) * _length(n1):
+                        return False
+        return True
+
+    def _on_boundary(self, v_id):
+        return any(e.left_face is None or e.right_face is None for e in self.vertex_edges[v_id])
+
+    def _collapse(self, edge, point):
+        # b is merged into a, which moves to point
+        mesh = self.mesh
+        a, b = edge.vertex_start, edge.vertex_end
+        # the triangles around b, collected before the links around it change
+        b_faces = {f for e in self.vertex_edges[b] for f in (e.left_face, e.right_face) if f is not None}
+
+        for face in [f for f in (edge.left_face, edge.right_face) if f is not None]:
+            _, edges = self._face_corners(face)
+            first, second = [e for e in edges if e is not edge]
+            # g_edge goes to the removed vertex b and disappears, k_edge goes to a and stays
+            g_edge, k_edge = (first, second) if b in (first.vertex_start, first.vertex_end) else (second, first)
+            x = _other_end(k_edge, a)
+
+            # the face across g_edge takes the side of k_edge the removed face had
+            # (after b becomes a, it walks k_edge in the same direction)
+            other = _other_face(g_edge, face)
+            if other is None:
+                _set_side(k_edge, face, None, None, None)
+            else:
+                next_edge = _next(g_edge, other)
+                prev_edge = _prev(g_edge, other)
+                _set_side(k_edge, face, other, next_edge, prev_edge)
+                _set_prev(next_edge, other, k_edge)
+                _set_next(prev_edge, other, k_edge)
+                if other.edge is g_edge:
+                    other.edge = k_edge
+
+            if mesh.vertices[x].edge is g_edge:
+                mesh.vertices[x].edge = k_edge
+            self._remove_edge(g_edge)
+            del mesh.faces[face.index]
+            del self.face_vertices[face]
+
+        self._remove_edge(edge)
+
+        # every other edge of b now ends at a: new key, and the ends (with the
+        # sides) are swapped when a sorts the other way round than b did
+        for face in b_faces:
+            tri = self.face_vertices.get(face)
+            if tri is not None:
+                tri[tri.index(b)] = a
+        for e in list(self.vertex_edges.pop(b)):
+            del mesh.edges[(e.vertex_start, e.vertex_end)]
+            if e.vertex_start == b:
+                e.vertex_start = a
+            else:
+                e.vertex_end = a
+            if e.vertex_start > e.vertex_end:
+                _flip(e)
+            mesh.edges[(e.vertex_start, e.vertex_end)] = e
+            self.vertex_edges[a].add(e)
+        del mesh.vertices[b]
+
+        vertex = mesh.vertices[a]
+        vertex.edge = next(iter(self.vertex_edges[a]), None)
+        self.pos[a] = point
+        self.pos[b] = None
+        self.quadrics[a] = [x + y for x, y in zip(self.quadrics[a], self.quadrics[b])]
+        self.quadrics[b] = None
+
+        self._push(list(self.vertex_edges[a]))
+
+    def _remove_edge(self, edge):
+        del self.mesh.edges[(edge.vertex_start, edge.vertex_end)]
+        self.vertex_edges[edge.vertex_start].discard(edge)
+        self.vertex_edges[edge.vertex_end].discard(edge)
+        self._forget(edge)
+
+    def run(self, targets):
+        # collapses edges until the mesh has at most targets[i] faces, for every
+        # target (biggest first); yields the number of faces reached for each one
+        for target in sorted(targets, reverse=True):
+            while len(self.mesh.faces) > target and self.heap:
+                _, _, edge, version = heapq.heappop(self.heap)
+                if self.versions.get(edge) != version:
+                    continue
+                point = self.targets[edge]
+                # a refused edge leaves the queue, it comes back when its neighbourhood changes
+                self._forget(edge)
+                if self._can_collapse(edge, point):
+                    self._collapse(edge, point)
+            yield len(self.mesh.faces)
+
+    def export(self, cls):
+        # the current mesh as a new cls, with the vertices and faces numbered from 1 again
+        self.mesh.invalidate_topology()
+        offsets, v_ids = self.mesh.face_vertex_arrays()
+        used, rows = np.unique(v_ids, return_inverse=True)
+        coords = np.array([self.pos[v] for v in used.tolist()], dtype=np.float64).reshape(-1, 3)
+        mesh = cls()
+        mesh.build_from_arrays(coords, offsets, rows.reshape(-1))
+        return mesh
+
+def _best_point(q, pa, pb):
+    # (cost, point) of the cheapest of: the minimum of the quadric q (10 coefficients),
+    # the two ends pa and pb and their middle
+    a11, a12, a13, a14, a22, a23, a24, a33, a34, a44 = q
+    candidates = [pa, pb, [(pa[0] + pb[0]) / 2, (pa[1] + pb[1]) / 2, (pa[2] + pb[2]) / 2]]
+    # 3x3 system of the minimum, by Cramer's rule
+    c1 = a22 * a33 - a23 * a23
+    c2 = a12 * a33 - a23 * a13
+    c3 = a12 * a23 - a22 * a13
+    det = a11 * c1 - a12 * c2 + a13 * c3
+    scale = abs(a11 + a22 + a33) / 3
+    if abs(det) > SINGULAR_TOLERANCE * scale ** 3:
+        r1, r2, r3 = -a14, -a24, -a34
+        x = (r1 * c1 - a12 * (r2 * a33 - a23 * r3) + a13 * (r2 * a23 - a22 * r3)) / det
+        y = (a11 * (r2 * a33 - a23 * r3) - r1 * c2 + a13 * (a12 * r3 - r2 * a13)) / det
+        z = (a11 * (a22 * r3 - r2 * a23) - a12 * (a12 * r3 - r2 * a13) + r1 * c3) / det
+        candidates.append([x, y, z])
+
+    best_cost, best = None, None
+    for x, y, z in candidates:
+        cost = (a11 * x * x + 2 * a12 * x * y + 2 * a13 * x * z + 2 * a14 * x + a22 * y * y
+                + 2 * a23 * y * z + 2 * a24 * y + a33 * z * z + 2 * a34 * z + a44)
+        if best_cost is None or cost < best_cost:
+            best_cost, best = cost, [x, y, z]
+    return max(best_cost, 0.0), best
+
+def _other_end(edge, v_id):
+    return edge.vertex_end if edge.vertex_start == v_id else edge.vertex_start
+
+def _other_face(edge, face):
+    return edge.right_face if edge.left_face is face else edge.left_face
+
+def _next(edge, face):
+    return edge.next_left if edge.left_face is face else edge.next_right
+
+def _prev(edge, face):
+    return edge.prev_left if edge.left_face is face else edge.prev_right
+
+def _set_next(edge, face, value):
+    if edge.left_face is face:
+        edge.next_left = value
+    else:
+        edge.next_right = value
+
+def _set_prev(edge, face, value):
+    if edge.left_face is face:
+        edge.prev_left = value
+    else:
+        edge.prev_right = value
+
+def _set_side(edge, face, new_face, next_edge, prev_edge):
+    # replaces the side of edge that belongs to face
+    if edge.left_face is face:
+        edge.left_face, edge.next_left, edge.prev_left = new_face, next_edge, prev_edge
+    else:
+        edge.right_face, edge.next_right, edge.prev_right = new_face, next_edge, prev_edge
+
+def _flip(edge):
+    # same edge, stored the other way round (the left side becomes the right side)
+    edge.vertex_start, edge.vertex_end = edge.vertex_end, edge.vertex_start
+    edge.left_face, edge.right_face = edge.right_face, edge.left_face
+    edge.next_left, edge.next_right = edge.next_right, edge.next_left
+    edge.prev_left, edge.prev_right = edge.prev_right, edge.prev_left
+
+def _normal(p, q, r):
+    u = (q[0] - p[0], q[1] - p[1], q[2] - p[2])
+    v = (r[0] - p[0], r[1] - p[1], r[2] - p[2])
+    return (u[1] * v[2] - u[2] * v[1], u[2] * v[0] - u[0] * v[2], u[0] * v[1] - u[1] * v[0])
+
+def _dot(u, v):
+    return u[0] * v[0] + u[1] * v[1] + u[2] * v[2]
+
+def _length(u):
+    return _dot(u, u) ** 0.5
+
+def decimate(mesh, target_faces):
+    # a simplified copy of mesh (same class, same model matrix) with at most target_faces
+    # triangles, or as close as the collapses allow; mesh is not changed
+    return build_lod_chain(mesh, targets=[target_faces])[-1]
+
+def build_lod_chain(mesh, levels=3, ratio=LOD_RATIO, min_faces=LOD_MIN_FACES, targets=None):
+    # [mesh, coarser, coarser, ...]: every level keeps about ratio of the faces of the
+    # one before (or the face counts in targets); all of them come from a single run
+    # of the simplifier, a level is saved each time its face count is reached
+    if targets is None:
+        targets = []
+        n_faces = len(mesh.faces)
+        for _ in range(levels):
+            n_faces = int(n_faces * ratio)
+            if n_faces < min_faces:
+                break
+            targets.append(n_faces)
+    if not targets:
+        return [mesh]
+
+    chain = [mesh]
+    with profiling.timed('lod.build'):
+        decimator = _Decimator(mesh)
+        for _ in decimator.run(targets):
+            level = decimator.export(type(mesh))
+            level.model_matrix = mesh.model_matrix.copy()
+            chain.append(level)
+    return chain
+
+class LodChain:
+    # the levels of build_lod_chain and the choice between them
+    # every level shares the placement of the first one (its model matrix is the one used)
+
+    def __init__(self, mesh, levels=3, ratio=LOD_RATIO):
+        self.levels = build_lod_chain(mesh, levels, ratio)
+        coords = mesh.coords_array()
+        # box of the full mesh, the levels stay inside it (roughly)
+        self.bounds = np.stack([coords.min(axis=0), coords.max(axis=0)]) if len(coords) else np.zeros((2, 3))
+        self.current = 0
+
+    def select(self, screen_area):
+        # the finest level with at least LOD_PIXELS_PER_FACE pixels per face, or the coarsest
+        for i, level in enumerate(self.levels):
+            if len(level.faces) * LOD_PIXELS_PER_FACE <= screen_area:
+                self.current = i
+                return level
+        self.current = len(self.levels) - 1
+        return self.levels[-1]
+
+    def screen_area(self, project):
+        # area in pixels of the screen box around the projected bounding box of the mesh
+        # (project maps an (N, 3) array to (N, 2) screen positions)
+        corners = np.array(np.meshgrid(*self.bounds.T)).reshape(3, -1).T
+        points = project(corners)
+        if not np.isfinite(points).all():
+            # a corner is behind the eye: the mesh is too close for anything but the finest level
+            return float('inf')
+        width, height = np.ptp(points, axis=0)
+        return float(width * height)
+
+class LodBuilder:
+    # builds a LodChain on a worker thread, like mesh_cache.MeshLoader: the collapses run
+    # one by one in Python (a few seconds per 100k faces), so the caller keeps drawing the
+    # full mesh meanwhile; on_done (if given) is called from the worker once chain or
+    # error is set
+
+    def __init__(self, mesh, levels=3, ratio=LOD_RATIO, on_done=None):
+        self.mesh = mesh
+        self.chain = None
+        self.error = None
+        self._on_done = on_done
+        # daemon: closing the viewer doesn't wait for the levels
+        self._thread = threading.Thread(target=self._run, args=(levels, ratio), daemon=True)
+        self._thread.start()
+
+    def _run(self, levels, ratio):
+        try:
+            self.chain = LodChain(self.mesh, levels, ratio)
+        except Exception as e:
+            self.error = e
+        if self._on_done is not None:
+            self._on_done()
+
+    def done(self):
+        return not self._thread.is_alive()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Simplify a mesh with quadric error edge collapses.")
+    parser.add_argument('input', help="mesh file to simplify (.obj, .obj.gz, .ply or .stl)")
+    parser.add_argument('output', help="where to save the result (format picked by the extension)")
+    parser.add_argument('--faces', type=int, required=True, help="number of triangles to keep")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    mesh = load_mesh(args.input, compact=True)
+    print(f"Loaded '{args.input}'. Faces: {len(mesh.faces)}")
+    result = decimate(mesh, args.faces)
+    print(f"Simplified to {len(result.faces)} faces, {len(result.vertices)} vertices.")
+    save_mesh(result, args.output)
+
+if __name__ == '__main__':
+    main()
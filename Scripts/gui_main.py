@@ -1,12 +1,23 @@
 import pygame
 import sys
 import os
+import time
+import atexit
+import argparse
 import numpy as np
-import copy
 
 # using the same functions from the old main.py file
-from winged_edge import EdgeMesh, save_mesh_to_obj
+from winged_edge import save_mesh, mesh_format
+from mesh_cache import MeshLoader
 import transformations as transform
+import render
+from scene import Scene
+from history import MeshHistory
+import profiling
+from picking import Picker, pick_adjacency
+from decimation import LodBuilder
+from camera import OrbitCamera
+from raster import FaceRenderer
 
 # window configuration
 SCREEN_WIDTH, SCREEN_HEIGHT = 1200, 800
@@ -20,6 +31,27 @@ BUTTON_COLOR = (70, 70, 90)
 BUTTON_HOVER_COLOR = (100, 100, 120)
 INPUT_ACTIVE_COLOR = (200, 200, 200)
 INPUT_INACTIVE_COLOR = (150, 150, 150)
+# highest frame rate while something keeps changing, the viewer sleeps when idle
+MAX_FPS = 60
+# pixels per unit of the orthographic projection (for a single copy of the mesh)
+VIEW_SCALE = 200
+# filled faces mode (F4) and perspective projection (F5); Home puts the camera back
+FILL_KEY = pygame.K_F4
+PERSPECTIVE_KEY = pygame.K_F5
+RESET_VIEW_KEY = pygame.K_HOME
+FACE_COLOR = (170, 180, 200)
+# performance overlay (F3), drawn in the top-left corner of the viewport
+HUD_KEY = pygame.K_F3
+HUD_BACKGROUND = (0, 0, 0, 170)
+# the picked vertex, edge or face is drawn over the mesh in this color
+SELECTION_COLOR = (255, 170, 40)
+# while a file loads: its vertices are drawn as points, under a progress bar
+POINT_COLOR = (140, 200, 255)
+PROGRESS_COLOR = (90, 160, 230)
+# frame rate of the loading screen, the rest of the time goes to the loading thread
+LOADING_FPS = 30
+# posted by the thread that builds the levels of detail when they are ready
+LOD_READY_EVENT = pygame.USEREVENT + 1
 
 class Button:
 
@@ -39,7 +71,10 @@ class Button:
         surface.blit(text_surf, text_rect)
 
     def check_hover(self, mouse_pos):
-        self.is_hovered = self.rect.collidepoint(mouse_pos)
+        # returns True when the hover state changed (so the button must be redrawn)
+        was_hovered = self.is_hovered
+        self.is_hovered = bool(self.rect.collidepoint(mouse_pos))
+        return was_hovered != self.is_hovered
 
     def is_clicked(self, event):
         return event.type == pygame.MOUSEBUTTONDOWN and event.button == 1 and self.is_hovered
@@ -55,7 +90,10 @@ class InputBox:
         self.active = False
 
     def handle_event(self, event):
+        # returns True when the box looks different (so it must be redrawn)
+        changed = False
         if event.type == pygame.MOUSEBUTTONDOWN:
+            was_active = self.active
             # validates if the user clicked in the box
             if self.rect.collidepoint(event.pos):
                 self.active = not self.active
@@ -63,6 +101,7 @@ class InputBox:
                 self.active = False
             # change the box color if so
             self.color = INPUT_ACTIVE_COLOR if self.active else INPUT_INACTIVE_COLOR
+            changed = was_active != self.active
         
         if event.type == pygame.KEYDOWN:
             if self.active:
@@ -76,21 +115,14 @@ class InputBox:
                     self.text += event.unicode
                 # and then renders the new text
                 self.text_surface = self.font.render(self.text, True, TEXT_COLOR)
+                changed = True
+        return changed
 
     def draw(self, screen):
         # draw the box for the input
         screen.blit(self.text_surface, (self.rect.x + 5, self.rect.y + 5))
         pygame.draw.rect(screen, self.color, self.rect, 2, border_radius=3)
 
-def project_orthographic(coords_3d, scale, offset):
-    # we need 3d coordinates to project in the 2d space
-    # so that we can show in the window
-    x, y, z = coords_3d
-    # the Y axis is inverted in pygame applications (-y)
-    x_proj = x * scale + offset[0]
-    y_proj = -y * scale + offset[1]
-    return int(x_proj), int(y_proj)
-
 def apply_transformation_to_mesh(mesh_obj, transformation_matrix):
     if not mesh_obj or transformation_matrix is None:
         return
@@ -99,15 +131,213 @@ def apply_transformation_to_mesh(mesh_obj, transformation_matrix):
     print(transformation_matrix)
     print("-----------------------\n\n")
     
-    # and this is the logic for the transformation matrix coordinates extraction
-    for vertex in mesh_obj.vertices.values():
-        original_coord = np.array([*vertex.coord, 1.0])
-        transformed_coord = transformation_matrix @ original_coord
-        w = transformed_coord[3]
-        if w != 0:
-            vertex.coord = (transformed_coord[0] / w, transformed_coord[1] / w, transformed_coord[2] / w)
+    # the vertices are not touched here: the matrix goes into the model matrix of
+    # the mesh, which is applied while drawing and when the mesh is saved
+    mesh_obj.apply_model_transform(transformation_matrix)
+
+def draw_hud(surface, font, lines):
+    # text lines on a translucent box, on top of whatever was drawn in the viewport
+    line_h = font.get_linesize()
+    width = max(font.size(line)[0] for line in lines) + 20
+    box = pygame.Surface((width, len(lines) * line_h + 10), pygame.SRCALPHA)
+    box.fill(HUD_BACKGROUND)
+    surface.blit(box, (10, 10))
+    for i, line in enumerate(lines):
+        surface.blit(font.render(line, True, TEXT_COLOR), (20, 15 + i * line_h))
+
+def hud_lines(frame_ms, project_ms, draw_ms, edges, last_op, mesh_name, lod=None, triangles=None):
+    # triangles: the number drawn in the filled mode, shown instead of the edges
+    lines = [
+        f"Frame: {frame_ms:.1f} ms (projection {project_ms:.1f} ms, drawing {draw_ms:.1f} ms)",
+        f"Edges drawn: {edges}" if triangles is None else f"Triangles drawn: {triangles}",
+    ]
+    if lod is not None:
+        lines.append(f"Level of detail: {lod.current} of {len(lod.levels) - 1} ({len(lod.levels[lod.current].faces)} faces)")
+    if last_op:
+        # no time when profiling was off while the operation ran (F3 turns it on)
+        ms = profiling.last_ms('op.' + last_op)
+        lines.append(f"Last operation: {last_op} {ms:.2f} ms" if ms is not None else f"Last operation: {last_op} -")
+    else:
+        lines.append("Last operation: -")
+    reading = profiling.memory.get(f"mesh {mesh_name}")
+    if reading:
+        lines.append(f"Mesh memory: {reading['kept_mb']:.1f} MB (peak {reading['peak_mb']:.1f} MB)")
+    lines.append("F3: hide, F4: faces, F5: perspective, Home: reset view")
+    return lines
+
+def selection_title(pick):
+    if pick.kind == 'vertex':
+        return f"Vertex {pick.key}"
+    if pick.kind == 'edge':
+        return f"Edge ({pick.key[0]}-{pick.key[1]})"
+    return f"Face {pick.key}"
+
+def fit_text(font, text, width):
+    # cuts the text with "..." so it fits in width pixels
+    if font.size(text)[0] <= width:
+        return text
+    while text and font.size(text + "...")[0] > width:
+        text = text[:-1]
+    return text + "..."
+
+def draw_selection(surface, pick, projection):
+    # the picked element of the picked instance, on top of the mesh
+    mesh = pick.mesh
+    world = pick.instance.model_matrix @ mesh.model_matrix
+    if pick.kind == 'face':
+        v_ids = mesh.face_vertex_ids(pick.key)
+    else:
+        v_ids = [pick.key] if pick.kind == 'vertex' else list(pick.key)
+    points = render.project_array(mesh.coords_array()[mesh.vertex_rows(v_ids)], projection, world)
+    if not np.isfinite(points).all():
+        return
+    points = points.tolist()
+    if pick.kind == 'vertex':
+        pygame.draw.circle(surface, SELECTION_COLOR, points[0], 5)
+    elif pick.kind == 'edge':
+        pygame.draw.line(surface, SELECTION_COLOR, points[0], points[1], 3)
+    else:
+        pygame.draw.polygon(surface, SELECTION_COLOR, points, 3)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="View and transform a mesh loaded from an .obj, .ply or .stl file.")
+    parser.add_argument('file', nargs='?', default=None,
+                        help="mesh file to open (default: choose one of the files in Objects in the window)")
+    parser.add_argument('--instances', type=int, default=1,
+                        help="show this many copies of the mesh in a grid, all sharing the same geometry (default: 1)")
+    parser.add_argument('--spacing', type=float, default=None,
+                        help="distance between the copies (default: 1.5x the size of the mesh)")
+    parser.add_argument('--profile', metavar='FILE', default=None,
+                        help="time loading, transformations and drawing, and save the profile to FILE (JSON) on exit; "
+                             "F3 shows the numbers in the viewer")
+    parser.add_argument('--trace-memory', action='store_true',
+                        help="with --profile, also measure the memory used by the mesh (slower loading)")
+    parser.add_argument('--lod', type=int, default=0, metavar='N',
+                        help="build N simplified versions of the mesh and draw the one that fits its size on "
+                             "screen (default: 0, always the full mesh); they are built in the background, "
+                             "at a few seconds per 100k faces, and the full mesh is drawn until then")
+    parser.add_argument('--perspective', action='store_true',
+                        help="start with the perspective projection instead of the orthographic one (F5 switches)")
+    parser.add_argument('--filled', action='store_true',
+                        help="start drawing shaded faces instead of the wireframe (F4 switches)")
+    return parser.parse_args()
+
+def choose_file(screen, clock, font_title, font, obj_files):
+    # one button per file in the viewport, returns the chosen one (None if the window is closed)
+    screen.fill(BACKGROUND_COLOR)
+    screen.fill(PANEL_COLOR, (VIEWPORT_WIDTH, 0, GUI_WIDTH, SCREEN_HEIGHT))
+    screen.blit(font_title.render("Choose a file to visualize", True, TEXT_COLOR), (40, 40))
+    # as many files as fit in the window, the others can still be opened from the command line
+    rows = obj_files[:(SCREEN_HEIGHT - 100) // 45]
+    file_buttons = [Button((40, 90 + i * 45, VIEWPORT_WIDTH - 80, 35), filename, font)
+                    for i, filename in enumerate(rows)]
+    for btn in file_buttons:
+        btn.draw(screen)
+    pygame.display.flip()
+
+    while True:
+        for event in [pygame.event.wait()] + pygame.event.get():
+            if event.type == pygame.QUIT:
+                return None
+            if event.type in (pygame.MOUSEMOTION, pygame.MOUSEBUTTONDOWN):
+                for btn in file_buttons:
+                    if btn.check_hover(event.pos):
+                        screen.fill(BACKGROUND_COLOR, btn.rect)
+                        btn.draw(screen)
+                        pygame.display.update(btn.rect)
+                for btn in file_buttons:
+                    if btn.is_clicked(event):
+                        return btn.text
+        clock.tick(MAX_FPS)
+
+def draw_points(surface, coords, projection, color, clip_rect):
+    # one pixel per point, for the vertices of a mesh that is still loading
+    points = render.project_array(coords, projection)
+    with np.errstate(invalid='ignore'):
+        x, y = np.floor(points).T
+        inside = (x >= clip_rect.left) & (x < clip_rect.right) & (y >= clip_rect.top) & (y < clip_rect.bottom)
+    pixels = pygame.surfarray.pixels2d(surface)
+    pixels[x[inside].astype(np.int64), y[inside].astype(np.int64)] = surface.map_rgb(color)
+    # the surface stays locked while the pixel array exists
+    del pixels
+
+def draw_progress(surface, font, progress, rect, frame):
+    # a bar with the stage of the load; stages that can't tell how far they are
+    # get a block that keeps moving instead
+    labels = {'cache': "Reading the cache", 'parse': "Reading the file", 'topology': "Linking the faces",
+              'cache write': "Writing the cache", 'done': "Done"}
+    label = labels.get(progress.stage, progress.stage)
+    pygame.draw.rect(surface, PANEL_COLOR, rect, border_radius=5)
+    inner = rect.inflate(-6, -6)
+    if progress.fraction is None:
+        block = inner.width // 5
+        x = (frame * 8) % (inner.width + block) - block
+        bar = pygame.Rect(inner.left + x, inner.top, block, inner.height).clip(inner)
+    else:
+        label += f" {100 * progress.fraction:.0f}%"
+        bar = pygame.Rect(inner.left, inner.top, int(inner.width * progress.fraction), inner.height)
+    pygame.draw.rect(surface, PROGRESS_COLOR, bar, border_radius=3)
+    text = font.render(label, True, TEXT_COLOR)
+    surface.blit(text, text.get_rect(center=rect.center))
+
+def load_in_background(screen, clock, font, obj_path, camera, viewport):
+    # loads the mesh on a worker thread and keeps the window alive meanwhile:
+    # a progress bar, and the vertices as soon as they are read (the camera already
+    # orbits, pans and zooms); returns the loader once it is done, None if the window is closed
+    loader = MeshLoader(obj_path, compact=True)
+    bar = pygame.Rect(40, SCREEN_HEIGHT - 70, VIEWPORT_WIDTH - 80, 30)
+    screen.fill(PANEL_COLOR, (VIEWPORT_WIDTH, 0, GUI_WIDTH, SCREEN_HEIGHT))
+    title = fit_text(font, f"Loading {os.path.basename(obj_path)}", GUI_WIDTH - 30)
+    screen.blit(font.render(title, True, TEXT_COLOR), (VIEWPORT_WIDTH + 15, 20))
+    # the points are drawn once into their own layer, only the blocks read since the
+    # last frame are added to it (all of them again when the camera moves), so the
+    # loading thread isn't slowed down by drawing
+    # (the viewport is the top-left part of the window, so the layer has screen coordinates)
+    cloud = pygame.Surface(viewport.size)
+    cloud.fill(BACKGROUND_COLOR)
+    cloud_projection = None
+    n_drawn = 0
+    frame = 0
+    while not loader.done():
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                return None
+            if event.type == pygame.MOUSEMOTION and event.pos[0] < VIEWPORT_WIDTH and (event.buttons[1] or event.buttons[2]):
+                dx, dy = event.rel
+                if event.buttons[1] or pygame.key.get_mods() & pygame.KMOD_SHIFT:
+                    camera.pan(dx, dy)
+                else:
+                    camera.orbit(dx, dy)
+            if event.type == pygame.MOUSEWHEEL and pygame.mouse.get_pos()[0] < VIEWPORT_WIDTH:
+                camera.zoom(event.y)
+
+        projection = camera.matrix()
+        if cloud_projection is None or not np.array_equal(projection, cloud_projection):
+            cloud.fill(BACKGROUND_COLOR)
+            cloud_projection = projection
+            n_drawn = 0
+        # the list can grow on the other thread while it is drawn, a copy is taken first
+        blocks = list(loader.progress.vertex_blocks)
+        if len(blocks) < n_drawn:
+            # the blocks were joined into one array once the file was read
+            n_drawn = 0
+            cloud.fill(BACKGROUND_COLOR)
+        for vertices in blocks[n_drawn:]:
+            draw_points(cloud, vertices, projection, POINT_COLOR, cloud.get_rect())
+        n_drawn = len(blocks)
+        screen.blit(cloud, viewport)
+        draw_progress(screen, font, loader.progress, bar, frame)
+        pygame.display.flip()
+        frame += 1
+        clock.tick(LOADING_FPS)
+    return loader
 
 def main():
+    args = parse_args()
+    if args.profile:
+        profiling.enable(trace_memory=args.trace_memory)
+        atexit.register(profiling.dump, args.profile)
+
     # start pygame
     pygame.init()
     screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
@@ -116,57 +346,77 @@ def main():
     font_small = pygame.font.SysFont("Arial", 16)
     font_large = pygame.font.SysFont("Arial", 20, bold=True)
     font_label = pygame.font.SysFont("Arial", 18, bold=True)
+    font_info = pygame.font.SysFont("Arial", 14)
 
-    # start the reading for .obj files in /Objects
-    obj_path = None
-    mesh = None
-    
-    # search and list every .obj file
-    try:
+    # the file comes from the command line, or is chosen in the window
+    # among the mesh files in /Objects
+    obj_path = args.file
+    if obj_path is None:
         objects_dir = "Objects"
         if not os.path.isdir(objects_dir):
             print(f"Error: Directory '{objects_dir}' not found.\nClosing")
             pygame.quit()
             sys.exit()
 
-        # create a list with every file in the directory that ends with .;bj
-        obj_files = [f for f 
-                    in os.listdir(objects_dir) 
-                    if f.endswith('.obj')]
+        # create a list with every mesh file in the directory (.obj, .obj.gz, .ply, .stl)
+        obj_files = sorted(f for f
+                           in os.listdir(objects_dir)
+                           if mesh_format(f))
 
         if not obj_files:
-            print(f"No .obj file was found in '{objects_dir}'.\nClosing")
+            print(f"No mesh file was found in '{objects_dir}'.\nClosing")
             pygame.quit()
             sys.exit()
 
-        # if files were found, we ask for a selection
-        print("Please choose one file to visualize")
-        for i, filename in enumerate(obj_files):
-            print(f"  {i + 1}: {filename}")
-
-        while True:
-            try:
-                choice = int(input("Input the number for the file "))
-                if 1 <= choice <= len(obj_files):
-                    chosen_file = obj_files[choice - 1]
-                    obj_path = os.path.join(objects_dir, chosen_file)
-                    break
-                else:
-                    print("Wrong value, please input a value in the list.")
-            except ValueError:
-                print("Please use only numbers.")
-
-    except Exception as e:
-        print(f"There was an error while trying to load {e}")
-        pygame.quit()
-        sys.exit()
+        chosen_file = choose_file(screen, clock, font_large, font_small, obj_files)
+        if chosen_file is None:
+            pygame.quit()
+            sys.exit()
+        obj_path = os.path.join(objects_dir, chosen_file)
+
+    # the camera starts with the view the viewer always had: orthographic, looking
+    # down -Z at the origin; right drag orbits, middle (or Shift + right) drag pans
+    # and the mouse wheel zooms
+    # (it is made before loading: the vertices are shown while the faces are linked)
+    projection_offset = (VIEWPORT_WIDTH / 2, SCREEN_HEIGHT / 2)
+    view_scale = VIEW_SCALE / np.ceil(np.sqrt(max(args.instances, 1)))
+    camera = OrbitCamera(view_scale, projection_offset, perspective=args.perspective)
+    # edges are culled and clipped to the viewport, nothing is drawn under the panel
+    viewport = pygame.Rect(0, 0, VIEWPORT_WIDTH, SCREEN_HEIGHT)
 
     # if an object was successfully choosed
     try:
-        mesh = EdgeMesh()
-        mesh.load_obj(obj_path)
-        # we create a copy of the original mesh for the "reset" option
-        original_mesh = copy.deepcopy(mesh) 
+        # parsed once, later launches map the binary cache in .mesh_cache
+        # the viewer keeps the mesh in arrays, that's what the renderer works with
+        # the file is read on a worker thread, the window shows how far it got
+        loader = load_in_background(screen, clock, font_small, obj_path, camera, viewport)
+        if loader is None:
+            pygame.quit()
+            sys.exit()
+        if loader.error is not None:
+            raise loader.error
+        mesh = loader.mesh
+        # undo/redo and the "reset" option only keep the coordinates and the model
+        # matrix of every step, the topology is shared instead of deep-copied
+        history = MeshHistory(mesh)
+        # every copy is an instance of the same mesh with its own placement,
+        # transformations are applied to the mesh so all copies follow them
+        scene = Scene()
+        if args.instances > 1:
+            scene.add_grid(mesh, args.instances, args.spacing)
+        else:
+            scene.add_instance(mesh)
+        # click-to-pick, the bounding volume hierarchy is built on the first click
+        picker = Picker(scene)
+        # simplified copies of every mesh, only for drawing: picking, transformations
+        # and saving always use the full mesh
+        # they are built on worker threads, every mesh is drawn in full until its levels are ready
+        lods = {}
+        lod_builders = []
+        if args.lod > 0:
+            def lod_ready():
+                pygame.event.post(pygame.event.Event(LOD_READY_EVENT))
+            lod_builders = [LodBuilder(scene_mesh, args.lod, on_done=lod_ready) for scene_mesh in scene.meshes()]
         print(f"Mesh '{obj_path}' loaded. Starting GUI.")
     except Exception as e:
         print(f"There was an error loading '{obj_path}': {e}")
@@ -180,67 +430,182 @@ def main():
     input_w, input_h = 100, 30
     label_w = 40
 
-    # for every section we create a new screen.blit() with the respected title:
+    # the panel background and every label never change, so they are rendered
+    # once in this surface and only blitted after that
+    panel_x = SCREEN_WIDTH - GUI_WIDTH
+    panel = pygame.Surface((GUI_WIDTH, SCREEN_HEIGHT))
+    panel.fill(PANEL_COLOR)
+    label_x = start_x - panel_x
+
+    # for every section we create a new panel.blit() with the respected title:
     
     # translation
     y_pos += 20
-    screen.blit(font_label.render("Translation", True, TEXT_COLOR), (start_x, y_pos))
+    panel.blit(font_label.render("Translation", True, TEXT_COLOR), (label_x, y_pos))
     y_pos += 30
     for i, axis in enumerate(['X', 'Y', 'Z']):
-        screen.blit(font_small.render(f"{axis}:", True, TEXT_COLOR), (start_x, y_pos + 5))
+        panel.blit(font_small.render(f"{axis}:", True, TEXT_COLOR), (label_x, y_pos + 5))
         box = InputBox((start_x + label_w, y_pos, input_w, input_h), font_small, '0.0')
         input_boxes[f'translate_{axis.lower()}'] = box
         y_pos += 40
     buttons['translate'] = Button((start_x, y_pos, 220, 35), "Apply translation", font_small)
-    y_pos += 60
+    y_pos += 50
 
     # rotation
-    screen.blit(font_label.render("Rotation (in degrees)", True, TEXT_COLOR), (start_x, y_pos))
+    panel.blit(font_label.render("Rotation (in degrees)", True, TEXT_COLOR), (label_x, y_pos))
     y_pos += 30
     for i, axis in enumerate(['X', 'Y', 'Z']):
-        screen.blit(font_small.render(f"Axis {axis}:", True, TEXT_COLOR), (start_x, y_pos + 5))
+        panel.blit(font_small.render(f"Axis {axis}:", True, TEXT_COLOR), (label_x, y_pos + 5))
         box = InputBox((start_x + label_w + 20, y_pos, input_w, input_h), font_small, '0.0')
         input_boxes[f'rotate_{axis.lower()}'] = box
         y_pos += 40
     buttons['rotate'] = Button((start_x, y_pos, 220, 35), "Apply rotation", font_small)
-    y_pos += 60
+    y_pos += 50
 
     # scale
-    screen.blit(font_label.render("Scale", True, TEXT_COLOR), (start_x, y_pos))
+    panel.blit(font_label.render("Scale", True, TEXT_COLOR), (label_x, y_pos))
     y_pos += 30
     for i, axis in enumerate(['X', 'Y', 'Z']):
-        screen.blit(font_small.render(f"Axis {axis}:", True, TEXT_COLOR), (start_x, y_pos + 5))
+        panel.blit(font_small.render(f"Axis {axis}:", True, TEXT_COLOR), (label_x, y_pos + 5))
         box = InputBox((start_x + label_w, y_pos, input_w, input_h), font_small, '1.0')
         input_boxes[f'scale_{axis.lower()}'] = box
         y_pos += 40
     buttons['scale'] = Button((start_x, y_pos, 220, 35), "Apply scale", font_small)
 
     # control buttons
-    reset_btn = Button((start_x, SCREEN_HEIGHT - 110, 220, 35), "Reset position", font_small)
-    save_btn = Button((start_x, SCREEN_HEIGHT - 60, 220, 35), "Save to .obj", font_small)
+    undo_btn = Button((start_x, SCREEN_HEIGHT - 135, 105, 35), "Undo", font_small)
+    redo_btn = Button((start_x + 115, SCREEN_HEIGHT - 135, 105, 35), "Redo", font_small)
+    reset_btn = Button((start_x, SCREEN_HEIGHT - 90, 220, 35), "Reset position", font_small)
+    save_btn = Button((start_x, SCREEN_HEIGHT - 45, 220, 35), "Save file", font_small)
+
+    buttons_all = list(buttons.values()) + [undo_btn, redo_btn, reset_btn, save_btn]
+    widgets = list(input_boxes.values()) + buttons_all
+
+    def redraw_widget(widget):
+        # puts the panel background back under the widget and draws it again
+        screen.blit(panel, widget.rect, widget.rect.move(-panel_x, 0))
+        widget.draw(screen)
+        dirty_rects.append(widget.rect)
 
     # main loop
+    # nothing is drawn unless something changed: needs_redraw repaints the whole
+    # window (mesh changes), dirty_rects only updates the widgets that changed
     running = True
+    needs_redraw = True
+    dirty_rects = []
+    show_hud = False
+    last_op = None
+    mesh_name = os.path.basename(obj_path)
+    selection = None
+
+    filled = args.filled
+    face_renderer = FaceRenderer()
     while running:
-        mouse_pos = pygame.mouse.get_pos()
+        if needs_redraw:
+            events = pygame.event.get()
+        else:
+            # idle: sleep until the next event instead of spinning at 60 Hz
+            events = [pygame.event.wait()] + pygame.event.get()
         
         # event manager for clicks and inputs
-        for event in pygame.event.get():
+        for event in events:
             if event.type == pygame.QUIT:
                 running = False
+
+            if event.type in (pygame.VIDEOEXPOSE, pygame.WINDOWEXPOSED, pygame.WINDOWSIZECHANGED):
+                needs_redraw = True
+
+            if event.type == LOD_READY_EVENT:
+                for builder in [b for b in lod_builders if b.done()]:
+                    lod_builders.remove(builder)
+                    if builder.error is not None:
+                        print(f"Warning: could not build the levels of detail: {builder.error}")
+                        continue
+                    lods[id(builder.mesh)] = builder.chain
+                    print(f"Levels of detail: {[len(level.faces) for level in builder.chain.levels]} faces")
+                needs_redraw = True
+
+            if event.type in (pygame.MOUSEMOTION, pygame.MOUSEBUTTONDOWN):
+                for btn in buttons_all:
+                    if btn.check_hover(event.pos):
+                        redraw_widget(btn)
             
+            # Ctrl+Z undo, Ctrl+Y or Ctrl+Shift+Z redo (not typed in the input boxes)
+            shortcut = None
+            if event.type == pygame.KEYDOWN and event.mod & pygame.KMOD_CTRL:
+                if event.key == pygame.K_z:
+                    shortcut = 'redo' if event.mod & pygame.KMOD_SHIFT else 'undo'
+                elif event.key == pygame.K_y:
+                    shortcut = 'redo'
+                else:
+                    shortcut = 'ignored'
+            elif event.type == pygame.KEYDOWN and event.key == HUD_KEY:
+                shortcut = 'hud'
+            elif event.type == pygame.KEYDOWN and event.key in (FILL_KEY, PERSPECTIVE_KEY, RESET_VIEW_KEY):
+                shortcut = 'view'
+                if event.key == FILL_KEY:
+                    filled = not filled
+                elif event.key == PERSPECTIVE_KEY:
+                    camera.perspective = not camera.perspective
+                else:
+                    camera = OrbitCamera(view_scale, projection_offset, perspective=camera.perspective)
+                needs_redraw = True
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE:
+                shortcut = 'ignored'
+                if selection is not None:
+                    selection = None
+                    needs_redraw = True
+
+            if shortcut == 'hud':
+                # the overlay turns profiling on, numbers are collected from then on
+                show_hud = not show_hud
+                if show_hud and not profiling.is_enabled():
+                    profiling.enable()
+                needs_redraw = True
+
             # check for clicks in the input_boxes
             for box in input_boxes.values():
-                box.handle_event(event)
+                if shortcut:
+                    break
+                if box.handle_event(event):
+                    redraw_widget(box)
             
+            # the camera follows the mouse while a button is held over the viewport
+            if event.type == pygame.MOUSEMOTION and event.pos[0] < VIEWPORT_WIDTH and (event.buttons[1] or event.buttons[2]):
+                dx, dy = event.rel
+                if event.buttons[1] or pygame.key.get_mods() & pygame.KMOD_SHIFT:
+                    camera.pan(dx, dy)
+                else:
+                    camera.orbit(dx, dy)
+                needs_redraw = True
+            if event.type == pygame.MOUSEWHEEL and pygame.mouse.get_pos()[0] < VIEWPORT_WIDTH:
+                camera.zoom(event.y)
+                needs_redraw = True
+
+            # a click in the viewport picks the vertex, edge or face under the cursor
+            if event.type == pygame.MOUSEBUTTONDOWN and event.button == 1 and event.pos[0] < VIEWPORT_WIDTH:
+                with profiling.timed('op.pick'):
+                    selection = picker.pick(event.pos, camera.matrix())
+                last_op = 'pick'
+                needs_redraw = True
+                if selection is not None:
+                    # same answers as the queries in main.py
+                    print(selection_title(selection))
+                    for label, values in pick_adjacency(selection):
+                        print(f"  {label}: {values}")
+
             # logic behind the apply buttons
             if buttons['translate'].is_clicked(event):
                 try:
                     tx = float(input_boxes['translate_x'].text or 0.0)
                     ty = float(input_boxes['translate_y'].text or 0.0)
                     tz = float(input_boxes['translate_z'].text or 0.0)
-                    matrix = transform.build_transformation_matrix([('translate', tx, ty, tz)])
-                    apply_transformation_to_mesh(mesh, matrix)
+                    with profiling.timed('op.translate'):
+                        matrix = transform.build_transformation_matrix([('translate', tx, ty, tz)])
+                        apply_transformation_to_mesh(mesh, matrix)
+                        history.record()
+                    last_op = 'translate'
+                    needs_redraw = True
                 except ValueError:
                     print("Error: invalid value. Use only numbers.")
 
@@ -257,8 +622,12 @@ def main():
                     if rz != 0: transforms.append(('rotateZ', rz))
 
                     if transforms:
-                        matrix = transform.build_transformation_matrix(transforms)
-                        apply_transformation_to_mesh(mesh, matrix)
+                        with profiling.timed('op.rotate'):
+                            matrix = transform.build_transformation_matrix(transforms)
+                            apply_transformation_to_mesh(mesh, matrix)
+                            history.record()
+                        last_op = 'rotate'
+                        needs_redraw = True
 
                 except ValueError:
                     print("Error: invalid value. Use only numbers.")
@@ -268,61 +637,121 @@ def main():
                     sx = float(input_boxes['scale_x'].text or 1.0)
                     sy = float(input_boxes['scale_y'].text or 1.0)
                     sz = float(input_boxes['scale_z'].text or 1.0)
-                    matrix = transform.build_transformation_matrix([('scale', sx, sy, sz)])
-                    apply_transformation_to_mesh(mesh, matrix)
+                    with profiling.timed('op.scale'):
+                        matrix = transform.build_transformation_matrix([('scale', sx, sy, sz)])
+                        apply_transformation_to_mesh(mesh, matrix)
+                        history.record()
+                    last_op = 'scale'
+                    needs_redraw = True
                 except ValueError:
                     print("Error: invalid value. Use only numbers.")
 
             # this checks for control buttons usage
+            if undo_btn.is_clicked(event) or shortcut == 'undo':
+                with profiling.timed('op.undo'):
+                    undone = history.undo()
+                if undone:
+                    last_op = 'undo'
+                    needs_redraw = True
+                else:
+                    print("Nothing to undo.")
+
+            if redo_btn.is_clicked(event) or shortcut == 'redo':
+                with profiling.timed('op.redo'):
+                    redone = history.redo()
+                if redone:
+                    last_op = 'redo'
+                    needs_redraw = True
+                else:
+                    print("Nothing to redo.")
+
             if reset_btn.is_clicked(event):
-                mesh = copy.deepcopy(original_mesh)
+                with profiling.timed('op.reset'):
+                    history.reset()
+                last_op = 'reset'
+                needs_redraw = True
                 print("Reseted.")
 
             if save_btn.is_clicked(event):
                 try:
-                    save_mesh_to_obj(mesh, obj_path)
+                    # same format as the loaded file, by extension
+                    with profiling.timed('op.save'):
+                        save_mesh(mesh, obj_path)
+                    last_op = 'save'
                     print(f"Saved in '{obj_path}'")
                 except Exception as e:
                     print(f"Error while saving: {e}")
 
-        # screen.fill is used to create the start screen
-        screen.fill(BACKGROUND_COLOR)
-        pygame.draw.rect(screen, PANEL_COLOR, (SCREEN_WIDTH - GUI_WIDTH, 0, GUI_WIDTH, SCREEN_HEIGHT))
-        
-        # draw every section name
-        y_pos_draw = 50
-        y_pos_draw += 20
-        screen.blit(font_label.render("Translation", True, TEXT_COLOR), (start_x, y_pos_draw))
-        y_pos_draw += 150
-        screen.blit(font_label.render("Rotation (degrees)", True, TEXT_COLOR), (start_x, y_pos_draw))
-        y_pos_draw += 180
-        screen.blit(font_label.render("Scale", True, TEXT_COLOR), (start_x, y_pos_draw))
-        
-        # draw every box and button
-        for box in input_boxes.values():
-            box.draw(screen)
-        for btn in buttons.values():
-            btn.check_hover(mouse_pos)
-            btn.draw(screen)
-        # draw the control buttons
-        reset_btn.check_hover(mouse_pos)
-        reset_btn.draw(screen)
-        save_btn.check_hover(mouse_pos)
-        save_btn.draw(screen)
-
-        # and here we translate the 3d object to a 2d viewport
-        projection_offset = (VIEWPORT_WIDTH / 2, SCREEN_HEIGHT / 2)
-        for edge in mesh.edges.values():
-            v_start_coords = mesh.vertices[edge.vertex_start].coord
-            v_end_coords = mesh.vertices[edge.vertex_end].coord
-            p_start = project_orthographic(v_start_coords, 200, projection_offset)
-            p_end = project_orthographic(v_end_coords, 200, projection_offset)
-            pygame.draw.line(screen, LINE_COLOR, p_start, p_end, 1)
-
-        # this step is used to update the screen at 60 hertz
-        # and probably theres a better way to do it 
-        pygame.display.flip()
-        clock.tick(60)
+        if needs_redraw:
+            frame_start = time.perf_counter()
+            project_before = profiling.total_ms('render.project')
+            draw_before = profiling.total_ms('render.draw')
+            edges_before = profiling.counters.get('render.edges', 0)
+            triangles_before = profiling.counters.get('render.triangles', 0)
+            projection = camera.matrix()
+
+            # screen.fill is used to clear the viewport
+            screen.fill(BACKGROUND_COLOR, viewport)
+
+            # and here we translate the 3d object to a 2d viewport
+            # every instance of every mesh is projected at once and the edges are drawn in a single pass
+            # (or, in the filled mode, all their faces go through one depth buffer)
+            drawn_meshes = []
+            for scene_mesh in scene.meshes():
+                world = scene.world_matrices(scene_mesh)
+                drawn = scene_mesh
+                lod = lods.get(id(scene_mesh))
+                if lod is not None:
+                    # the level is picked from the size of one copy on screen; the levels
+                    # share the coordinates frame of the full mesh, so its matrices still apply
+                    area = lod.screen_area(lambda points: render.project_array(points, projection, world[0]))
+                    drawn = lod.select(area)
+                drawn_meshes.append((drawn, world))
+            if filled:
+                face_renderer.draw(screen, drawn_meshes, camera, FACE_COLOR, viewport)
+            else:
+                for drawn, world in drawn_meshes:
+                    render.draw_instances(screen, drawn.coords_array(), drawn.edge_index_array(),
+                                          world, projection, LINE_COLOR, viewport)
+            if selection is not None:
+                screen.set_clip(viewport)
+                draw_selection(screen, selection, projection)
+                screen.set_clip(None)
+
+            if show_hud:
+                # the frame time shown is the one of the frame drawn before this one
+                frame_ms = profiling.last_ms('frame.total') or 0.0
+                lines = hud_lines(frame_ms, profiling.total_ms('render.project') - project_before,
+                                  profiling.total_ms('render.draw') - draw_before,
+                                  profiling.counters.get('render.edges', 0) - edges_before, last_op, mesh_name,
+                                  lods.get(id(mesh)),
+                                  profiling.counters.get('render.triangles', 0) - triangles_before if filled else None)
+                draw_hud(screen, font_small, lines)
+
+            # the pre-rendered panel goes on top, then every box and button
+            screen.blit(panel, (panel_x, 0))
+            for widget in widgets:
+                widget.draw(screen)
+
+            # the picked element and its neighbours, at the top of the panel
+            if selection is None:
+                info = ["Click the mesh to select a vertex, edge or face"]
+            else:
+                info = [selection_title(selection)]
+                info += [f"{label}: {', '.join(map(str, values)) or '-'}" for label, values in pick_adjacency(selection)]
+            for i, line in enumerate(info):
+                text = fit_text(font_info, line, GUI_WIDTH - 2 * label_x)
+                screen.blit(font_info.render(text, True, TEXT_COLOR), (start_x, 6 + i * 18))
+
+            pygame.display.flip()
+            profiling.record('frame.total', time.perf_counter() - frame_start)
+            needs_redraw = False
+        elif dirty_rects:
+            pygame.display.update(dirty_rects)
+        dirty_rects = []
+
+        # limits the frame rate while things keep changing
+        clock.tick(MAX_FPS)
 
     pygame.quit()
     sys.exit()
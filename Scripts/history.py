@@ -0,0 +1,115 @@
+from collections import Counter
+import numpy as np
+
+# default memory limit for the undo history (coordinate snapshots), in bytes
+DEFAULT_HISTORY_BUDGET = 64 * 1024 * 1024
+# and for the number of steps, no matter how small they are
+DEFAULT_MAX_STEPS = 1000
+# every snapshot keeps its own 4x4 model matrix
+MATRIX_BYTES = 16 * 8
+
+class MeshSnapshot:
+    # state of the mesh at one point of the history
+    # the topology is never copied, all snapshots share it with the mesh;
+    # coords is shared with the previous snapshot while the vertices don't change
+
+    __slots__ = ('coords', 'model_matrix')
+
+    def __init__(self, coords, model_matrix):
+        self.coords = coords
+        self.model_matrix = model_matrix
+
+class MeshHistory:
+    # multi-level undo/redo for the transformations applied to a mesh
+    # snapshots only hold the coordinates and the model matrix: while the
+    # transformations stay in the model matrix (the GUI case) a step costs 128 bytes,
+    # baked coordinates are stored once per change and shared between steps
+    # (copy-on-write: the meshes replace their coordinate array, never write into it)
+
+    def __init__(self, mesh, memory_budget=DEFAULT_HISTORY_BUDGET, max_steps=DEFAULT_MAX_STEPS):
+        self.mesh = mesh
+        self.memory_budget = memory_budget
+        self.max_steps = max_steps
+        # the state the mesh was loaded with, always kept for reset()
+        self.original = self._capture(None)
+        self._steps = [self.original]
+        self._position = 0
+
+    def _capture(self, previous):
+        coords = self.mesh.coords_array()
+        if previous is not None:
+            # vertices didn't change since the last snapshot: share its array
+            if coords is previous.coords or np.array_equal(coords, previous.coords):
+                coords = previous.coords
+        return MeshSnapshot(coords, self.mesh.model_matrix.copy())
+
+    def _restore(self, snapshot):
+        current = self._steps[self._position]
+        if snapshot.coords is not current.coords:
+            self.mesh.set_coords_array(snapshot.coords)
+        self.mesh.model_matrix = snapshot.model_matrix.copy()
+
+    def can_undo(self):
+        return self._position > 0
+
+    def can_redo(self):
+        return self._position < len(self._steps) - 1
+
+    def record(self):
+        # call after every change to the mesh, the redo steps are lost
+        del self._steps[self._position + 1:]
+        self._steps.append(self._capture(self._steps[self._position]))
+        self._position += 1
+        self._trim()
+
+    def undo(self):
+        if not self.can_undo():
+            return False
+        self._restore(self._steps[self._position - 1])
+        self._position -= 1
+        return True
+
+    def redo(self):
+        if not self.can_redo():
+            return False
+        self._restore(self._steps[self._position + 1])
+        self._position += 1
+        return True
+
+    def reset(self):
+        # goes back to the loaded state, as a new step so it can be undone too
+        self._restore(self.original)
+        del self._steps[self._position + 1:]
+        self._steps.append(MeshSnapshot(self.original.coords, self.original.model_matrix.copy()))
+        self._position += 1
+        self._trim()
+
+    def memory_usage(self):
+        # bytes held by the history, shared coordinate arrays are only counted once
+        arrays = {id(step.coords): step.coords for step in self._steps}
+        arrays.pop(id(self.original.coords), None)
+        return sum(a.nbytes for a in arrays.values()) + MATRIX_BYTES * len(self._steps)
+
+    def _trim(self):
+        # the oldest steps are dropped until the history fits in memory_budget and max_steps
+        # (the original state is not counted, the mesh needs it anyway)
+        while len(self._steps) > self.max_steps and self._position > 0:
+            del self._steps[0]
+            self._position -= 1
+        if len(self._steps) <= 1 or self._position == 0:
+            return
+        # memory_usage walks every snapshot, so it is read once and the bytes of every
+        # dropped step are taken off it: its matrix, and its coordinates once no other
+        # step shares them
+        usage = self.memory_usage()
+        uses = Counter(id(step.coords) for step in self._steps)
+        while len(self._steps) > 1 and self._position > 0 and usage > self.memory_budget:
+            dropped = self._steps.pop(0)
+            self._position -= 1
+            usage -= MATRIX_BYTES
+            uses[id(dropped.coords)] -= 1
+            if uses[id(dropped.coords)] == 0 and dropped.coords is not self.original.coords:
+                usage -= dropped.coords.nbytes
+
+    def __len__(self):
+        return len(self._steps)
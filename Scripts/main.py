@@ -1,10 +1,14 @@
 import os
+import atexit
+import argparse
 from pathlib import Path
-from winged_edge import EdgeMesh
-from winged_edge import get_face_vertices
-from winged_edge import save_mesh_to_obj
+from concurrent.futures import ProcessPoolExecutor
+from winged_edge import CompactEdgeMesh
+from winged_edge import save_mesh, mesh_format, MESH_EXTENSIONS
+from mesh_cache import load_mesh, read_cache, LoadProgress
 import numpy as np
 import transformations as T
+import profiling
 
 def clear():
     os.system('cls' if os.name == 'nt' else 'clear')
@@ -16,30 +20,16 @@ def apply_transformations_to_mesh(mesh_obj, transformation_matrix):
         print("Error: Mesh object or transformation matrix is not available.")
         return
 
-    count = 0
-    for vertex_id, vertex_obj in mesh_obj.vertices.items():
-        original_coord = vertex_obj.coord
-        
-        # Homogeneous coordinates for 3D
-        v_homogeneous = np.array([original_coord[0], original_coord[1], original_coord[2], 1.0])
-        
-        # Apply transformation: M @ v
-        transformed_v_homogeneous = transformation_matrix @ v_homogeneous
-        
-        # Convert back to Cartesian coordinates (perspective division)
-        w = transformed_v_homogeneous[3]
-        if w == 0: 
-            print(f"Warning: Homogeneous w component is zero for vertex {vertex_id} after transformation. Skipping update.")
-            continue
-        
-        # Update vertex coordinate in the mesh object
-        vertex_obj.coord = (
-            transformed_v_homogeneous[0] / w,
-            transformed_v_homogeneous[1] / w,
-            transformed_v_homogeneous[2] / w
-        )
-        count += 1
-    print(f"Transformation applied to {count} vertices.")
+    # every vertex is transformed at once, see EdgeMesh.transform
+    transformed = mesh_obj.transform(transformation_matrix)
+    skipped = np.flatnonzero(np.ma.getmaskarray(transformed).any(axis=1))
+
+    if len(skipped):
+        vertex_ids = list(mesh_obj.vertices.keys())
+        preview = ", ".join(str(vertex_ids[i]) for i in skipped[:10])
+        more = "..." if len(skipped) > 10 else ""
+        print(f"Warning: Homogeneous w component is zero for {len(skipped)} vertices ({preview}{more}). Skipping update.")
+    print(f"Transformation applied to {len(transformed) - len(skipped)} vertices.")
 
 def handle_transformations_submenu(current_mesh_obj, selected_mesh_name_str):
     if current_mesh_obj is None:
@@ -166,7 +156,79 @@ def handle_transformations_submenu(current_mesh_obj, selected_mesh_name_str):
              clear()
 
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Query and transform winged-edge meshes loaded from .obj, .ply or .stl files.")
+    parser.add_argument('--compact', action='store_true',
+                        help="store the meshes in NumPy index arrays instead of Python objects (for very big meshes)")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="always parse the .obj files instead of using the binary cache")
+    parser.add_argument('--cache-dir', default=None,
+                        help="where to keep the binary mesh cache (default: .mesh_cache next to the .obj files)")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="processes used to load the .obj files (0 = one per CPU core, default: 1)")
+    parser.add_argument('--profile', metavar='FILE', default=None,
+                        help="time loading and transformations and save the profile to FILE (JSON) on exit "
+                             "(files loaded by other --workers processes are not included)")
+    parser.add_argument('--trace-memory', action='store_true',
+                        help="with --profile, also measure the memory used by every mesh (slower loading)")
+    return parser.parse_args()
+
+def _load_mesh_worker(obj_file, use_cache, cache_dir):
+    # runs in a worker process, so it only sends plain arrays back:
+    # with the cache on, the parent maps the cache files and nothing big is sent at all,
+    # otherwise (or when the cache entry couldn't be written) the arrays go through
+    # pickle as raw buffers (no Vertex/Edge/Face objects)
+    try:
+        progress = LoadProgress()
+        mesh = load_mesh(obj_file, compact=True, use_cache=use_cache, cache_dir=cache_dir, progress=progress)
+        return None, (None if progress.cached else mesh.to_arrays())
+    except Exception as e:
+        return str(e), None
+
+def load_meshes(obj_files, compact=False, use_cache=True, cache_dir=None, workers=1):
+    # returns a list of (obj_file, mesh or None, error or None), in the same order as obj_files
+    if workers == 0:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(obj_files))
+
+    if workers <= 1:
+        results = []
+        for obj_file in obj_files:
+            try:
+                results.append((obj_file, load_mesh(obj_file, compact=compact, use_cache=use_cache, cache_dir=cache_dir), None))
+            except Exception as e:
+                results.append((obj_file, None, str(e)))
+        return results
+
+    results = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(_load_mesh_worker, obj_file, use_cache, cache_dir) for obj_file in obj_files]
+
+        # the futures are read in submission order, so the result order doesn't depend on timing
+        for obj_file, future in zip(obj_files, futures):
+            try:
+                error, arrays = future.result()
+            except Exception as e:
+                error, arrays = str(e), None
+
+            if error is not None:
+                results.append((obj_file, None, error))
+                continue
+
+            # no arrays: the worker confirmed the cache entry is there
+            mesh = read_cache(obj_file, cache_dir) if arrays is None else CompactEdgeMesh.from_arrays(arrays)
+            if mesh is None:
+                results.append((obj_file, None, "the mesh cache written by the worker could not be read"))
+                continue
+            results.append((obj_file, mesh if compact else mesh.to_edge_mesh(), None))
+    return results
+
 def main():
+    args = parse_args()
+    if args.profile:
+        profiling.enable(trace_memory=args.trace_memory)
+        atexit.register(profiling.dump, args.profile)
+
     # using resolve() now
     script_dir = Path(__file__).resolve().parent
     possible_objects_dirs = [
@@ -190,24 +252,22 @@ def main():
         print(f"The path '{objects_dir.resolve()}' is not a valid path.\nClosing app.")
         return
 
-    obj_files = list(objects_dir.glob('*.obj'))
+    # every file type winged_edge can read (.obj, .obj.gz, .ply, .stl)
+    obj_files = [p for p in objects_dir.iterdir() if p.is_file() and mesh_format(p)]
 
     if not obj_files:
-        print(f'No .obj file found in {objects_dir.resolve()}')
+        print(f"No mesh file ({', '.join(MESH_EXTENSIONS)}) found in {objects_dir.resolve()}")
         return
     
     meshes = {}
-    for obj_file in obj_files:
-        mesh_instance = EdgeMesh()
-        try:
-            mesh_instance.load_obj(obj_file) 
-            meshes[obj_file.name] = mesh_instance
-            print(f"Loaded '{obj_file.name}'. Vertices: {len(mesh_instance.vertices)}, Faces: {len(mesh_instance.faces)}, Edges: {len(mesh_instance.edges)}")
-        except Exception as e:
-            print(f"Error loading {obj_file.name}: {e}")
-            # if more info is needed, we can use the code below
-            # import traceback
-            # traceback.print_exc()
+    loaded = load_meshes(obj_files, compact=args.compact, use_cache=not args.no_cache,
+                         cache_dir=args.cache_dir, workers=args.workers)
+    for obj_file, mesh_instance, error in loaded:
+        if error is not None:
+            print(f"Error loading {obj_file.name}: {error}")
+            continue
+        meshes[obj_file.name] = mesh_instance
+        print(f"Loaded '{obj_file.name}'. Vertices: {len(mesh_instance.vertices)}, Faces: {len(mesh_instance.faces)}, Edges: {len(mesh_instance.edges)}")
 
     file_names = list(meshes.keys())
     if not file_names:
@@ -280,11 +340,8 @@ def main():
                         print(f"IDs available: 1 to {len(current_mesh.vertices)}.")
                     
                     else:
-                        found_faces = []
-                        for f_id, f_obj in current_mesh.faces.items():
-                            vertices_da_face = get_face_vertices(f_obj, current_mesh) 
-                            if v_id_input in vertices_da_face:
-                                found_faces.append(f_id)
+                        # O(degree) lookup in the vertex -> face index of the mesh
+                        found_faces = current_mesh.faces_around_vertex(v_id_input)
                         print(f'Faces that share the same Vertex {v_id_input}:', found_faces) 
                 
                 except ValueError:
@@ -299,7 +356,7 @@ def main():
                         print(f"IDs available: 1 to {len(current_mesh.vertices)}.")
                     
                     else:
-                        edges_found = [key for key in current_mesh.edges.keys() if v_id_input in key]
+                        edges_found = current_mesh.edges_around_vertex(v_id_input)
                         print(f'Edges conected by the Vertex {v_id_input}: ', edges_found)
 
                 except ValueError:
@@ -349,30 +406,8 @@ def main():
                             print(f'Face {f_id_input} doesn\'t have edges or is malformed.')
                         
                         else:
-                            start_edge_face = face.edge
-                            current_edge_face = start_edge_face
-                            iter_limit_face = len(current_mesh.edges) + 1 if current_mesh.edges else 256
-                            
-                            for _ in range(iter_limit_face): 
-                                
-                                if not current_edge_face: 
-                                    break 
-                                
-                                key_edge = tuple(sorted((current_edge_face.vertex_start, current_edge_face.vertex_end)))
-                                edges_found.append(key_edge)
-                                
-                                if current_edge_face.left_face == face:
-                                    current_edge_face = current_edge_face.next_left
-                                elif current_edge_face.right_face == face: 
-                                    current_edge_face = current_edge_face.next_right
-                                else: 
-                                    break
-                                
-                                if not current_edge_face or current_edge_face == start_edge_face: 
-                                    break
-                            else: 
-                                # limit
-                                pass
+                            # read from the face loop table of the mesh, no pointer walk here
+                            edges_found = current_mesh.face_edge_keys(f_id_input)
                         print(f'Arestas na face {f_id_input}: ', edges_found)
                 except ValueError:
                     print("Invalid Face ID.")
@@ -387,51 +422,23 @@ def main():
                         print(f"Available Face IDs : 1 to {len(current_mesh.faces)}.")
 
                     else:
-                        adj_faces = set()
+                        adj_faces = []
                         
                         if not face.edge:
                             print(f'Face {f_id_input} doesn\'t have edges or is malformed.')
                         
                         else:
-                            start_edge_adj = face.edge
-                            current_edge_adj = start_edge_adj
-                            iter_limit_adj = len(current_mesh.edges) + 1 if current_mesh.edges else 256
-                            for _ in range(iter_limit_adj):
-                                if not current_edge_adj: 
-                                    break
-                                
-                                neighbor_face_obj = None
-                                if current_edge_adj.left_face == face: 
-                                    neighbor_face_obj = current_edge_adj.right_face
-                                
-                                elif current_edge_adj.right_face == face: 
-                                    neighbor_face_obj = current_edge_adj.left_face
-                                
-                                if neighbor_face_obj: 
-                                    adj_faces.add(neighbor_face_obj.index)
-                                
-                                if current_edge_adj.left_face == face: 
-                                    current_edge_adj = current_edge_adj.next_left
-                                
-                                elif current_edge_adj.right_face == face: 
-                                    current_edge_adj = current_edge_adj.next_right
-                                
-                                else: 
-                                    break
-                                
-                                if not current_edge_adj or current_edge_adj == start_edge_adj: 
-                                    break
-                            
-                            else: 
-                                pass
+                            # the faces on the other side of every edge in the face loop table
+                            adj_faces = current_mesh.faces_adjacent_to_face(f_id_input)
                         
-                        print(f'Adjacent Faces to Face {f_id_input}:', list(adj_faces))
+                        print(f'Adjacent Faces to Face {f_id_input}:', adj_faces)
                 except ValueError:
                     print("Invalid Face ID")
 
             case 6:
                 handle_transformations_submenu(current_mesh, selected_mesh_name)
-                save_mesh_to_obj(current_mesh, selected_mesh_name)
+                # saved in the same format as the file it was loaded from
+                save_mesh(current_mesh, selected_mesh_name)
 
             case 0:
                 break
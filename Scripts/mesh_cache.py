@@ -0,0 +1,205 @@
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import threading
+from pathlib import Path
+import numpy as np
+from winged_edge import EdgeMesh, CompactEdgeMesh, parse_mesh_file
+from validation import ValidationReport, VALIDATION_LOG_LIMIT
+import profiling
+
+# bump this when the layout of the cached arrays changes
+CACHE_VERSION = 2
+CACHE_DIR_NAME = '.mesh_cache'
+# the content hash only reads a few blocks of the file, so checking a
+# big file on every launch stays cheap
+HASH_BLOCK_SIZE = 1024 * 1024
+
+def default_cache_dir(obj_path):
+    # the cache lives next to the .obj files
+    return Path(obj_path).resolve().parent / CACHE_DIR_NAME
+
+def cache_entry_dir(obj_path, cache_dir=None):
+    obj_path = Path(obj_path).resolve()
+    cache_dir = Path(cache_dir) if cache_dir else default_cache_dir(obj_path)
+    # one directory per source file, named after the file and a hash of its full path
+    path_hash = hashlib.sha1(str(obj_path).encode()).hexdigest()[:12]
+    return cache_dir / f"{obj_path.stem}-{path_hash}"
+
+def source_signature(obj_path):
+    # size, mtime and a hash of the first, middle and last blocks of the file
+    stat = os.stat(obj_path)
+    digest = hashlib.blake2b(str(stat.st_size).encode(), digest_size=16)
+    with open(obj_path, 'rb') as f:
+        for offset in (0, stat.st_size // 2, stat.st_size - HASH_BLOCK_SIZE):
+            f.seek(max(offset, 0))
+            digest.update(f.read(HASH_BLOCK_SIZE))
+
+    return {
+        'version': CACHE_VERSION,
+        'source': str(Path(obj_path).resolve()),
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'hash': digest.hexdigest(),
+    }
+
+def read_cache(obj_path, cache_dir=None):
+    # returns a CompactEdgeMesh with memory-mapped arrays, or None if there is no valid cache
+    entry = cache_entry_dir(obj_path, cache_dir)
+    try:
+        with open(entry / 'meta.json') as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if meta.get('signature') != source_signature(obj_path):
+        return None
+
+    try:
+        # copy-on-write: the mesh can be edited in memory without touching the cache files
+        arrays = {name: np.load(entry / f"{name}.npy", mmap_mode='c') for name in meta['arrays']}
+        mesh = CompactEdgeMesh.from_arrays(arrays)
+        mesh.validation = _read_validation(entry, meta.get('validation'))
+        return mesh
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Warning: ignoring broken mesh cache for '{obj_path}': {e}")
+        return None
+
+def write_cache(obj_path, mesh, cache_dir=None):
+    # saves the arrays of a CompactEdgeMesh as .npy files, so they can be mapped later
+    # returns True when the entry was written; on failure (read-only or missing
+    # directory, full disk...) a warning is printed and the mesh just isn't cached
+    entry = cache_entry_dir(obj_path, cache_dir)
+    arrays = mesh.to_arrays()
+
+    # everything is written in a temporary directory first, then moved in place,
+    # so an interrupted write never leaves a half cache behind
+    tmp_dir = None
+    try:
+        entry.parent.mkdir(parents=True, exist_ok=True)
+        tmp_dir = Path(tempfile.mkdtemp(dir=entry.parent, prefix=f".{entry.name}-"))
+        for name, array in arrays.items():
+            np.save(tmp_dir / f"{name}.npy", np.ascontiguousarray(array))
+        meta = {'signature': source_signature(obj_path), 'arrays': sorted(arrays)}
+        if mesh.validation is not None:
+            meta['validation'] = _write_validation(tmp_dir, mesh.validation)
+        with open(tmp_dir / 'meta.json', 'w') as f:
+            json.dump(meta, f, indent=2)
+
+        if entry.exists():
+            shutil.rmtree(entry)
+        os.replace(tmp_dir, entry)
+        return True
+    except OSError as e:
+        if tmp_dir is not None:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        print(f"Warning: could not write the mesh cache for '{obj_path}': {e}")
+        return False
+
+class LoadProgress:
+    # what a load is doing, written by load_mesh and read by another thread (the viewer)
+    # stage: 'cache', 'parse', 'topology', 'cache write' or 'done'
+    # fraction: how much of the stage is done (0-1), None when it can't be told
+    # vertex_blocks: (V, 3) coordinate blocks, filled while the file is read, so the
+    # vertices can be shown before the faces are linked (blocks are only ever appended)
+    # cached: True once the mesh is known to have a valid cache entry (read or written)
+
+    def __init__(self):
+        self.stage = 'cache'
+        self.fraction = None
+        self.vertex_blocks = []
+        self.cached = False
+
+    def set_stage(self, stage, fraction=None):
+        self.stage = stage
+        self.fraction = fraction
+
+    def parsed(self, fraction, vertex_blocks):
+        # the progress callback of parse_obj
+        self.fraction = fraction
+        self.vertex_blocks = vertex_blocks
+
+class MeshLoader:
+    # runs load_mesh on a worker thread, the caller polls done() and reads progress
+    # meanwhile; the result is in mesh (or the exception in error) once done() is True
+
+    def __init__(self, obj_path, compact=False, use_cache=True, cache_dir=None):
+        self.obj_path = obj_path
+        self.progress = LoadProgress()
+        self.mesh = None
+        self.error = None
+        # daemon: closing the viewer doesn't wait for a big file to finish loading
+        self._thread = threading.Thread(target=self._run, args=(compact, use_cache, cache_dir), daemon=True)
+        self._thread.start()
+
+    def _run(self, compact, use_cache, cache_dir):
+        try:
+            self.mesh = load_mesh(self.obj_path, compact, use_cache, cache_dir, self.progress)
+        except Exception as e:
+            self.error = e
+
+    def done(self):
+        return not self._thread.is_alive()
+
+def _write_validation(entry, report):
+    # the problem arrays of the ValidationReport go next to the mesh arrays,
+    # the sizes and the skipped lines (text) into meta.json
+    for name, _ in ValidationReport.PROBLEMS:
+        if name != 'skipped_lines':
+            np.save(entry / f"validation.{name}.npy", np.asarray(getattr(report, name)))
+    return {
+        'n_vertices': int(report.n_vertices),
+        'n_faces': int(report.n_faces),
+        'n_edges': int(report.n_edges),
+        'skipped_lines': list(report.skipped_lines),
+    }
+
+def _read_validation(entry, meta):
+    # the ValidationReport saved by _write_validation, None if the mesh had none
+    if meta is None:
+        return None
+    problems = {name: np.load(entry / f"validation.{name}.npy")
+                for name, _ in ValidationReport.PROBLEMS if name != 'skipped_lines'}
+    return ValidationReport(meta['n_vertices'], meta['n_faces'], meta['n_edges'],
+                            skipped_lines=meta['skipped_lines'], **problems)
+
+def load_mesh(obj_path, compact=False, use_cache=True, cache_dir=None, progress=None):
+    # loads an .obj, .ply or .stl file, using the binary cache when it is still valid
+    # compact=True returns a CompactEdgeMesh, otherwise a regular EdgeMesh
+    # progress: a LoadProgress that follows the load (see MeshLoader)
+    # with profiling on, the time and the memory it kept are recorded per file
+    progress = progress or LoadProgress()
+    with profiling.timed('load.total'), profiling.traced_memory(f"mesh {Path(obj_path).name}"):
+        mesh = _load_mesh(obj_path, compact, use_cache, cache_dir, progress)
+    progress.set_stage('done', 1.0)
+    return mesh
+
+def _load_mesh(obj_path, compact, use_cache, cache_dir, progress):
+    mesh = None
+    if use_cache:
+        with profiling.timed('load.cache_read'):
+            mesh = read_cache(obj_path, cache_dir)
+    if mesh is not None:
+        # the same warnings as when the file was parsed
+        if mesh.validation is not None:
+            mesh.validation.log(VALIDATION_LOG_LIMIT)
+        progress.vertex_blocks = [mesh.coords_array()]
+        progress.cached = True
+        return mesh if compact else mesh.to_edge_mesh()
+
+    # same steps as EdgeMesh.load, the vertices are published between them
+    progress.set_stage('parse', 0.0)
+    with profiling.timed('load.parse'):
+        data = parse_mesh_file(obj_path, progress.parsed)
+    progress.vertex_blocks = [data.vertices]
+    progress.set_stage('topology')
+    mesh = CompactEdgeMesh() if compact or use_cache else EdgeMesh()
+    mesh.load_data(data)
+    if use_cache:
+        progress.set_stage('cache write')
+        progress.cached = write_cache(obj_path, mesh, cache_dir)
+        if not compact:
+            mesh = mesh.to_edge_mesh()
+    return mesh
@@ -0,0 +1,265 @@
+import numpy as np
+
+import profiling
+import render
+
+# triangles per leaf of the hierarchy
+BVH_LEAF_SIZE = 8
+# bits per axis of the Morton codes the triangles are sorted by
+MORTON_BITS = 10
+# a click this close (in pixels) to a vertex or an edge of the hit face picks it instead of the face
+# (at most a quarter of the size of the face on screen)
+PICK_RADIUS = 6
+
+class FaceBVH:
+    # bounding volume hierarchy over the faces of a mesh, in object space
+    # the faces are split in fan triangles, sorted along a Morton curve and grouped
+    # BVH_LEAF_SIZE at a time; the tree above the leaves is a complete binary tree,
+    # so it is stored as one (2 ** d, 2, 3) array of boxes per level and never as nodes
+    # the tree only depends on the topology: after the vertices move, refit() recomputes
+    # the boxes in O(N) without sorting again, and the model matrix never touches it
+    # (the picking ray is brought to object space instead)
+
+    def __init__(self, mesh):
+        self.loops = mesh.face_loops()
+        sizes = np.diff(self.loops.offsets)
+        n_tris = np.maximum(sizes - 2, 0)
+        tri_face = np.repeat(np.arange(len(sizes)), n_tris)
+        tri_offsets = np.zeros(len(sizes) + 1, dtype=np.int64)
+        np.cumsum(n_tris, out=tri_offsets[1:])
+        # triangle i of a face uses its corners 0, i + 1 and i + 2
+        local = np.arange(len(tri_face)) - tri_offsets[tri_face]
+        first = self.loops.offsets[tri_face]
+        corners = np.stack([first, first + local + 1, first + local + 2], axis=1)
+        # coords_array row of every corner of the face loops
+        self.corner_rows = mesh.vertex_rows(self.loops.vertex_ids)
+        rows = self.corner_rows[corners]
+
+        coords = mesh.coords_array()
+        order = np.argsort(_morton_codes(coords[rows].mean(axis=1)), kind='stable')
+        self.tri_rows = rows[order].astype(np.int32)
+        self.tri_face = tri_face[order]
+
+        n_leaves = max(-(-len(self.tri_rows) // BVH_LEAF_SIZE), 1)
+        self.depth = int(np.ceil(np.log2(n_leaves)))
+        self.levels = None
+        self.coords = None
+        self.refit(coords)
+
+    def refit(self, coords):
+        # recomputes every box for new vertex positions (same topology)
+        with profiling.timed('pick.refit'):
+            n_slots = (1 << self.depth) * BVH_LEAF_SIZE
+            lo = np.full((n_slots, 3), np.inf)
+            hi = np.full((n_slots, 3), -np.inf)
+            corners = [coords[self.tri_rows[:, k]] for k in range(3)]
+            lo[:len(self.tri_rows)] = np.minimum(np.minimum(corners[0], corners[1]), corners[2])
+            hi[:len(self.tri_rows)] = np.maximum(np.maximum(corners[0], corners[1]), corners[2])
+
+            boxes = np.stack([lo.reshape(-1, BVH_LEAF_SIZE, 3).min(axis=1), hi.reshape(-1, BVH_LEAF_SIZE, 3).max(axis=1)], axis=1)
+            levels = [boxes]
+            while len(boxes) > 1:
+                pairs = boxes.reshape(-1, 2, 2, 3)
+                boxes = np.stack([pairs[:, :, 0].min(axis=1), pairs[:, :, 1].max(axis=1)], axis=1)
+                levels.append(boxes)
+            self.levels = levels[::-1]
+            self.coords = coords
+
+    def bounds(self):
+        # (2, 3) box around the whole mesh
+        return self.levels[0][0]
+
+    def intersect(self, origin, direction, t_min=-np.inf):
+        # first face hit by the line origin + t * direction for t >= t_min (by default
+        # t can be negative: an orthographic view has no near plane), the smallest t wins;
+        # returns (t, face row) or None
+        inv_dir = 1.0 / np.where(direction == 0, 1e-300, direction)
+        nodes = np.zeros(1, dtype=np.int64)
+        for level, boxes in enumerate(self.levels):
+            nodes = nodes[_line_hits_boxes(origin, inv_dir, boxes[nodes])]
+            if len(nodes) == 0:
+                return None
+            if level < self.depth:
+                nodes = (nodes[:, None] * 2 + np.arange(2)).ravel()
+
+        tris = (nodes[:, None] * BVH_LEAF_SIZE + np.arange(BVH_LEAF_SIZE)).ravel()
+        tris = tris[tris < len(self.tri_rows)]
+        t = _line_triangle_hits(origin, direction, self.coords[self.tri_rows[tris]])
+        t[t < t_min] = np.inf
+        if not np.isfinite(t).any():
+            return None
+        best = int(np.argmin(t))
+        return float(t[best]), int(self.tri_face[tris[best]])
+
+class Pick:
+    # what was clicked: kind is 'vertex', 'edge' or 'face'; key is the vertex id,
+    # the (smaller, bigger) vertex ids of the edge, or the face id
+    __slots__ = ('kind', 'key', 'mesh', 'instance')
+
+    def __init__(self, kind, key, mesh, instance):
+        self.kind = kind
+        self.key = key
+        self.mesh = mesh
+        self.instance = instance
+
+    def __repr__(self):
+        return f"Pick({self.kind}, {self.key})"
+
+class Picker:
+    # click-to-pick for every instance of a Scene drawn with a screen matrix (see render.project_array)
+    # the hierarchies are kept per mesh and only rebuilt when the topology changes
+
+    def __init__(self, scene):
+        self.scene = scene
+        self._trees = {}
+
+    def tree(self, mesh):
+        bvh = self._trees.get(id(mesh))
+        if bvh is None or bvh.loops is not mesh.face_loops():
+            with profiling.timed('pick.build'):
+                bvh = self._trees[id(mesh)] = FaceBVH(mesh)
+        coords = mesh.coords_array()
+        # the meshes replace their coordinate array when the vertices move
+        if coords is not bvh.coords and not np.array_equal(coords, bvh.coords):
+            bvh.refit(coords)
+        bvh.coords = coords
+        return bvh
+
+    def pick(self, pos, projection):
+        # the element under the screen position pos, or None
+        # projection is the 4x4 world -> screen matrix with a depth row the scene is drawn
+        # with, like camera.OrbitCamera.matrix()
+        with profiling.timed('pick.query'):
+            # every point of the line below the cursor has the same screen position, it
+            # goes from depth 0 (the eye, or the near plane of a perspective projection)
+            # to depth 0.5, and the smallest depth is in front
+            near = np.array([pos[0], pos[1], 0.0, 1.0])
+            far = np.array([pos[0], pos[1], 0.5, 1.0])
+            # nothing behind the near plane can be picked in perspective
+            t_min = 0.0 if np.any(projection[3] != [0, 0, 0, 1]) else -np.inf
+
+            best = None
+            for mesh in self.scene.meshes():
+                bvh = self.tree(mesh)
+                matrices = projection @ self.scene.world_matrices(mesh)
+                try:
+                    inverse = np.linalg.inv(matrices)
+                except np.linalg.LinAlgError:
+                    # flattened by a zero scale, there is nothing to click on
+                    continue
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    p0 = inverse @ near
+                    p1 = inverse @ far
+                    p0 = p0[:, :3] / p0[:, 3:]
+                    p1 = p1[:, :3] / p1[:, 3:]
+                directions = p1 - p0
+
+                # the root box of every instance is tested at once, only the hit ones go down the tree
+                lo, hi = bvh.bounds()
+                inv_dirs = 1.0 / np.where(directions == 0, 1e-300, directions)
+                candidates = np.flatnonzero(_line_hits_box_stack(p0, inv_dirs, lo, hi))
+                for i in candidates.tolist():
+                    hit = bvh.intersect(p0[i], directions[i], t_min)
+                    if hit is None:
+                        continue
+                    t, face_row = hit
+                    depth = (matrices[i] @ np.append(p0[i] + t * directions[i], 1.0))
+                    depth = depth[2] / depth[3]
+                    if best is None or depth < best[0]:
+                        best = (depth, mesh, i, face_row, matrices[i])
+
+            if best is None:
+                return None
+            _, mesh, i, face_row, screen_matrix = best
+            instance = [inst for inst in self.scene if inst.mesh is mesh][i]
+            return _snap(self.tree(mesh), mesh, instance, screen_matrix, face_row, pos)
+
+def _snap(bvh, mesh, instance, screen_matrix, face_row, pos):
+    # a vertex or an edge of the hit face when the click is close enough to it on screen
+    loops = bvh.loops
+    corners = slice(loops.offsets[face_row], loops.offsets[face_row + 1])
+    v_ids = loops.vertex_ids[corners]
+    points = render.project_array(bvh.coords[bvh.corner_rows[corners]], screen_matrix)
+    click = np.asarray(pos, dtype=np.float64)
+    # on small faces the radius shrinks, so the face itself can still be picked
+    radius = min(PICK_RADIUS, 0.25 * float(np.ptp(points, axis=0).max()))
+
+    distances = np.hypot(*(points - click).T)
+    nearest = int(np.argmin(distances))
+    if distances[nearest] <= radius:
+        return Pick('vertex', int(v_ids[nearest]), mesh, instance)
+
+    starts, ends = points, np.roll(points, -1, axis=0)
+    segment = ends - starts
+    length2 = (segment ** 2).sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        along = np.clip(((click - starts) * segment).sum(axis=1) / length2, 0, 1)
+    along = np.nan_to_num(along)
+    distances = np.hypot(*(starts + along[:, None] * segment - click).T)
+    nearest = int(np.argmin(distances))
+    if distances[nearest] <= radius:
+        a, b = int(v_ids[nearest]), int(v_ids[(nearest + 1) % len(v_ids)])
+        return Pick('edge', (min(a, b), max(a, b)), mesh, instance)
+
+    return Pick('face', int(loops.face_ids[face_row]), mesh, instance)
+
+def pick_adjacency(pick):
+    # the answers of the main.py queries for the picked element, as (label, values) pairs
+    mesh = pick.mesh
+    if pick.kind == 'vertex':
+        return [('Faces', mesh.faces_around_vertex(pick.key)),
+                ('Edges', mesh.edges_around_vertex(pick.key))]
+    if pick.kind == 'edge':
+        edge = mesh.edges.get(pick.key)
+        faces = []
+        if edge is not None:
+            if edge.left_face: faces.append(edge.left_face.index)
+            if edge.right_face: faces.append(edge.right_face.index)
+        return [('Faces', faces)]
+    return [('Edges', mesh.face_edge_keys(pick.key)),
+            ('Adjacent faces', mesh.faces_adjacent_to_face(pick.key))]
+
+def _morton_codes(points):
+    # position of every point along a Z-order curve through the bounding box
+    lo = points.min(axis=0) if len(points) else np.zeros(3)
+    size = np.ptp(points, axis=0) if len(points) else np.ones(3)
+    size[size == 0] = 1
+    cells = ((points - lo) / size * ((1 << MORTON_BITS) - 1)).astype(np.uint32)
+    return _spread_bits(cells[:, 0]) | (_spread_bits(cells[:, 1]) << 1) | (_spread_bits(cells[:, 2]) << 2)
+
+def _spread_bits(x):
+    # puts two zero bits between the 10 low bits of every value (..., b1, 0, 0, b0)
+    x = (x | (x << 16)) & np.uint32(0x030000FF)
+    x = (x | (x << 8)) & np.uint32(0x0300F00F)
+    x = (x | (x << 4)) & np.uint32(0x030C30C3)
+    x = (x | (x << 2)) & np.uint32(0x09249249)
+    return x
+
+def _line_hits_boxes(origin, inv_dir, boxes):
+    # slab test of one line against a (K, 2, 3) array of boxes (empty boxes never hit)
+    t1 = (boxes[:, 0] - origin) * inv_dir
+    t2 = (boxes[:, 1] - origin) * inv_dir
+    return (np.minimum(t1, t2).max(axis=1) <= np.maximum(t1, t2).min(axis=1)) & (boxes[:, 0, 0] <= boxes[:, 1, 0])
+
+def _line_hits_box_stack(origins, inv_dirs, lo, hi):
+    # slab test of K lines against one box
+    with np.errstate(invalid='ignore'):
+        t1 = (lo - origins) * inv_dirs
+        t2 = (hi - origins) * inv_dirs
+        return (np.minimum(t1, t2).max(axis=1) <= np.maximum(t1, t2).min(axis=1)) & (lo[0] <= hi[0])
+
+def _line_triangle_hits(origin, direction, triangles):
+    # Moller-Trumbore for a (K, 3, 3) array of triangles: t of the hit, inf for a miss
+    a, b, c = triangles[:, 0], triangles[:, 1], triangles[:, 2]
+    e1, e2 = b - a, c - a
+    p = np.cross(direction, e2)
+    det = (e1 * p).sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        inv_det = 1.0 / det
+        s = origin - a
+        u = (s * p).sum(axis=1) * inv_det
+        q = np.cross(s, e1)
+        v = (q @ direction) * inv_det
+        t = (q * e2).sum(axis=1) * inv_det
+        hit = (np.abs(det) > 1e-12) & (u >= 0) & (v >= 0) & (u + v <= 1)
+    return np.where(hit, t, np.inf)
@@ -0,0 +1,111 @@
+import json
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+# opt-in instrumentation: named timers, counters and memory readings
+# everything is a no-op until enable() is called, so the hot paths can keep
+# their "with profiling.timed(...)" blocks at almost no cost
+
+_enabled = False
+_trace_memory = False
+timers = {}
+counters = {}
+memory = {}
+# name of the last timer that finished, for "last operation" displays
+last_timer = None
+
+class TimerStats:
+    __slots__ = ('count', 'total', 'last', 'max')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.last = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.last = seconds
+        self.max = max(self.max, seconds)
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'total_ms': self.total * 1000,
+            'mean_ms': self.total * 1000 / self.count if self.count else 0.0,
+            'last_ms': self.last * 1000,
+            'max_ms': self.max * 1000,
+        }
+
+def enable(trace_memory=False):
+    # trace_memory also turns on tracemalloc, which makes allocations a lot slower
+    global _enabled, _trace_memory
+    _enabled = True
+    _trace_memory = trace_memory
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+def is_enabled():
+    return _enabled
+
+def record(name, seconds):
+    global last_timer
+    if not _enabled:
+        return
+    stats = timers.get(name)
+    if stats is None:
+        stats = timers[name] = TimerStats()
+    stats.add(seconds)
+    last_timer = name
+
+@contextmanager
+def timed(name):
+    if not _enabled:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - start)
+
+def count(name, amount=1):
+    if _enabled:
+        counters[name] = counters.get(name, 0) + amount
+
+@contextmanager
+def traced_memory(name):
+    # memory kept (and the peak) while the block runs, only with enable(trace_memory=True)
+    if not (_enabled and _trace_memory):
+        yield
+        return
+    before, _ = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    try:
+        yield
+    finally:
+        after, peak = tracemalloc.get_traced_memory()
+        memory[name] = {'kept_mb': (after - before) / (1024 * 1024), 'peak_mb': (peak - before) / (1024 * 1024)}
+
+def last_ms(name):
+    stats = timers.get(name)
+    return stats.last * 1000 if stats else None
+
+def total_ms(name):
+    # the difference of two readings is the time spent in between (e.g. in one frame)
+    stats = timers.get(name)
+    return stats.total * 1000 if stats else 0.0
+
+def report():
+    return {
+        'timers': {name: stats.as_dict() for name, stats in sorted(timers.items())},
+        'counters': dict(sorted(counters.items())),
+        'memory': dict(sorted(memory.items())),
+    }
+
+def dump(path):
+    with open(path, 'w') as f:
+        json.dump(report(), f, indent=2)
+    print(f"Profile saved to {path}")
@@ -0,0 +1,252 @@
+import numpy as np
+import pygame
+
+import profiling
+from winged_edge import _triangulate
+
+# most candidate pixels (bounding box pixels of the triangles) tested at once,
+# bigger batches are faster but take more memory
+MAX_FRAGMENTS = 1 << 20
+# light that still reaches the faces seen edge-on, as a fraction of the color
+AMBIENT = 0.25
+# pixel centres this close outside a triangle (in barycentric units) are still covered,
+# so rounding never opens a gap between two triangles
+SPAN_TOLERANCE = 1e-9
+# an empty pixel of the depth buffer
+_EMPTY = np.iinfo(np.int64).max
+
+class MeshTriangles:
+    # fan triangles of the face loops of a mesh, with the object-space normal of their face
+    # the triangles only depend on the topology and the normals come from the cache of
+    # the mesh (mesh_normals), the model matrices never touch them (the eye is brought
+    # to object space instead)
+
+    def __init__(self, mesh):
+        self.loops = mesh.face_loops()
+        self.rows = _triangulate(self.loops.offsets, mesh.vertex_rows(self.loops.vertex_ids))
+        sizes = np.diff(self.loops.offsets)
+        self.faces = np.repeat(np.arange(len(sizes)), np.maximum(sizes - 2, 0))
+        self.coords = None
+        self.normals = None
+        self.offsets = None
+
+    def update(self, mesh):
+        # the meshes replace their coordinate array when the vertices move
+        coords = mesh.coords_array()
+        if coords is self.coords:
+            return
+        # the plane of every triangle, normal . p = offset (the normal is not normalized)
+        self.normals = mesh.mesh_normals().face_areas[self.faces]
+        self.offsets = np.einsum('ij,ij->i', self.normals, coords[self.rows[:, 0]])
+        self.coords = coords
+
+class FaceRenderer:
+    # filled, flat shaded faces with a depth buffer, rasterized with numpy
+    # the faces are fan triangulated, the ones turned away from the eye are culled with
+    # the normals of their faces, and the others are rasterized in batches: every pixel of the
+    # bounding box of every triangle is tested at once, and the nearest one per pixel
+    # is kept with np.minimum.at on a key that packs (depth, triangle)
+    # the triangles and normals are kept per mesh, like picking.Picker does
+
+    def __init__(self):
+        self._meshes = {}
+        self._palettes = {}
+
+    def triangles(self, mesh):
+        tris = self._meshes.get(id(mesh))
+        if tris is None or tris.loops is not mesh.face_loops():
+            tris = self._meshes[id(mesh)] = MeshTriangles(mesh)
+        tris.update(mesh)
+        return tris
+
+    def draw(self, surface, meshes, camera, color, clip_rect=None):
+        # meshes: (mesh, (I, 4, 4) world matrices) pairs, drawn with the camera of
+        # camera.OrbitCamera; nothing is drawn outside clip_rect (the whole surface by default)
+        clip_rect = surface.get_rect().clip(pygame.Rect(clip_rect)) if clip_rect is not None else surface.get_rect()
+        width, height = clip_rect.size
+        if width == 0 or height == 0:
+            return
+        keys = np.full(width * height, _EMPTY, dtype=np.int64)
+        # screen -> depth buffer pixels
+        to_buffer = np.identity(4)
+        to_buffer[:2, 3] = -clip_rect.left, -clip_rect.top
+        view = to_buffer @ camera.matrix()
+        eye = camera.eye()
+        _, _, light = camera.axes()
+
+        shades = []
+        n_drawn = 0
+        for mesh, world_matrices in meshes:
+            tris = self.triangles(mesh)
+            if len(tris.rows) == 0:
+                continue
+            for world in world_matrices:
+                with profiling.timed('render.project'):
+                    visible = self._visible(tris, world, view, eye, light)
+                if visible is None:
+                    continue
+                x, y, depth, shade = visible
+                with profiling.timed('render.draw'):
+                    _rasterize(keys, width, height, x, y, depth, np.arange(n_drawn, n_drawn + len(shade)))
+                shades.append(shade)
+                n_drawn += len(shade)
+        profiling.count('render.triangles', n_drawn)
+        if n_drawn == 0:
+            return
+
+        with profiling.timed('render.draw'):
+            covered = np.flatnonzero(keys != _EMPTY)
+            shade = np.concatenate(shades)[keys[covered] & 0xFFFFFFFF]
+            values = self._palette(surface, color)[shade]
+            x = covered % width + clip_rect.left
+            y = covered // width + clip_rect.top
+            pixels = pygame.surfarray.pixels2d(surface)
+            rows = pixels.T
+            if rows.flags.c_contiguous:
+                # write through a flat view, a 1-D scatter is faster than a 2-D one
+                rows.reshape(-1)[y * surface.get_width() + x] = values
+            else:
+                pixels[x, y] = values
+            # the surface stays locked while the pixel arrays exist
+            del pixels, rows
+
+    def _visible(self, tris, world, view, eye, light):
+        # the triangles of one instance that face the eye and are in front of it:
+        # their (T, 3) screen x, y and depth and their shade (0-255), or None
+        try:
+            inverse = np.linalg.inv(world)
+        except np.linalg.LinAlgError:
+            # flattened by a zero scale, there is nothing to see
+            return None
+        # facing the eye: the eye is on the side the normal points to
+        # (checked in object space, where the normals are)
+        eye = inverse @ eye
+        facing = np.flatnonzero(tris.normals @ eye[:3] > eye[3] * tris.offsets)
+        profiling.count('render.culled', len(tris.rows) - len(facing))
+        if len(facing) == 0:
+            return None
+
+        # screen x, y, depth and w of every vertex, one contiguous array each
+        matrix = view @ world
+        projected = (tris.coords @ matrix[:, :3].T + matrix[:, 3]).T
+        w = projected[3]
+        rows = tris.rows[facing]
+        # triangles with a corner behind the eye are dropped, not clipped
+        if not (w > 0).all():
+            in_front = (w[rows] > 0).all(axis=1)
+            facing, rows = facing[in_front], rows[in_front]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            x, y, depth = (projected[k] / w for k in range(3))
+
+        # flat shading with a light at the eye; the normals go to world space with the
+        # inverse transpose of the model matrix
+        normals = tris.normals[facing] @ inverse[:3, :3]
+        lengths = np.sqrt(np.einsum('ij,ij->i', normals, normals))
+        cos = (normals @ light) / np.where(lengths > 0, lengths, 1.0)
+        shade = (255 * (AMBIENT + (1 - AMBIENT) * np.clip(cos, 0.0, 1.0))).astype(np.uint8)
+        return x[rows], y[rows], depth[rows], shade
+
+    def _palette(self, surface, color):
+        # mapped pixel value of color at every shade level
+        key = (tuple(color), surface.get_bitsize(), surface.get_masks())
+        palette = self._palettes.get(key)
+        if palette is None:
+            levels = np.arange(256) / 255
+            palette = np.array([surface.map_rgb(tuple(int(c * level) for c in color)) for level in levels])
+            palette = self._palettes[key] = palette.astype(pygame.surfarray.pixels2d(surface).dtype)
+        return palette
+
+def _rasterize(keys, width, height, x, y, depth, ids):
+    # writes (T, 3) triangles (corners in pixels of the buffer) into keys, a flat
+    # width x height depth buffer, keeping the nearest one per pixel; ids are stored
+    # with the depth (below 2 ** 32)
+    # a pixel is covered when its centre is inside the triangle (or on its border); every
+    # row of every triangle is turned into the span of pixels it covers at once, so only
+    # covered pixels are ever made
+    x0, x1, x2 = x.T
+    y0, y1, y2 = y.T
+    x_lo = np.maximum(np.ceil(np.minimum(np.minimum(x0, x1), x2) - 0.5), 0)
+    x_hi = np.minimum(np.floor(np.maximum(np.maximum(x0, x1), x2) - 0.5), width - 1)
+    y_lo = np.maximum(np.ceil(np.minimum(np.minimum(y0, y1), y2) - 0.5), 0)
+    y_hi = np.minimum(np.floor(np.maximum(np.maximum(y0, y1), y2) - 0.5), height - 1)
+    # off screen or too thin to cover a pixel centre
+    kept = np.flatnonzero((x_hi >= x_lo) & (y_hi >= y_lo))
+    if len(kept) == 0:
+        return
+
+    # barycentric coordinates of the corners as planes over the pixels, b = A * px + B * py + C
+    # at the centre of pixel (px, py), and the depth as another plane
+    x = x[kept] - 0.5
+    y = y[kept] - 0.5
+    depth = depth[kept]
+    area = (x[:, 1] - x[:, 0]) * (y[:, 2] - y[:, 0]) - (x[:, 2] - x[:, 0]) * (y[:, 1] - y[:, 0])
+    keep = area != 0
+    kept, x, y, depth, area = kept[keep], x[keep], y[keep], depth[keep], area[keep]
+    planes = []
+    for k in range(3):
+        # corner k is weighted by the edge across it
+        (xa, ya), (xb, yb) = (x[:, (k + 1) % 3], y[:, (k + 1) % 3]), (x[:, (k + 2) % 3], y[:, (k + 2) % 3])
+        planes.append(((ya - yb) / area, (xb - xa) / area, (xa * yb - xb * ya) / area))
+    depth_plane = [sum(plane[c] * depth[:, k] for k, plane in enumerate(planes)) for c in range(3)]
+
+    # one entry per row of every triangle box (np.repeat is a lot cheaper than
+    # gathering the triangle data with fancy indexing)
+    box_h = (y_hi[kept] - y_lo[kept] + 1).astype(np.int64)
+    first = np.cumsum(box_h) - box_h
+    py = np.arange(first[-1] + box_h[-1]) - np.repeat(first - y_lo[kept].astype(np.int64), box_h)
+    row_y = py.astype(np.float64)
+
+    # the span of the row: the pixels with the three coordinates >= 0
+    lo = np.repeat(x_lo[kept], box_h)
+    hi = np.repeat(x_hi[kept], box_h)
+    for a, b, c in planes:
+        a = np.repeat(a, box_h)
+        c = np.repeat(b, box_h) * row_y + np.repeat(c + SPAN_TOLERANCE, box_h)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            bound = -c / a
+        np.maximum(lo, np.ceil(bound), out=lo, where=a > 0)
+        np.minimum(hi, np.floor(bound), out=hi, where=a < 0)
+        # parallel to the row: all or nothing
+        hi[(a == 0) & (c < 0)] = -1
+    counts = (hi - lo + 1).astype(np.int64)
+    rows = np.flatnonzero(counts > 0)
+    if len(rows) == 0:
+        return
+    # depth at the first pixel of every span and its step along the row
+    da = np.repeat(depth_plane[0], box_h)[rows]
+    lo = lo[rows]
+    row_depth = (da * lo + (np.repeat(depth_plane[1], box_h) * row_y + np.repeat(depth_plane[2], box_h))[rows]).astype(np.float32)
+    row_step = da.astype(np.float32)
+    row_pixel = py[rows] * width + lo.astype(np.int64)
+    row_id = np.repeat(np.asarray(ids)[kept], box_h)[rows]
+    counts = counts[rows]
+
+    # batches of whole spans with at most MAX_FRAGMENTS pixels
+    ends = np.cumsum(counts)
+    start = 0
+    while start < len(counts):
+        base = ends[start - 1] if start else 0
+        stop = max(int(np.searchsorted(ends, base + MAX_FRAGMENTS, side='right')), start + 1)
+        batch = slice(start, stop)
+        _fill(keys, counts[batch], row_pixel[batch], row_depth[batch], row_step[batch], row_id[batch])
+        start = stop
+
+def _fill(keys, counts, row_pixel, row_depth, row_step, row_id):
+    # writes the pixels of a batch of spans into the depth buffer
+    profiling.count('render.fragments', int(counts.sum()))
+    # pixel i of every span, one entry per pixel
+    first = np.cumsum(counts) - counts
+    i = np.arange(first[-1] + counts[-1]) - np.repeat(first, counts)
+    pixel = np.repeat(row_pixel, counts) + i
+    # np.repeat is a lot cheaper than gathering the span data with fancy indexing
+    depth = np.repeat(row_step, counts)
+    depth *= i
+    depth += np.repeat(row_depth, counts)
+
+    # float32 bits ordered like the floats, then (depth, id) in one int64 key
+    bits = depth.view(np.int32)
+    bits ^= (bits >> 31) & 0x7FFFFFFF
+    key = bits.astype(np.int64)
+    key <<= 32
+    key |= np.repeat(row_id, counts)
+    np.minimum.at(keys, pixel, key)
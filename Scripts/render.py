@@ -0,0 +1,216 @@
+import numpy as np
+import pygame
+
+import profiling
+
+# segments longer than this (in pixels, after clipping) are left to pygame.draw.line
+# instead of being rasterized point by point
+MAX_RASTER_SEGMENT = 4096
+# draw_instances projects at most this many points at once (instances x vertices)
+MAX_BATCH_POINTS = 1 << 20
+
+def orthographic_matrix(scale, offset):
+    # 3x4 orthographic screen matrix: x * scale + offset, with Y inverted (as in pygame)
+    # the last row keeps w, so it can be fused with any 4x4 model matrix
+    return np.array([
+        [scale, 0,      0, offset[0]],
+        [0,     -scale, 0, offset[1]],
+        [0,     0,      0, 1],
+    ], dtype=np.float64)
+
+def project_orthographic_array(coords, scale, offset, model_matrix=None):
+    # project_array with orthographic_matrix, for an (N, 3) array at once
+    return project_array(coords, orthographic_matrix(scale, offset), model_matrix)
+
+def project_array(coords, projection, model_matrix=None):
+    # projects an (N, 3) array with a 3x4 (x, y, w) or a 4x4 (x, y, depth, w) screen
+    # matrix, like the ones of orthographic_matrix and camera.OrbitCamera.matrix
+    # the model matrix is fused with the projection, so the vertices are
+    # only touched once per frame; returns an (N, 2) float array of screen positions
+    # (NaN for the points behind the eye, w <= 0)
+    coords = np.asarray(coords, dtype=np.float64)
+    if model_matrix is not None:
+        projection = projection @ model_matrix
+
+    projected = coords @ projection[:2, :3].T + projection[:2, 3]
+    w = projection[-1]
+    if w[0] != 0 or w[1] != 0 or w[2] != 0 or w[3] != 1:
+        # only for perspective projections and non-affine model matrices
+        w = coords @ w[:3] + w[3]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            projected /= np.where(w > 0, w, np.nan)[:, None]
+    return projected
+
+def project_instances(coords, projection, model_matrices):
+    # project_array for an (I, 4, 4) stack of model matrices at once,
+    # every instance shares coords; returns an (I, N, 2) array
+    coords = np.asarray(coords, dtype=np.float64)
+    projection = projection @ np.asarray(model_matrices, dtype=np.float64)
+
+    projected = np.matmul(coords, np.swapaxes(projection[:, :2, :3], 1, 2)) + projection[:, None, :2, 3]
+    w = projection[:, -1]
+    if not (np.all(w[:, :3] == 0) and np.all(w[:, 3] == 1)):
+        # only for perspective projections and non-affine model matrices
+        w = (coords @ w[:, :3].T + w[:, 3]).T
+        with np.errstate(divide='ignore', invalid='ignore'):
+            projected /= np.where(w > 0, w, np.nan)[..., None]
+    return projected
+
+def draw_instances(surface, coords, edges, model_matrices, projection, color, clip_rect=None):
+    # draws the same edges once for every model matrix, projected with a screen matrix
+    # (see project_array); instances are projected in batches, then all their edges
+    # are drawn in one draw_edges call (clip_rect is passed to draw_edges)
+    # edges with an end behind the eye are not drawn
+    n_points = max(len(coords), 1)
+    per_batch = max(1, MAX_BATCH_POINTS // n_points)
+    for start in range(0, len(model_matrices), per_batch):
+        batch = model_matrices[start:start + per_batch]
+        with profiling.timed('render.project'):
+            points = project_instances(coords, projection, batch).reshape(-1, 2)
+        # the edges of instance i point to rows i * N ... i * N + N - 1
+        shift = (np.arange(len(batch)) * len(coords))[:, None, None]
+        with profiling.timed('render.draw'):
+            draw_edges(surface, points, (edges[None] + shift).reshape(-1, 2), color, clip_rect)
+        profiling.count('render.edges', len(edges) * len(batch))
+
+def clip_segments(start, delta, clip_rect):
+    # culls and clips the segments start -> start + delta to a pygame.Rect, all at once
+    # returns (kept, t_enter, t_exit): the rows of the segments that are at least partly
+    # inside, and the part of each one that is, as start + t * delta for t in [t_enter, t_exit]
+    # (the bounds are one pixel wider on the left and top, where a truncated position
+    # still lands inside)
+    x_min, y_min = clip_rect.left - 1, clip_rect.top - 1
+    x_max, y_max = clip_rect.right, clip_rect.bottom
+
+    # segments with both ends beyond the same border are dropped before anything else
+    x0, y0 = start[:, 0], start[:, 1]
+    x1, y1 = x0 + delta[:, 0], y0 + delta[:, 1]
+    outside = ((np.maximum(x0, x1) <= x_min) | (np.minimum(x0, x1) >= x_max) |
+               (np.maximum(y0, y1) <= y_min) | (np.minimum(y0, y1) >= y_max))
+    kept = np.flatnonzero(~outside)
+    profiling.count('render.culled', len(start) - len(kept))
+    t_enter = np.zeros(len(kept), dtype=start.dtype)
+    t_exit = np.ones(len(kept), dtype=start.dtype)
+
+    # only the segments that cross a border need clipping
+    x0, y0, x1, y1 = x0[kept], y0[kept], x1[kept], y1[kept]
+    crossing = np.flatnonzero((np.minimum(x0, x1) < x_min) | (np.maximum(x0, x1) > x_max) |
+                              (np.minimum(y0, y1) < y_min) | (np.maximum(y0, y1) > y_max))
+    if len(crossing) == 0:
+        return kept, t_enter, t_exit
+    profiling.count('render.clipped', len(crossing))
+
+    # Liang-Barsky: every border limits t from below (entering) or from above (leaving)
+    s, d = start[kept[crossing]], delta[kept[crossing]]
+    enter = np.zeros(len(s), dtype=s.dtype)
+    exit_ = np.ones(len(s), dtype=s.dtype)
+    visible = np.ones(len(s), dtype=bool)
+    for p, q in ((-d[:, 0], s[:, 0] - x_min), (d[:, 0], x_max - s[:, 0]),
+                 (-d[:, 1], s[:, 1] - y_min), (d[:, 1], y_max - s[:, 1])):
+        # parallel to this border: visible only on the inner side
+        visible &= (p != 0) | (q >= 0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            r = q / p
+        np.maximum(enter, r, out=enter, where=p < 0)
+        np.minimum(exit_, r, out=exit_, where=p > 0)
+    visible &= enter <= exit_
+
+    t_enter[crossing] = enter
+    t_exit[crossing] = exit_
+    keep = np.ones(len(kept), dtype=bool)
+    keep[crossing] = visible
+    return kept[keep], t_enter[keep], t_exit[keep]
+
+def draw_edges(surface, points, edges, color, clip_rect=None):
+    # draws every edge (an (E, 2) array of rows of points) as a 1 pixel line
+    # the lines are rasterized with numpy and written to the surface pixels in one go,
+    # instead of one pygame.draw.line call per edge
+    # nothing is drawn outside clip_rect (the whole surface by default): edges outside it
+    # are dropped and only the samples of the visible part of the others are made, so a
+    # zoomed-in view only pays for what is on screen
+    if len(edges) == 0:
+        return
+    clip_rect = surface.get_rect().clip(pygame.Rect(clip_rect)) if clip_rect is not None else surface.get_rect()
+
+    points = np.asarray(points, dtype=np.float32)
+    if not np.isfinite(points).all():
+        finite = np.isfinite(points).all(axis=1)
+        edges = edges[finite[edges[:, 0]] & finite[edges[:, 1]]]
+
+    start = points[edges[:, 0]]
+    delta = points[edges[:, 1]] - start
+    # when every point is on screen (the usual case) there is nothing to clip
+    low, high = (points.min(axis=0), points.max(axis=0)) if len(points) else ((0, 0), (0, 0))
+    all_inside = (low[0] >= clip_rect.left and low[1] >= clip_rect.top and
+                  high[0] < clip_rect.right and high[1] < clip_rect.bottom)
+    if not all_inside:
+        kept, t_enter, t_exit = clip_segments(start, delta, clip_rect)
+        if len(kept) == 0:
+            return
+        start, delta = start[kept], delta[kept]
+    steps = np.abs(delta).max(axis=1)
+    np.ceil(steps, out=steps)
+
+    if all_inside:
+        t_enter = np.zeros(len(start), dtype=np.float32)
+        t_exit = np.ones(len(start), dtype=np.float32)
+        first_step = np.zeros(len(start), dtype=np.int32)
+        steps = steps.astype(np.int32)
+        visible_steps = steps
+    else:
+        # the samples are the same as for the whole segment, the ones outside are just not made
+        first_step = np.ceil(t_enter * steps - 1e-3)
+        last_step = np.floor(t_exit * steps + 1e-3)
+        steps = steps.astype(np.int32)
+        first_step = first_step.astype(np.int32)
+        visible_steps = last_step.astype(np.int32) - first_step
+
+    long_segments = visible_steps > MAX_RASTER_SEGMENT
+    if long_segments.any():
+        for (x0, y0), (dx, dy), t0, t1 in zip(start[long_segments].tolist(), delta[long_segments].tolist(),
+                                              t_enter[long_segments].tolist(), t_exit[long_segments].tolist()):
+            pygame.draw.line(surface, color, (int(x0 + t0 * dx), int(y0 + t0 * dy)), (int(x0 + t1 * dx), int(y0 + t1 * dy)), 1)
+        short = ~long_segments
+        start, delta, steps = start[short], delta[short], steps[short]
+        first_step, visible_steps = first_step[short], visible_steps[short]
+    drawn = visible_steps >= 0
+    if not drawn.all():
+        start, delta, steps = start[drawn], delta[drawn], steps[drawn]
+        first_step, visible_steps = first_step[drawn], visible_steps[drawn]
+    if len(start) == 0:
+        return
+
+    # one sample per pixel along the longest axis of each segment (a DDA, but for all segments)
+    counts = visible_steps + 1
+    step_size = delta / np.maximum(steps, 1)[:, None]
+    first_sample = np.cumsum(counts) - counts
+    sample = np.arange(first_sample[-1] + counts[-1], dtype=np.float32)
+    sample -= np.repeat((first_sample - first_step).astype(np.float32), counts)
+    # np.repeat is a lot cheaper than gathering the segment data with fancy indexing
+    x = np.repeat(step_size[:, 0], counts)
+    x *= sample
+    x += np.repeat(start[:, 0], counts)
+    y = np.repeat(step_size[:, 1], counts)
+    y *= sample
+    y += np.repeat(start[:, 1], counts)
+    x = x.astype(np.int32)
+    y = y.astype(np.int32)
+
+    # the clipped ends can still round one pixel out
+    width = surface.get_width()
+    inside = (x >= clip_rect.left) & (x < clip_rect.right) & (y >= clip_rect.top) & (y < clip_rect.bottom)
+    if not inside.all():
+        x, y = x[inside], y[inside]
+
+    pixels = pygame.surfarray.pixels2d(surface)
+    color_value = surface.map_rgb(color)
+    rows = pixels.T
+    if rows.flags.c_contiguous:
+        # write through a flat view, a 1-D scatter is faster than a 2-D one
+        y *= width
+        y += x
+        rows.reshape(-1)[y] = color_value
+    else:
+        pixels[x, y] = color_value
+    # the surface stays locked while the pixel arrays exist
+    del pixels, rows
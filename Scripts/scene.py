@@ -0,0 +1,103 @@
+import numpy as np
+
+import transformations as T
+
+class Instance:
+    # one placement of a mesh in the scene, the geometry is shared with every
+    # other instance of the same mesh; only the 4x4 model matrix is its own
+
+    __slots__ = ('scene', 'mesh', '_model_matrix', 'name')
+
+    def __init__(self, scene, mesh, model_matrix, name=None):
+        self.scene = scene
+        self.mesh = mesh
+        self._model_matrix = model_matrix
+        self.name = name
+
+    @property
+    def model_matrix(self):
+        return self._model_matrix
+
+    @model_matrix.setter
+    def model_matrix(self, matrix):
+        self._model_matrix = np.array(matrix, dtype=float)
+        self.scene._matrix_stacks.pop(id(self.mesh), None)
+
+    def apply_transform(self, transformation_matrix):
+        self.model_matrix = transformation_matrix @ self._model_matrix
+
+    def __repr__(self):
+        return f"Instance({self.name or id(self)})"
+
+class Scene:
+    # a list of instances; the world position of a vertex of an instance is
+    # instance.model_matrix @ mesh.model_matrix @ vertex, so a transformation applied
+    # to the mesh (like in the GUI) moves every copy, each in its own place
+
+    def __init__(self):
+        self.instances = []
+        # (I, 4, 4) stack of instance matrices for each mesh, rebuilt after a change
+        self._matrix_stacks = {}
+
+    def add_instance(self, mesh, model_matrix=None, name=None):
+        if model_matrix is None:
+            model_matrix = np.identity(4)
+        instance = Instance(self, mesh, np.array(model_matrix, dtype=float), name)
+        self.instances.append(instance)
+        self._matrix_stacks.pop(id(mesh), None)
+        return instance
+
+    def add_instances(self, mesh, model_matrices):
+        # one instance for every matrix of an (I, 4, 4) stack
+        # (build_transformation_matrices makes those stacks)
+        return [self.add_instance(mesh, matrix) for matrix in np.asarray(model_matrices, dtype=float)]
+
+    def add_grid(self, mesh, count, spacing=None):
+        # count copies in a square grid on the XY plane, centred on the origin
+        # by default the copies are spaced by 1.5x the largest side of the mesh
+        if spacing is None:
+            coords = mesh.coords_array()
+            size = float(np.ptp(coords, axis=0).max()) if len(coords) else 1.0
+            spacing = 1.5 * size if size > 0 else 1.0
+
+        columns = int(np.ceil(np.sqrt(count)))
+        rows = np.arange(count) // columns
+        cols = np.arange(count) % columns
+        tx = (cols - (columns - 1) / 2) * spacing
+        ty = (rows.max(initial=0) / 2 - rows) * spacing
+        matrices = T.build_transformation_matrices([('translate', tx, ty, 0.0)])
+        return self.add_instances(mesh, matrices)
+
+    def remove_instance(self, instance):
+        self.instances.remove(instance)
+        self._matrix_stacks.pop(id(instance.mesh), None)
+
+    def meshes(self):
+        # every mesh used in the scene, once, in the order they were added
+        unique = {}
+        for instance in self.instances:
+            unique.setdefault(id(instance.mesh), instance.mesh)
+        return list(unique.values())
+
+    def instance_matrices(self, mesh):
+        # (I, 4, 4) matrices of every instance of mesh, without the mesh model matrix
+        stack = self._matrix_stacks.get(id(mesh))
+        if stack is None:
+            matrices = [i.model_matrix for i in self.instances if i.mesh is mesh]
+            stack = np.array(matrices, dtype=float).reshape(-1, 4, 4)
+            self._matrix_stacks[id(mesh)] = stack
+        return stack
+
+    def world_matrices(self, mesh):
+        # (I, 4, 4) instance matrices combined with the model matrix of the mesh
+        return self.instance_matrices(mesh) @ mesh.model_matrix
+
+    def world_coords(self, mesh):
+        # (I, N, 3) coordinates of every instance of mesh, in one batched operation
+        return T.apply_matrices_to_points(self.world_matrices(mesh), mesh.coords_array())
+
+    def __len__(self):
+        return len(self.instances)
+
+    def __iter__(self):
+        return iter(self.instances)
@@ -0,0 +1,45 @@
+import os
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+
+from mesh_cache import load_mesh, read_cache
+from winged_edge import CompactEdgeMesh
+
+CUBE = Path(__file__).resolve().parent / 'Objects' / 'test-cube.obj'
+
+class UnwritableCacheTest(unittest.TestCase):
+    # a cache directory that can't be created must not stop the mesh from loading
+
+    def setUp(self):
+        self.tmp = Path(tempfile.mkdtemp())
+        self.obj_path = self.tmp / 'cube.obj'
+        shutil.copy(CUBE, self.obj_path)
+        # a regular file where the cache directory should be
+        self.blocker = self.tmp / 'not-a-directory'
+        self.blocker.write_text('')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def test_mesh_loads_without_cache(self):
+        cache_dir = self.blocker / 'cache'
+        mesh = load_mesh(self.obj_path, compact=True, cache_dir=cache_dir)
+        self.assertIsInstance(mesh, CompactEdgeMesh)
+        self.assertEqual(len(mesh.faces), len(load_mesh(self.obj_path, compact=True, use_cache=False).faces))
+        self.assertIsNone(read_cache(self.obj_path, cache_dir))
+
+    @unittest.skipIf(os.name == 'nt' or os.geteuid() == 0, "permissions are not enforced")
+    def test_read_only_directory(self):
+        cache_dir = self.tmp / 'read-only'
+        cache_dir.mkdir()
+        cache_dir.chmod(0o555)
+        try:
+            mesh = load_mesh(self.obj_path, compact=True, cache_dir=cache_dir)
+            self.assertEqual(len(mesh.vertices), 8)
+        finally:
+            cache_dir.chmod(0o755)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,6 @@
 import numpy as np
 import math
+from functools import lru_cache
 
 def get_translation_matrix(tx, ty, tz=None):
     # if tz is None, returns a 2D translation matrix (3x3 homogeneous).
@@ -75,84 +76,272 @@ def get_rotation_matrix_3d(axis, angle_degrees):
     else:
         raise ValueError("Invalid rotation axis. Must be 'x', 'y', or 'z'.")
 
+# parameters expected by every operation, for each dimension: (count, names, label)
+_OPERATIONS = {
+    3: {
+        'translate': (3, "tx, ty, tz", "Translate 3D"),
+        'scale': (3, "sx, sy, sz", "Scale 3D"),
+        'rotatex': (1, "angle_degrees", "RotateX"),
+        'rotatey': (1, "angle_degrees", "RotateY"),
+        'rotatez': (1, "angle_degrees", "RotateZ"),
+    },
+    2: {
+        'translate': (2, "tx, ty", "Translate 2D"),
+        'scale': (2, "sx, sy", "Scale 2D"),
+        'rotate': (1, "angle_degrees", "Rotate 2D"),
+    },
+}
+# how many compiled sequences compile_transform keeps
+COMPILED_CACHE_SIZE = 256
+
+def _check_step(transform, dim):
+    # checks one (operation, *params) tuple, returns it as (operation, params)
+    if not isinstance(transform, tuple) or not transform:
+        raise ValueError(f"Each transformation must be a non-empty tuple. Got: {transform}")
+
+    operation = transform[0].lower()
+    params = transform[1:]
+
+    if operation not in _OPERATIONS[dim]:
+        raise ValueError(f"Unknown {dim}D transformation operation: '{operation}' in {transform}")
+    count, names, label = _OPERATIONS[dim][operation]
+    if len(params) != count:
+        raise ValueError(f"{label} expects {count} parameter{'s' if count > 1 else ''} ({names}), got {len(params)} for {transform}")
+
+    return operation, params
+
+def _validate_step(transform, dim):
+    operation, params = _check_step(transform, dim)
+    return operation, tuple(float(p) for p in params)
+
+def _fuse_steps(steps):
+    # consecutive steps of the same kind are merged in closed form:
+    # translations add up, scales multiply and rotations about the same axis add their angles
+    fused = []
+    for operation, params in steps:
+        if fused and fused[-1][0] == operation:
+            previous = fused[-1][1]
+            if operation == 'scale':
+                params = tuple(a * b for a, b in zip(previous, params))
+            else:
+                params = tuple(a + b for a, b in zip(previous, params))
+            fused[-1] = (operation, params)
+        else:
+            fused.append((operation, params))
+    return fused
+
+def _step_matrix(operation, params, dim):
+    if operation == 'translate':
+        return get_translation_matrix(*params)
+    if operation == 'scale':
+        return get_scaling_matrix(*params)
+    if operation == 'rotate':
+        return get_rotation_matrix_2d(params[0])
+    return get_rotation_matrix_3d(operation[-1], params[0])
+
+def _inverse_step(operation, params):
+    # the inverse of every operation is the same operation with other parameters
+    if operation == 'translate':
+        return operation, tuple(-p for p in params)
+    if operation == 'scale':
+        return operation, tuple(1.0 / p for p in params)
+    return operation, (-params[0],)
+
+def _compose(steps, dim):
+    # To apply T1, then T2, then T3,
+    # we do composite_matrix = current_transform_matrix @ composite_matrix
+    composite_matrix = np.identity(dim + 1, dtype=float)
+    for operation, params in steps:
+        composite_matrix = _step_matrix(operation, params, dim) @ composite_matrix
+    return composite_matrix
+
+class CompiledTransform:
+    # a transformation sequence that was validated and fused once,
+    # matrix and inverse are only computed the first time they are used
+    # the matrices are read-only because compile_transform shares them
+
+    def __init__(self, transform_sequence, dim=3):
+        if dim not in _OPERATIONS:
+            raise ValueError("Dimension must be 2 or 3.")
+        self.dim = dim
+        self.steps = tuple(_fuse_steps(_validate_step(t, dim) for t in transform_sequence))
+        self._matrix = None
+        self._inverse = None
+
+    @property
+    def matrix(self):
+        if self._matrix is None:
+            self._matrix = _compose(self.steps, self.dim)
+            self._matrix.flags.writeable = False
+        return self._matrix
+
+    @property
+    def inverse(self):
+        if self._inverse is None:
+            if any(op == 'scale' and 0.0 in params for op, params in self.steps):
+                raise np.linalg.LinAlgError("The transformation has a zero scale and can't be inverted.")
+            # the steps are undone in the reverse order
+            steps = [_inverse_step(op, params) for op, params in reversed(self.steps)]
+            self._inverse = _compose(steps, self.dim)
+            self._inverse.flags.writeable = False
+        return self._inverse
+
+    def apply(self, points):
+        return transform_points(self.matrix, points)
+
+    def __repr__(self):
+        return f"CompiledTransform({list(self.steps)}, dim={self.dim})"
+
+@lru_cache(maxsize=COMPILED_CACHE_SIZE)
+def _compile_cached(transform_sequence, dim):
+    return CompiledTransform(transform_sequence, dim)
+
+def compile_transform(transform_sequence, dim=3):
+    # returns the CompiledTransform of a sequence, the same sequence
+    # is only validated and multiplied once (LRU cache keyed on the sequence)
+    transform_sequence = tuple(transform_sequence)
+    try:
+        return _compile_cached(transform_sequence, dim)
+    except TypeError:
+        # unhashable parameters can't be cached
+        return CompiledTransform(transform_sequence, dim)
+
 def build_transformation_matrix(transform_sequence, dim=3):
-    if dim == 3:
-        # Start with a 4x4 identity matrix for 3D
-        composite_matrix = np.identity(4, dtype=float)
-    elif dim == 2:
-        # Start with a 3x3 identity matrix for 2D
-        composite_matrix = np.identity(3, dtype=float)
+    # a copy, so the caller can change it without touching the cached matrix
+    return compile_transform(transform_sequence, dim).matrix.copy()
+
+# batched versions of the builders above: every parameter can be a scalar or an
+# array of F values (they are broadcast together) and the result is an (F, 4, 4)
+# stack for 3D, (F, 3, 3) for 2D, one matrix per frame of a sweep or animation
+
+def _broadcast_params(*params):
+    params = np.broadcast_arrays(*(np.asarray(p, dtype=float) for p in params))
+    return [np.ravel(p) for p in params]
+
+def _identity_stack(count, size):
+    return np.tile(np.identity(size), (count, 1, 1))
+
+def get_translation_matrices(tx, ty, tz=None):
+    if tz is None: # 2D
+        tx, ty = _broadcast_params(tx, ty)
+        matrices = _identity_stack(tx.size, 3)
+        matrices[:, 0, 2] = tx
+        matrices[:, 1, 2] = ty
+    else: # 3D
+        tx, ty, tz = _broadcast_params(tx, ty, tz)
+        matrices = _identity_stack(tx.size, 4)
+        matrices[:, 0, 3] = tx
+        matrices[:, 1, 3] = ty
+        matrices[:, 2, 3] = tz
+    return matrices
+
+def get_scaling_matrices(sx, sy, sz=None):
+    if sz is None: # 2D
+        sx, sy = _broadcast_params(sx, sy)
+        matrices = _identity_stack(sx.size, 3)
+        matrices[:, 0, 0] = sx
+        matrices[:, 1, 1] = sy
+    else: # 3D
+        sx, sy, sz = _broadcast_params(sx, sy, sz)
+        matrices = _identity_stack(sx.size, 4)
+        matrices[:, 0, 0] = sx
+        matrices[:, 1, 1] = sy
+        matrices[:, 2, 2] = sz
+    return matrices
+
+def get_rotation_matrices_2d(angles_degrees):
+    angles_rad, = _broadcast_params(np.radians(angles_degrees))
+    c, s = np.cos(angles_rad), np.sin(angles_rad)
+    matrices = _identity_stack(angles_rad.size, 3)
+    matrices[:, 0, 0], matrices[:, 0, 1] = c, -s
+    matrices[:, 1, 0], matrices[:, 1, 1] = s, c
+    return matrices
+
+def get_rotation_matrices_3d(axis, angles_degrees):
+    axis = axis.lower()
+    # rows/columns of the 2x2 block that rotates, same signs as get_rotation_matrix_3d
+    if axis == 'x':
+        i, j = 1, 2
+    elif axis == 'y':
+        i, j = 2, 0
+    elif axis == 'z':
+        i, j = 0, 1
     else:
+        raise ValueError("Invalid rotation axis. Must be 'x', 'y', or 'z'.")
+
+    angles_rad, = _broadcast_params(np.radians(angles_degrees))
+    c, s = np.cos(angles_rad), np.sin(angles_rad)
+    matrices = _identity_stack(angles_rad.size, 4)
+    matrices[:, i, i], matrices[:, i, j] = c, -s
+    matrices[:, j, i], matrices[:, j, j] = s, c
+    return matrices
+
+def build_transformation_matrices(transform_sequence, dim=3):
+    # same sequences as build_transformation_matrix, but the parameters may be arrays:
+    # [('rotateY', np.linspace(0, 360, 100)), ('translate', 0, 0, 5)] gives 100 matrices
+    if dim not in _OPERATIONS:
         raise ValueError("Dimension must be 2 or 3.")
 
+    composite_matrices = np.identity(dim + 1)[None]
     for transform in transform_sequence:
-        if not isinstance(transform, tuple) or not transform:
-            raise ValueError(f"Each transformation must be a non-empty tuple. Got: {transform}")
-        
-        operation = transform[0].lower()
-        params = transform[1:]
-        
-        current_transform_matrix = None
-
-        if dim == 3:
-            if operation == 'translate':
-                if len(params) != 3:
-                    raise ValueError(f"Translate 3D expects 3 parameters (tx, ty, tz), got {len(params)} for {transform}")
-                
-                current_transform_matrix = get_translation_matrix(params[0], params[1], params[2])
-            
-            elif operation == 'scale':
-                if len(params) != 3:
-                    raise ValueError(f"Scale 3D expects 3 parameters (sx, sy, sz), got {len(params)} for {transform}")
-                
-                current_transform_matrix = get_scaling_matrix(params[0], params[1], params[2])
-            
-            elif operation == 'rotatex':
-                if len(params) != 1:
-                    raise ValueError(f"RotateX expects 1 parameter (angle_degrees), got {len(params)} for {transform}")
-                
-                current_transform_matrix = get_rotation_matrix_3d('x', params[0])
-            
-            elif operation == 'rotatey':
-                if len(params) != 1:
-                    raise ValueError(f"RotateY expects 1 parameter (angle_degrees), got {len(params)} for {transform}")
-                
-                current_transform_matrix = get_rotation_matrix_3d('y', params[0])
-            
-            elif operation == 'rotatez':
-                if len(params) != 1:
-                    raise ValueError(f"RotateZ expects 1 parameter (angle_degrees), got {len(params)} for {transform}")
-                
-                current_transform_matrix = get_rotation_matrix_3d('z', params[0])
-            
-            else:
-                raise ValueError(f"Unknown 3D transformation operation: '{operation}' in {transform}")
-        
-        elif dim == 2:
-            if operation == 'translate':
-                if len(params) != 2:
-                    raise ValueError(f"Translate 2D expects 2 parameters (tx, ty), got {len(params)} for {transform}")
-                
-                current_transform_matrix = get_translation_matrix(params[0], params[1]) # tz is None
-            
-            elif operation == 'scale':
-                if len(params) != 2:
-                    raise ValueError(f"Scale 2D expects 2 parameters (sx, sy), got {len(params)} for {transform}")
-                
-                current_transform_matrix = get_scaling_matrix(params[0], params[1]) # sz is None
-            
-            elif operation == 'rotate': # 2D rotation
-                if len(params) != 1:
-                    raise ValueError(f"Rotate 2D expects 1 parameter (angle_degrees), got {len(params)} for {transform}")
-                
-                current_transform_matrix = get_rotation_matrix_2d(params[0])
-            
-            else:
-                raise ValueError(f"Unknown 2D transformation operation: '{operation}' in {transform}")
+        operation, params = _check_step(transform, dim)
+        if operation == 'translate':
+            current = get_translation_matrices(*params)
+        elif operation == 'scale':
+            current = get_scaling_matrices(*params)
+        elif operation == 'rotate':
+            current = get_rotation_matrices_2d(params[0])
+        else:
+            current = get_rotation_matrices_3d(operation[-1], params[0])
+        # (1 or F) @ (1 or F): a step with scalar parameters is shared by every frame
+        composite_matrices = current @ composite_matrices
+
+    return composite_matrices
+
+def apply_matrices_to_points(matrices, points):
+    # applies an (F, 4, 4) stack to the same (N, 3) points (or (F, 3, 3) to (N, 2))
+    # and returns every frame at once, an (F, N, dim) masked array like transform_points
+    # for long animations use iter_transformed_frames, (F, N, dim) can be very big
+    points = np.asarray(points, dtype=float)
+    matrices = np.asarray(matrices, dtype=float)
+    dim = matrices.shape[-1] - 1
+
+    cartesian = np.matmul(points, np.swapaxes(matrices[:, :dim, :dim], 1, 2)) + matrices[:, None, :dim, dim]
+    w = points @ matrices[:, dim, :dim].T + matrices[:, dim, dim]  # (N, F)
+    w = w.T
+    invalid = w == 0
+
+    if not np.all(w == 1):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            cartesian /= w[..., None]
+
+    if not invalid.any():
+        return np.ma.masked_array(cartesian, mask=np.ma.nomask)
+    frames, rows = np.nonzero(invalid)
+    cartesian[frames, rows] = points[rows]
+    return np.ma.masked_array(cartesian, mask=np.repeat(invalid[..., None], dim, axis=2))
+
+def iter_transformed_frames(matrices, points, frames_per_chunk=16):
+    # streams the frames of apply_matrices_to_points, one (N, dim) masked array at a time,
+    # computed frames_per_chunk at once so only that many frames are in memory
+    for start in range(0, len(matrices), frames_per_chunk):
+        chunk = apply_matrices_to_points(matrices[start:start + frames_per_chunk], points)
+        for frame in chunk:
+            yield frame
+
+def transform_points(matrix, points):
+    # Applies a homogeneous matrix (4x4 for 3D, 3x3 for 2D) to every row of points at once.
+    # returns a masked array: rows where w == 0 are masked and keep their original values
+    points = np.asarray(points, dtype=float)
+    dim = matrix.shape[0] - 1
+
+    # (N, dim + 1) homogeneous result, without building the (N, dim + 1) input first
+    homogeneous = points @ matrix[:, :dim].T + matrix[:, dim]
+    w = homogeneous[:, dim]
+    invalid = w == 0
 
-        if current_transform_matrix is not None:
-            # To apply T1, then T2, then T3,
-            # we do composite_matrix = current_transform_matrix @ composite_matrix
-            composite_matrix = current_transform_matrix @ composite_matrix
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cartesian = homogeneous[:, :dim] / w[:, None]
+    cartesian[invalid] = points[invalid]
 
-    return composite_matrix
\ No newline at end of file
+    return np.ma.masked_array(cartesian, mask=np.repeat(invalid[:, None], dim, axis=1))
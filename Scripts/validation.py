@@ -0,0 +1,136 @@
+import numpy as np
+
+# how many examples of each problem ValidationReport.log prints by default
+VALIDATION_LOG_LIMIT = 5
+
+class ValidationReport:
+    # result of validate_mesh_arrays, every problem is kept as an index array:
+    # - skipped_lines: .obj lines the parser couldn't read (text)
+    # - small_faces / missing_vertex_faces: faces with less than 3 vertices or with
+    #   vertices that don't exist, numbered 1.. in file order; they are not built
+    # - degenerate_faces: faces that use the same vertex twice, as face ids of the built mesh
+    # - boundary_edges: edges with a face on only one side
+    # - non_manifold_edges: edges used by more than two faces
+    # - flipped_edges: edges used twice in the same direction (the two faces disagree on orientation)
+    # - unreferenced_vertices: vertices no face uses
+    # edges are (K, 2) arrays of vertex ids (smaller id first), vertices are vertex ids
+
+    PROBLEMS = (
+        ('skipped_lines', "lines that couldn't be read, ignored"),
+        ('small_faces', "faces with less than 3 vertexes, ignored"),
+        ('missing_vertex_faces', "faces use vertexes which don't exist, ignored"),
+        ('degenerate_faces', "faces use the same vertex more than once"),
+        ('non_manifold_edges', "edges are shared by more than two faces (only the first two are linked)"),
+        ('flipped_edges', "edges are used in the same direction by two faces (inconsistent orientation)"),
+        ('boundary_edges', "boundary edges"),
+        ('unreferenced_vertices', "vertexes are not used by any face"),
+    )
+    # boundary edges and loose vertices are fine in an open mesh, they are not problems
+    INFO_ONLY = ('boundary_edges', 'unreferenced_vertices')
+
+    def __init__(self, n_vertices, n_faces, n_edges, **problems):
+        self.n_vertices = n_vertices
+        self.n_faces = n_faces
+        self.n_edges = n_edges
+        for name, _ in self.PROBLEMS:
+            setattr(self, name, problems.get(name, np.zeros(0, dtype=np.int64)))
+
+    def counts(self):
+        return {name: len(getattr(self, name)) for name, _ in self.PROBLEMS}
+
+    def is_clean(self):
+        # True when nothing but boundary edges or loose vertices was found
+        return all(count == 0 for name, count in self.counts().items() if name not in self.INFO_ONLY)
+
+    def unbuildable_faces(self):
+        # rows (0-based, file order) of the faces the mesh can't be built with
+        return np.union1d(self.small_faces, self.missing_vertex_faces) - 1
+
+    def log(self, limit=VALIDATION_LOG_LIMIT, include_info=False):
+        # one warning line per kind of problem, with at most limit examples each
+        # (limit=0 only prints the counts)
+        for name, message in self.PROBLEMS:
+            items = getattr(self, name)
+            if len(items) == 0 or (name in self.INFO_ONLY and not include_info):
+                continue
+            line = f"Warning: {len(items)} {message}."
+            if limit:
+                examples = [_describe(item) for item in list(items[:limit])]
+                more = ", ..." if len(items) > limit else ""
+                line += f" E.g.: {', '.join(examples)}{more}"
+            print(line)
+
+    def __repr__(self):
+        found = ", ".join(f"{name}={count}" for name, count in self.counts().items() if count)
+        return f"ValidationReport(vertices={self.n_vertices}, faces={self.n_faces}, edges={self.n_edges}{', ' + found if found else ''})"
+
+def _describe(item):
+    if isinstance(item, str):
+        return repr(item)
+    if np.ndim(item):
+        return str(tuple(int(i) for i in item))
+    return str(int(item))
+
+def validate_mesh_arrays(n_vertices, face_offsets, face_vertices, skipped_lines=()):
+    # checks a flat face list (face i uses the 0-based vertex rows face_vertices[face_offsets[i]:face_offsets[i + 1]])
+    # in O(corners log corners), without building the mesh, and returns a ValidationReport
+    face_offsets = np.asarray(face_offsets, dtype=np.int64)
+    face_vertices = np.asarray(face_vertices, dtype=np.int64)
+    sizes = np.diff(face_offsets)
+    corner_face = np.repeat(np.arange(len(sizes)), sizes)
+
+    # faces that can't be built at all
+    small = sizes < 3
+    missing = np.zeros(len(sizes), dtype=bool)
+    missing[corner_face[(face_vertices < 0) | (face_vertices >= n_vertices)]] = True
+    missing &= ~small
+    keep = ~(small | missing)
+
+    if not keep.all():
+        keep_corner = keep[corner_face]
+        face_vertices = face_vertices[keep_corner]
+        sizes = sizes[keep]
+        face_offsets = np.zeros(len(sizes) + 1, dtype=np.int64)
+        np.cumsum(sizes, out=face_offsets[1:])
+        corner_face = np.repeat(np.arange(len(sizes)), sizes)
+
+    # every corner i is the half-edge face_vertices[i] -> the next corner of its face
+    next_corner = np.arange(len(face_vertices)) + 1
+    last = face_offsets[1:] - 1
+    next_corner[last] = face_offsets[:-1]
+    starts = face_vertices
+    ends = face_vertices[next_corner]
+
+    # faces that use a vertex twice: sorted (face, vertex) pairs with an equal neighbour
+    pairs = np.sort(corner_face * max(n_vertices, 1) + face_vertices)
+    repeated = pairs[1:][pairs[1:] == pairs[:-1]]
+    degenerate = np.unique(repeated // max(n_vertices, 1)) + 1
+
+    # the edges: both directions of a vertex pair share one key
+    real = starts != ends
+    lo = np.minimum(starts, ends)[real]
+    hi = np.maximum(starts, ends)[real]
+    forward = (starts < ends)[real]
+    keys, inverse, uses = np.unique(lo * n_vertices + hi, return_inverse=True, return_counts=True)
+    forward_uses = np.bincount(inverse.reshape(-1), weights=forward, minlength=len(keys))
+    edge_ids = np.stack([keys // n_vertices, keys % n_vertices], axis=1) + 1 if len(keys) else np.zeros((0, 2), dtype=np.int64)
+
+    boundary = uses == 1
+    non_manifold = uses > 2
+    # two faces on one edge must walk it in opposite directions
+    flipped = (uses == 2) & (forward_uses != 1)
+
+    used = np.zeros(n_vertices, dtype=bool)
+    used[face_vertices] = True
+
+    return ValidationReport(
+        n_vertices, len(sizes), len(keys),
+        skipped_lines=list(skipped_lines),
+        small_faces=np.flatnonzero(small) + 1,
+        missing_vertex_faces=np.flatnonzero(missing) + 1,
+        degenerate_faces=degenerate,
+        boundary_edges=edge_ids[boundary],
+        non_manifold_edges=edge_ids[non_manifold],
+        flipped_edges=edge_ids[flipped],
+        unreferenced_vertices=np.flatnonzero(~used) + 1,
+    )
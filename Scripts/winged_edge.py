@@ -1,3 +1,304 @@
+import os
+import re
+import gzip
+import tempfile
+import warnings
+from collections.abc import Mapping
+from itertools import chain
+import numpy as np
+import transformations as T
+import profiling
+from validation import validate_mesh_arrays, VALIDATION_LOG_LIMIT
+
+# the .obj files are read in blocks of this size (in bytes)
+OBJ_CHUNK_SIZE = 8 * 1024 * 1024
+# save_mesh_to_obj formats this many vertices (or faces) per write call
+OBJ_WRITE_ROWS = 65536
+OBJ_WRITE_BUFFER = 1024 * 1024
+# gzip level for .obj.gz files, low levels are much faster and compress almost as well
+OBJ_GZIP_LEVEL = 3
+
+# an empty field in a face corner ("1//3", "1/2/", "1//")
+_EMPTY_CORNER_FIELD = re.compile(rb'/(?=/|\s|$)')
+# a face corner with more fields than the first corner of the block
+_EXTRA_CORNER_FIELD = {
+    2: re.compile(rb'/[^\s/]*/'),
+    3: re.compile(rb'/[^\s/]*/[^\s/]*/'),
+}
+
+class ObjData:
+    # arrays read from an .obj file
+    # every index is a 0-based row, -1 means "not given" (like a missing vt in "1//3")
+    # face i uses the corners face_offsets[i]:face_offsets[i + 1]
+    # skipped_lines are the lines of the file that couldn't be read
+    def __init__(self, vertices, face_offsets, face_vertices,
+                 texcoords=None, normals=None, face_texcoords=None, face_normals=None, skipped_lines=()):
+        self.vertices = vertices
+        self.face_offsets = face_offsets
+        self.face_vertices = face_vertices
+        self.texcoords = texcoords
+        self.normals = normals
+        self.face_texcoords = face_texcoords
+        self.face_normals = face_normals
+        self.skipped_lines = list(skipped_lines)
+
+    def without_faces(self, rows):
+        # a copy without the faces in rows, the per-corner arrays are cut the same way
+        sizes = np.diff(self.face_offsets)
+        keep = np.ones(len(sizes), dtype=bool)
+        keep[rows] = False
+        keep_corner = np.repeat(keep, sizes)
+        face_offsets = np.zeros(int(keep.sum()) + 1, dtype=np.int64)
+        np.cumsum(sizes[keep], out=face_offsets[1:])
+
+        def cut(corners):
+            return None if corners is None else corners[keep_corner]
+        return ObjData(self.vertices, face_offsets, self.face_vertices[keep_corner],
+                       self.texcoords, self.normals, cut(self.face_texcoords), cut(self.face_normals),
+                       self.skipped_lines)
+
+class _ObjParser:
+    # keeps the state between the chunks of one file
+    def __init__(self):
+        self.n_vertices = 0
+        self.n_texcoords = 0
+        self.n_normals = 0
+        self.vertex_blocks = []
+        self.texcoord_blocks = []
+        self.normal_blocks = []
+        self.face_size_blocks = []
+        self.corner_blocks = []
+        # lines that couldn't be read, reported by the validation after loading
+        self.skipped_lines = []
+
+    def parse_lines(self, lines):
+        v_lines = [line for line in lines if line[:2] == b'v ']
+        vt_lines = [line for line in lines if line[:3] == b'vt ']
+        vn_lines = [line for line in lines if line[:3] == b'vn ']
+        f_lines = [line for line in lines if line[:2] == b'f ']
+
+        # faces first: negative indices count from the v/vt/vn read before this block
+        if f_lines:
+            self._parse_faces(f_lines, lines)
+
+        if v_lines:
+            self.vertex_blocks.append(_parse_float_block(v_lines, 3, b'v', self.skipped_lines))
+            self.n_vertices += len(v_lines)
+        if vt_lines:
+            self.texcoord_blocks.append(_parse_float_block(vt_lines, 2, b'vt', self.skipped_lines).astype(np.float32))
+            self.n_texcoords += len(vt_lines)
+        if vn_lines:
+            self.normal_blocks.append(_parse_float_block(vn_lines, 3, b'vn', self.skipped_lines).astype(np.float32))
+            self.n_normals += len(vn_lines)
+
+    def _parse_faces(self, f_lines, lines):
+        try:
+            sizes, corners = _parse_face_block(f_lines)
+            kept = None
+        except ValueError:
+            # slow path, only for blocks with broken faces
+            kept = []
+            for i, line in enumerate(f_lines):
+                try:
+                    _parse_face_block([line])
+                    kept.append(i)
+                except ValueError:
+                    self.skipped_lines.append(line.strip().decode(errors='replace'))
+            sizes, corners = _parse_face_block([f_lines[i] for i in kept])
+
+        # obj indices are 1-based, negative ones count back from the last v/vt/vn read so far
+        resolved = corners - 1
+        if (corners < 0).any():
+            counts = np.array(self._counts_before_faces(lines), dtype=np.int64)
+            if kept is not None:
+                counts = counts[kept]
+            relative = corners < 0
+            resolved[relative] = (np.repeat(counts, sizes, axis=0) + corners)[relative]
+        resolved[resolved < 0] = -1
+
+        self.face_size_blocks.append(sizes)
+        self.corner_blocks.append(resolved)
+
+    def _counts_before_faces(self, lines):
+        # how many v/vt/vn lines come before each face line
+        counts = []
+        n_v, n_vt, n_vn = self.n_vertices, self.n_texcoords, self.n_normals
+        for line in lines:
+            head = line[:3]
+            if head[:2] == b'v ':
+                n_v += 1
+            elif head == b'vt ':
+                n_vt += 1
+            elif head == b'vn ':
+                n_vn += 1
+            elif head[:2] == b'f ':
+                counts.append((n_v, n_vt, n_vn))
+        return counts
+
+    def finish(self):
+        vertices = _concat(self.vertex_blocks, (0, 3), np.float64)
+        texcoords = _concat(self.texcoord_blocks, (0, 2), np.float32)
+        normals = _concat(self.normal_blocks, (0, 3), np.float32)
+        sizes = _concat(self.face_size_blocks, (0,), np.int64)
+        corners = _concat(self.corner_blocks, (0, 3), np.int64)
+
+        # faces that can't be built (too small, missing vertices) are kept here,
+        # EdgeMesh.load_data finds them with the validation and drops them
+        face_offsets = np.zeros(len(sizes) + 1, dtype=np.int64)
+        np.cumsum(sizes, out=face_offsets[1:])
+
+        face_texcoords = face_normals = None
+        if len(texcoords):
+            corners[corners[:, 1] >= len(texcoords), 1] = -1
+            face_texcoords = corners[:, 1].astype(np.int32)
+        if len(normals):
+            corners[corners[:, 2] >= len(normals), 2] = -1
+            face_normals = corners[:, 2].astype(np.int32)
+
+        return ObjData(vertices, face_offsets, corners[:, 0].astype(np.int32),
+                       texcoords if len(texcoords) else None,
+                       normals if len(normals) else None,
+                       face_texcoords, face_normals, self.skipped_lines)
+
+def _concat(blocks, empty_shape, dtype):
+    if not blocks:
+        return np.zeros(empty_shape, dtype=dtype)
+    return np.concatenate(blocks) if len(blocks) > 1 else blocks[0]
+
+def _numbers_from_bytes(text):
+    # parses whitespace separated numbers in C, raises ValueError on anything else
+    with warnings.catch_warnings():
+        # older numpy versions only warn about text that isn't a number
+        warnings.simplefilter('error', DeprecationWarning)
+        try:
+            return np.fromstring(text, sep=' ')
+        except DeprecationWarning as e:
+            raise ValueError(str(e))
+
+def _tagged_numbers(joined, n_lines, tag):
+    # parses a block of joined lines that start with the same tag ("v", "f", ...)
+    # the tags are turned into NaN so the line boundaries survive the bulk parse
+    values = _numbers_from_bytes(joined.replace(tag + b' ', b'nan '))
+    tag_positions = np.flatnonzero(np.isnan(values))
+    if len(tag_positions) != n_lines:
+        raise ValueError(f"unexpected values in the '{tag.decode()}' lines")
+    return values, tag_positions
+
+def _parse_float_block(lines, width, tag, skipped_lines):
+    # converts the numbers of many "v x y z" style lines at once
+    # unreadable lines become zeros (so the indices still match) and go to skipped_lines
+    try:
+        values, tag_positions = _tagged_numbers(b' '.join(lines), len(lines), tag)
+        if len(values) == len(lines) * (width + 1) and (tag_positions % (width + 1) == 0).all():
+            return values.reshape(-1, width + 1)[:, 1:]
+    except ValueError:
+        pass
+
+    # slow path: lines with extra values (w, colors), missing values or garbage
+    values = []
+    for line in lines:
+        try:
+            numbers = [float(p) for p in line.split()[1:width + 1]]
+        except ValueError:
+            numbers = []
+        if len(numbers) < width and not (tag == b'vt' and numbers):
+            skipped_lines.append(line.strip().decode(errors='replace'))
+            numbers = []
+        values.append((numbers + [0.0] * width)[:width])
+    return np.array(values, dtype=np.float64).reshape(-1, width)
+
+def _parse_face_block(f_lines):
+    # converts many "f ..." lines at once
+    # returns the amount of corners of every face and an (C, 3) array with the
+    # v, vt, vn index of every corner ("7", "7/2", "7//3", "7/2/3"); 0 means not given
+    width = 1
+    joined = b' '.join(f_lines)
+    has_slashes = b'/' in joined
+    if has_slashes:
+        joined = _EMPTY_CORNER_FIELD.sub(b'/0', joined)
+        first_tokens = joined.split(None, 2)
+        if len(first_tokens) > 1:
+            width = first_tokens[1].count(b'/') + 1
+
+    values, tag_positions = _tagged_numbers(joined.replace(b'/', b' '), len(f_lines), b'f')
+    n_values = np.diff(np.append(tag_positions, len(values))) - 1
+    numbers = np.delete(values, tag_positions)
+    if (numbers != np.trunc(numbers)).any():
+        raise ValueError("face index that isn't an integer")
+    numbers = numbers.astype(np.int64)
+
+    # the fast path needs every corner to have the same fields as the first one
+    if width == 1:
+        uniform = not has_slashes
+    else:
+        uniform = (width <= 3 and not (n_values % width).any()
+                   and joined.count(b'/') == len(numbers) // width * (width - 1)
+                   and not _EXTRA_CORNER_FIELD[width].search(joined))
+
+    if uniform:
+        corners = np.zeros((len(numbers) // width, 3), dtype=np.int64)
+        corners[:, :width] = numbers.reshape(-1, width)
+        return n_values // width, corners
+
+    # files that mix corner formats
+    sizes, corners = [], []
+    for line in joined.split(b'f ')[1:]:
+        tokens = line.split()
+        sizes.append(len(tokens))
+        for token in tokens:
+            fields = token.split(b'/')
+            if len(fields) > 3:
+                raise ValueError(f"face corner with more than 3 fields: {token!r}")
+            corners.append(([int(field) for field in fields] + [0, 0])[:3])
+    return np.array(sizes, dtype=np.int64), np.array(corners, dtype=np.int64).reshape(-1, 3)
+
+def parse_obj(filename, chunk_size=OBJ_CHUNK_SIZE, progress=None):
+    # reads the whole .obj in one pass, chunk by chunk, and returns an ObjData
+    # progress, if given, is called after every chunk with the fraction of the file read
+    # and the (V, 3) blocks of vertices read so far (the list keeps growing, don't change it)
+    parser = _ObjParser()
+    size = os.path.getsize(filename)
+    with open(filename, 'rb') as raw:
+        # .obj.gz files (like the ones save_mesh_to_obj can write) are read the same way,
+        # the progress is the part of the compressed file read so far
+        f = gzip.GzipFile(fileobj=raw) if str(filename).endswith('.gz') else raw
+        tail = b''
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            lines = (tail + chunk).split(b'\n')
+            # the last line may continue in the next chunk
+            tail = lines.pop()
+            parser.parse_lines(lines)
+            if progress is not None:
+                progress(raw.tell() / size if size else 1.0, parser.vertex_blocks)
+        if tail:
+            parser.parse_lines([tail])
+    return parser.finish()
+
+def _csr(keys, values, n_keys):
+    # groups values by key: values of key k end up in flat[offsets[k]:offsets[k + 1]]
+    # repeated (key, value) pairs are kept once, values are sorted inside each key
+    stride = int(values.max()) + 1 if len(values) else 1
+    pairs = np.unique(keys.astype(np.int64) * stride + values)
+    offsets = np.zeros(n_keys + 1, dtype=np.int64)
+    np.cumsum(np.bincount(pairs // stride, minlength=n_keys), out=offsets[1:])
+    return offsets, pairs % stride
+
+def _csr_gather(offsets, values, keys):
+    # concatenates the CSR rows of many keys at once, unknown keys give empty rows
+    keys = np.asarray(keys, dtype=np.int64).reshape(-1)
+    known = (keys >= 0) & (keys < len(offsets) - 1)
+    starts = np.where(known, offsets[np.where(known, keys, 0)], 0)
+    counts = np.where(known, offsets[np.where(known, keys, 0) + 1] - starts, 0)
+
+    out_offsets = np.zeros(len(keys) + 1, dtype=np.int64)
+    np.cumsum(counts, out=out_offsets[1:])
+    # position of every output item inside its source row
+    within = np.arange(out_offsets[-1]) - np.repeat(out_offsets[:-1], counts)
+    return out_offsets, values[np.repeat(starts, counts) + within]
+
 class Edge:
     def __init__(self, vertex_start, vertex_end):
         self.vertex_start = vertex_start
@@ -20,179 +321,1267 @@ class Face:
         self.index = index
         self.edge = None
 
+class FaceLoops:
+    # flat table with the loop of every face, walked once from the winged-edge pointers
+    # face row i (same order as mesh.faces) has the corners offsets[i]:offsets[i + 1];
+    # vertex_ids are what get_face_vertices returns and edge_rows the rows (self.edges order)
+    # of the edges it walks through; edge_keys / edge_faces are the sorted vertex ids
+    # and the (left, right) face ids of every edge (0 = None)
+    __slots__ = ('face_ids', 'offsets', 'vertex_ids', 'edge_rows', 'edge_keys', 'edge_faces', '_row_of_id')
+
+    def __init__(self, face_ids, offsets, vertex_ids, edge_rows, edge_arrays):
+        self.face_ids = face_ids
+        self.offsets = offsets
+        self.vertex_ids = vertex_ids
+        self.edge_rows = edge_rows
+        self.edge_keys = np.sort(np.stack([edge_arrays['vertex_start'], edge_arrays['vertex_end']], axis=1), axis=1)
+        self.edge_faces = np.stack([edge_arrays['left_face'], edge_arrays['right_face']], axis=1)
+        self._row_of_id = np.full((face_ids.max() + 2) if len(face_ids) else 1, -1, dtype=np.int64)
+        self._row_of_id[face_ids] = np.arange(len(face_ids))
+
+    def face_row(self, f_id):
+        return int(self._row_of_id[f_id]) if 0 <= f_id < len(self._row_of_id) else -1
+
+    def corners(self, f_id):
+        # slice of the corners of the face (empty for an unknown id)
+        row = self.face_row(f_id)
+        if row < 0:
+            return slice(0, 0)
+        return slice(int(self.offsets[row]), int(self.offsets[row + 1]))
+
+class MeshNormals:
+    # area vectors of the faces (normal * twice the area, the sum of the cross products
+    # of the fan triangles) and their sums around every vertex, which normalized are
+    # the face normals and the area-weighted vertex normals
+    # an affine matrix A maps an area vector n to cof(A) @ n exactly, where cof(A) is
+    # det(A) * inverse(A).T (the inverse transpose up to a factor, and defined even when
+    # A is singular): transformed() carries them along with the vertices, no recomputing
+    __slots__ = ('face_areas', 'vertex_areas')
+
+    def __init__(self, face_areas, vertex_areas):
+        self.face_areas = face_areas
+        self.vertex_areas = vertex_areas
+
+    @classmethod
+    def from_mesh(cls, mesh, coords=None):
+        # computed from the face loops and coords (by default, the mesh coordinates)
+        loops = mesh.face_loops()
+        coords = mesh.coords_array() if coords is None else coords
+        rows = mesh.vertex_rows(loops.vertex_ids)
+        sizes = np.diff(loops.offsets)
+        n_faces = len(sizes)
+
+        triangles = _triangulate(loops.offsets, rows)
+        a = coords[triangles[:, 0]]
+        crosses = np.cross(coords[triangles[:, 1]] - a, coords[triangles[:, 2]] - a)
+        tri_face = np.repeat(np.arange(n_faces), np.maximum(sizes - 2, 0))
+        face_areas = np.stack([np.bincount(tri_face, crosses[:, k], minlength=n_faces) for k in range(3)], axis=1)
+
+        # every face adds its area vector to each of its corners
+        corner_face = np.repeat(np.arange(n_faces), sizes)
+        vertex_areas = np.stack([np.bincount(rows, face_areas[corner_face, k], minlength=len(coords))
+                                 for k in range(3)], axis=1).reshape(-1, 3)
+        return cls(face_areas.reshape(-1, 3), vertex_areas)
+
+    def transformed(self, matrix):
+        # the area vectors after the affine 4x4 matrix is applied to the vertices
+        cofactors = _cofactor_matrix(matrix[:3, :3])
+        return MeshNormals(self.face_areas @ cofactors.T, self.vertex_areas @ cofactors.T)
+
+    def face_normals(self):
+        return _unit_rows(self.face_areas)
+
+    def vertex_normals(self):
+        return _unit_rows(self.vertex_areas)
+
 class EdgeMesh:
     def __init__(self):
         self.vertices = {}
         self.edges = {}
         self.faces = {}
+        self._reset_attributes()
+
+    def _reset_attributes(self):
+        # extra per-corner data kept from the .obj file (see ObjData)
+        self.texcoords = None
+        self.normals = None
+        self.face_texcoords = None
+        self.face_normals = None
+        # transformations that were applied but not written to the coordinates yet
+        self.model_matrix = np.identity(4)
+        # ValidationReport of the loaded file (see load_data)
+        self.validation = None
+        self.invalidate_topology()
+
+    def invalidate_topology(self):
+        # drops everything derived from the edges and faces, call it after editing them
+        self._incidence = None
+        self._edge_index = None
+        self._face_loops = None
+        self.invalidate_normals()
+
+    def invalidate_normals(self):
+        # drops the cached normals, call it after moving vertices one by one (vertex.coord = ...);
+        # set_coords_array and transform keep them right by themselves
+        self._mesh_normals = None
+
+    def vertex_rows(self, v_ids):
+        # converts vertex ids to rows of coords_array (-1 for unknown ids)
+        ids = np.fromiter(self.vertices.keys(), dtype=np.int64, count=len(self.vertices))
+        row_of_id = np.full((ids.max() + 2) if len(ids) else 1, -1, dtype=np.int64)
+        row_of_id[ids] = np.arange(len(ids))
+        v_ids = np.asarray(v_ids, dtype=np.int64)
+        known = (v_ids >= 0) & (v_ids < len(row_of_id))
+        return np.where(known, row_of_id[np.where(known, v_ids, 0)], -1)
+
+    def edge_index_array(self):
+        # (E, 2) array with the coords_array rows of both ends of every edge,
+        # in the same order as self.edges; cached until the topology changes
+        if self._edge_index is None:
+            arrays = self.edge_arrays()
+            self._edge_index = self.vertex_rows(
+                np.stack([arrays['vertex_start'], arrays['vertex_end']], axis=1))
+        return self._edge_index
+
+    def edge_arrays(self):
+        # the winged-edge slots as flat id arrays, in the same order as self.edges:
+        # vertex_start/vertex_end are vertex ids, left_face/right_face are face ids (0 = None)
+        starts, ends, lefts, rights = [], [], [], []
+        for edge in self.edges.values():
+            starts.append(edge.vertex_start)
+            ends.append(edge.vertex_end)
+            lefts.append(edge.left_face.index if edge.left_face else 0)
+            rights.append(edge.right_face.index if edge.right_face else 0)
+        return {
+            'vertex_start': np.array(starts, dtype=np.int64),
+            'vertex_end': np.array(ends, dtype=np.int64),
+            'left_face': np.array(lefts, dtype=np.int64),
+            'right_face': np.array(rights, dtype=np.int64),
+        }
+
+    def _build_incidence(self):
+        # vertex -> edges and vertex -> faces in CSR form (offsets + flat values), indexed by vertex id
+        # a face touches the start vertex of its left edges and the end vertex of its right
+        # edges, which are the same vertices get_face_vertices collects
+        arrays = self.edge_arrays()
+        n_ids = (max(self.vertices) if self.vertices else 0) + 1
+        edge_rows = np.arange(len(arrays['vertex_start']))
+
+        edge_offsets, edge_values = _csr(
+            np.concatenate([arrays['vertex_start'], arrays['vertex_end']]),
+            np.concatenate([edge_rows, edge_rows]), n_ids)
+
+        left = arrays['left_face'] > 0
+        right = arrays['right_face'] > 0
+        face_offsets, face_values = _csr(
+            np.concatenate([arrays['vertex_start'][left], arrays['vertex_end'][right]]),
+            np.concatenate([arrays['left_face'][left], arrays['right_face'][right]]), n_ids)
+
+        edge_keys = np.stack([arrays['vertex_start'], arrays['vertex_end']], axis=1)
+        self._incidence = (edge_offsets, edge_values, face_offsets, face_values, edge_keys)
+
+    def _incidence_index(self):
+        if self._incidence is None:
+            self._build_incidence()
+        return self._incidence
+
+    def faces_around_vertex(self, v_id):
+        # ids of the faces that use the vertex, sorted, in O(degree)
+        _, _, offsets, values, _ = self._incidence_index()
+        if not 0 <= v_id < len(offsets) - 1:
+            return []
+        return values[offsets[v_id]:offsets[v_id + 1]].tolist()
+
+    def edges_around_vertex(self, v_id):
+        # keys of the edges that use the vertex, in the same order as self.edges
+        offsets, values, _, _, edge_keys = self._incidence_index()
+        if not 0 <= v_id < len(offsets) - 1:
+            return []
+        return [tuple(key) for key in edge_keys[values[offsets[v_id]:offsets[v_id + 1]]].tolist()]
+
+    def faces_around_vertices(self, v_ids):
+        # batch version: returns (offsets, face_ids), the faces of v_ids[i] are
+        # face_ids[offsets[i]:offsets[i + 1]]
+        _, _, offsets, values, _ = self._incidence_index()
+        return _csr_gather(offsets, values, v_ids)
+
+    def edges_around_vertices(self, v_ids):
+        # batch version: returns (offsets, edge_keys) with edge_keys as a (K, 2) array of vertex ids
+        offsets, values, _, _, edge_keys = self._incidence_index()
+        out_offsets, rows = _csr_gather(offsets, values, v_ids)
+        return out_offsets, edge_keys[rows]
+
+    def _build_face_loops(self):
+        # one walk per face, like get_face_vertices, keeping the edges it goes through
+        arrays = self.edge_arrays()
+        edge_row = {id(edge): row for row, edge in enumerate(self.edges.values())}
+        max_edges = len(self.edges) + 1 if self.edges else 256
+
+        sizes, vertex_ids, edge_rows = [], [], []
+        for face in self.faces.values():
+            vertices, edges = _walk_face_loop(face, max_edges)
+            sizes.append(len(vertices))
+            vertex_ids.extend(vertices)
+            edge_rows.extend(edge_row[id(edge)] for edge in edges)
+
+        offsets = np.zeros(len(sizes) + 1, dtype=np.int64)
+        np.cumsum(sizes, out=offsets[1:])
+        face_ids = np.fromiter(self.faces.keys(), dtype=np.int64, count=len(self.faces))
+        return FaceLoops(face_ids, offsets, np.array(vertex_ids, dtype=np.int64),
+                         np.array(edge_rows, dtype=np.int64), arrays)
+
+    def face_loops(self):
+        # the FaceLoops table of the mesh, built on first use and kept until the topology changes
+        if self._face_loops is None:
+            self._face_loops = self._build_face_loops()
+        return self._face_loops
+
+    def face_vertex_arrays(self):
+        # vertex ids of every face, in the same order as self.faces: returns
+        # (offsets, vertex_ids), face i uses vertex_ids[offsets[i]:offsets[i + 1]]
+        loops = self.face_loops()
+        return loops.offsets, loops.vertex_ids
+
+    def face_vertex_ids(self, f_id):
+        # same list as get_face_vertices, from the cached face loops
+        loops = self.face_loops()
+        return loops.vertex_ids[loops.corners(f_id)].tolist()
+
+    def face_edge_keys(self, f_id):
+        # (smaller id, bigger id) of every edge around the face, in loop order
+        loops = self.face_loops()
+        return [tuple(key) for key in loops.edge_keys[loops.edge_rows[loops.corners(f_id)]].tolist()]
+
+    def faces_adjacent_to_face(self, f_id):
+        # ids of the faces on the other side of the edges of the face, sorted
+        loops = self.face_loops()
+        edge_faces = loops.edge_faces[loops.edge_rows[loops.corners(f_id)]]
+        # the face is on one side of each of its edges, the other side is the neighbour
+        neighbours = edge_faces.sum(axis=1) - f_id
+        return np.unique(neighbours[neighbours > 0]).tolist()
+
+    def coords_array(self):
+        # (N, 3) array with every vertex coordinate, in the same order as self.vertices
+        return np.array([v.coord for v in self.vertices.values()], dtype=np.float64).reshape(-1, 3)
+
+    def set_coords_array(self, coords):
+        for vertex, coord in zip(self.vertices.values(), np.asarray(coords).tolist()):
+            vertex.coord = tuple(coord)
+        self.invalidate_normals()
+
+    def mesh_normals(self):
+        # the MeshNormals of the coordinates, computed on first use and kept until the
+        # topology changes or the vertices are moved by something else than transform
+        if self._mesh_normals is None:
+            with profiling.timed('normals.compute'):
+                self._mesh_normals = MeshNormals.from_mesh(self)
+        return self._mesh_normals
+
+    def face_normal_array(self, world=False):
+        # (F, 3) unit normal of every face, in the same order as self.faces (zero for a
+        # face without area); world=True gives them with model_matrix applied
+        # (not to be confused with face_normals, the normal indices read from the .obj file)
+        return self._world_normals(world).face_normals()
+
+    def vertex_normal_array(self, world=False):
+        # (N, 3) area-weighted unit normal of every vertex, in the same order as self.vertices
+        return self._world_normals(world).vertex_normals()
+
+    def _world_normals(self, world):
+        normals = self.mesh_normals()
+        if not world or not self.has_model_transform():
+            return normals
+        if _is_affine(self.model_matrix):
+            return normals.transformed(self.model_matrix)
+        # a projective model matrix does not keep the planes apart, only recomputing works
+        return MeshNormals.from_mesh(self, self.world_coords_array())
+
+    def apply_model_transform(self, transformation_matrix):
+        # O(1) version of transform: the matrix is only combined with model_matrix,
+        # the coordinates stay exact until bake_model_matrix (or a save) needs them
+        self.model_matrix = transformation_matrix @ self.model_matrix
+        profiling.count('transform.model_matrix')
+
+    def has_model_transform(self):
+        return not np.array_equal(self.model_matrix, np.identity(4))
+
+    def world_coords_array(self):
+        # the coordinates with model_matrix applied, the mesh itself is not changed
+        if not self.has_model_transform():
+            return self.coords_array()
+        return T.transform_points(self.model_matrix, self.coords_array()).data
+
+    def bake_model_matrix(self):
+        # writes model_matrix into the coordinates and resets it
+        if not self.has_model_transform():
+            return None
+        transformed = self.transform(self.model_matrix)
+        self.model_matrix = np.identity(4)
+        return transformed
+
+    def transform(self, transformation_matrix):
+        # applies a 4x4 homogeneous matrix to every vertex in one batched operation
+        # returns the masked result, vertices with w == 0 are masked and not moved
+        with profiling.timed('transform.vertices'):
+            transformed = T.transform_points(transformation_matrix, self.coords_array())
+            normals = self._mesh_normals
+            self.set_coords_array(transformed.data)
+        # the cached normals follow an affine matrix, anything else recomputes them when needed
+        if normals is not None and _is_affine(transformation_matrix):
+            with profiling.timed('normals.transform'):
+                self._mesh_normals = normals.transformed(transformation_matrix)
+        return transformed
     
     def load_obj(self, filename):
+        with profiling.timed('load.parse'):
+            data = parse_obj(filename)
+        self.load_data(data)
+
+    def load(self, filename):
+        # .obj, .obj.gz, .ply or .stl, picked by the extension
+        with profiling.timed('load.parse'):
+            data = parse_mesh_file(filename)
+        self.load_data(data)
+
+    def load_data(self, data, log_limit=VALIDATION_LOG_LIMIT):
+        # builds the mesh from an ObjData (parse_obj, parse_ply or parse_stl)
+        # the arrays are validated first: the report is kept in self.validation and
+        # logged with at most log_limit examples per problem (None = don't log)
+        with profiling.timed('load.validate'):
+            report = validate_mesh_arrays(len(data.vertices), data.face_offsets, data.face_vertices, data.skipped_lines)
+            unbuildable = report.unbuildable_faces()
+            if len(unbuildable):
+                data = data.without_faces(unbuildable)
+        if log_limit is not None:
+            report.log(log_limit)
+
+        with profiling.timed('load.topology'):
+            self.build_from_arrays(data.vertices, data.face_offsets, data.face_vertices)
+        profiling.count('load.faces', len(data.face_offsets) - 1)
+        profiling.count('load.vertices', len(data.vertices))
+        self.validation = report
+        self.texcoords = data.texcoords
+        self.normals = data.normals
+        self.face_texcoords = data.face_texcoords
+        self.face_normals = data.face_normals
+
+    def build_from_arrays(self, coords, face_offsets, face_vertices):
+        # builds the winged-edge objects from a flat face list:
+        # face i uses the vertex rows face_vertices[face_offsets[i]:face_offsets[i + 1]]
         self.vertices.clear()
         self.edges.clear()
         self.faces.clear()
+        self.invalidate_topology()
 
-        file_vertex_id_counter = 1
-        parsed_vertices = {}
+        for v_id, coord in enumerate(np.asarray(coords, dtype=np.float64).tolist(), start=1):
+            self.vertices[v_id] = Vertex(v_id, tuple(coord))
 
-        with open(filename) as f:
-            lines = f.readlines()
+        offsets = np.asarray(face_offsets).tolist()
+        # the rows are 0-based, the vertex ids are 1-based
+        corner_vertex_ids = (np.asarray(face_vertices, dtype=np.int64) + 1).tolist()
 
-        for line in lines:
-            if line.startswith('v '):
-                parts = line.strip().split()
-                if len(parts) >= 4:
-                    x, y, z = parts[1], parts[2], parts[3]
-                    current_v_id = file_vertex_id_counter
-                    self.vertices[current_v_id] = Vertex(current_v_id, (float(x), float(y), float(z)))
-                    parsed_vertices[current_v_id] = self.vertices[current_v_id] # Guardar referência se necessário
-                    file_vertex_id_counter += 1
-                else: print(f"Warning: ignored edge: {line.strip()}")
-        
         face_id_counter = 1
+        # load_data drops these faces before, so this only counts for direct calls
+        n_small = n_missing = 0
 
-        for line in lines:
-            if line.startswith('f '):
-                current_face_obj = Face(face_id_counter)
-                
-                try:
-                    face_vertex_ids_in_obj_order = [int(p.split('/')[0]) for p in line.strip().split()[1:]]
-                except ValueError:
-                    print(f"Warning: malformed edge or id not in the vertex object: {line.strip()}")
-                    continue
+        for face_row in range(len(offsets) - 1):
+            current_face_obj = Face(face_id_counter)
+            face_vertex_ids_in_obj_order = corner_vertex_ids[offsets[face_row]:offsets[face_row + 1]]
 
-                num_verts_in_face = len(face_vertex_ids_in_obj_order)
+            num_verts_in_face = len(face_vertex_ids_in_obj_order)
 
-                if num_verts_in_face < 3:
-                    print(f"Warning: Face {face_id_counter} with {num_verts_in_face} vertexes, ignored.")
-                    continue
+            if num_verts_in_face < 3:
+                n_small += 1
+                continue
+
+            # checked before any edge is touched, so a dropped face never owns an edge side
+            # (and, like the small faces, it doesn't use up a face id, as in CompactEdgeMesh)
+            if any(v_id not in self.vertices for v_id in face_vertex_ids_in_obj_order):
+                n_missing += 1
+                continue
+
+            self.faces[face_id_counter] = current_face_obj
+            
+            ordered_canonical_edges_for_face = []
+            edge_orientations_relative_to_face = []
+            # the corners that got their edge side: the first face (and corner) that uses
+            # a side of an edge keeps it, with its next/prev pointers, like CompactEdgeMesh
+            # does; the later faces on a non-manifold edge are not linked to it
+            owns_side = []
+
+            for i in range(num_verts_in_face):
+                v_start_face = face_vertex_ids_in_obj_order[i]
+                v_end_face = face_vertex_ids_in_obj_order[(i + 1) % num_verts_in_face]
 
-                self.faces[face_id_counter] = current_face_obj
+                edge_key = tuple(sorted((v_start_face, v_end_face)))
+
+                canonical_edge = self.edges.get(edge_key)
+                if not canonical_edge:
+                    canonical_edge = Edge(edge_key[0], edge_key[1])
+                    self.edges[edge_key] = canonical_edge
                 
-                ordered_canonical_edges_for_face = []
-                edge_orientations_relative_to_face = []
-
-                for i in range(num_verts_in_face):
-                    v_start_face = face_vertex_ids_in_obj_order[i]
-                    v_end_face = face_vertex_ids_in_obj_order[(i + 1) % num_verts_in_face]
-
-                    if v_start_face not in self.vertices or v_end_face not in self.vertices:
-                        print(f"Warning: Face {face_id_counter} uses the vertex {v_start_face} or the vertex {v_end_face} which doesn't exists.")
-                        if current_face_obj.index in self.faces:
-                             # if already in the list, we remove it
-                             del self.faces[current_face_obj.index]
-                        ordered_canonical_edges_for_face = []
-                        break
-
-                    edge_key = tuple(sorted((v_start_face, v_end_face)))
-
-                    canonical_edge = self.edges.get(edge_key)
-                    if not canonical_edge:
-                        canonical_edge = Edge(edge_key[0], edge_key[1])
-                        self.edges[edge_key] = canonical_edge
-                    
-                    ordered_canonical_edges_for_face.append(canonical_edge)
-
-                    # If canonical_edge.vertex_start == v_start_face, the orientation
-                    # (v_start_face -> v_end_face) is alingned with the orientation for canonical_edge.
-                    # so the face is left to the canonical_edge.
-                    is_aligned_with_canonical = (canonical_edge.vertex_start == v_start_face)
-                    edge_orientations_relative_to_face.append(is_aligned_with_canonical)
-
-                    if is_aligned_with_canonical:
-                        if canonical_edge.left_face is None:
-                            canonical_edge.left_face = current_face_obj
-
-                    else: 
-                        # face edge is opposite from the canonical_edge, meaning that is the face to the right.
-                        if canonical_edge.right_face is None:
-                            canonical_edge.right_face = current_face_obj
-                        
-                # check for possible errors
-                if not ordered_canonical_edges_for_face:
-                    face_id_counter +=1 
+                ordered_canonical_edges_for_face.append(canonical_edge)
+
+                # If canonical_edge.vertex_start == v_start_face, the orientation
+                # (v_start_face -> v_end_face) is alingned with the orientation for canonical_edge.
+                # so the face is left to the canonical_edge.
+                is_aligned_with_canonical = (canonical_edge.vertex_start == v_start_face)
+                edge_orientations_relative_to_face.append(is_aligned_with_canonical)
+
+                if is_aligned_with_canonical:
+                    owns_side.append(canonical_edge.left_face is None)
+                    if canonical_edge.left_face is None:
+                        canonical_edge.left_face = current_face_obj
+
+                else: 
+                    # face edge is opposite from the canonical_edge, meaning that is the face to the right.
+                    owns_side.append(canonical_edge.right_face is None)
+                    if canonical_edge.right_face is None:
+                        canonical_edge.right_face = current_face_obj
+
+            # define face.edge as the first edge
+            current_face_obj.edge = ordered_canonical_edges_for_face[0]
+
+            # configure pointers next and prev to the face cycle, only on the edge sides
+            # this face owns
+            # there was an error with this logic (was using next_left in the wrong place)
+            for i in range(num_verts_in_face):
+                if not owns_side[i]:
                     continue
+                edge_c = ordered_canonical_edges_for_face[i]
+                edge_n = ordered_canonical_edges_for_face[(i + 1) % num_verts_in_face]
+                edge_p = ordered_canonical_edges_for_face[(i - 1 + num_verts_in_face) % num_verts_in_face]
 
+                if edge_orientations_relative_to_face[i]:
+                    edge_c.next_left = edge_n
+                    edge_c.prev_left = edge_p
+                else:
+                    edge_c.next_right = edge_n
+                    edge_c.prev_right = edge_p
 
-                # define face.edge as the first edge
-                if ordered_canonical_edges_for_face:
-                    current_face_obj.edge = ordered_canonical_edges_for_face[0]
-
-                # configure pointers next and prev to the face cycle
-                # there was an error with this logic (was using next_left in the wrong place)
-                for i in range(num_verts_in_face):
-                    edge_c = ordered_canonical_edges_for_face[i]
-                    edge_p = ordered_canonical_edges_for_face[(i - 1 + num_verts_in_face) % num_verts_in_face]
-                    
-                    c_is_aligned = edge_orientations_relative_to_face[i]
-                    p_is_aligned = edge_orientations_relative_to_face[(i - 1 + num_verts_in_face) % num_verts_in_face]
-
-                    # now we check if the previous is alingned with the canonical face
-                    if p_is_aligned:
-                        edge_p.next_left = edge_c
-                    else: 
-                        edge_p.next_right = edge_c
-                    
-                    if c_is_aligned: 
-                        edge_c.prev_left = edge_p
-                    else: 
-                        edge_c.prev_right = edge_p
-                
-                face_id_counter += 1
+            face_id_counter += 1
+
+        # one line for all the faces, instead of one per face
+        if n_small:
+            print(f"Warning: {n_small} faces with less than 3 vertexes, ignored.")
+        if n_missing:
+            print(f"Warning: {n_missing} faces use vertexes which don't exist, ignored.")
+
+class CompactVertex:
+    # lightweight view of one vertex of a CompactEdgeMesh
+    # it behaves like Vertex, but reads and writes straight to the arrays
+    __slots__ = ('mesh', 'row')
+
+    def __init__(self, mesh, row):
+        self.mesh = mesh
+        self.row = row
+
+    @property
+    def index(self):
+        return self.row + 1
+
+    @property
+    def coord(self):
+        x, y, z = self.mesh.coords[self.row]
+        return (float(x), float(y), float(z))
+
+    @coord.setter
+    def coord(self, value):
+        # copy-on-write like transform: the old array may be shared (MeshHistory snapshots,
+        # a memory-mapped cache), so it is never written to
+        coords = np.array(self.mesh.coords, dtype=np.float64)
+        coords[self.row] = value
+        self.mesh.set_coords_array(coords)
+
+    @property
+    def edge(self):
+        return self.mesh._edge_view(self.mesh.vertex_edge[self.row])
+
+    def __eq__(self, other):
+        return isinstance(other, CompactVertex) and other.mesh is self.mesh and other.row == self.row
+
+    def __hash__(self):
+        return hash((id(self.mesh), self.row))
+
+class CompactEdge:
+    # same attributes as Edge, vertex ids are 1-based like in EdgeMesh
+    __slots__ = ('mesh', 'row')
+
+    def __init__(self, mesh, row):
+        self.mesh = mesh
+        self.row = row
+
+    @property
+    def vertex_start(self):
+        return int(self.mesh.edge_vertex_start[self.row]) + 1
+
+    @property
+    def vertex_end(self):
+        return int(self.mesh.edge_vertex_end[self.row]) + 1
+
+    @property
+    def left_face(self):
+        return self.mesh._face_view(self.mesh.edge_left_face[self.row])
+
+    @property
+    def right_face(self):
+        return self.mesh._face_view(self.mesh.edge_right_face[self.row])
+
+    @property
+    def next_left(self):
+        return self.mesh._edge_view(self.mesh.edge_next_left[self.row])
+
+    @property
+    def prev_left(self):
+        return self.mesh._edge_view(self.mesh.edge_prev_left[self.row])
+
+    @property
+    def next_right(self):
+        return self.mesh._edge_view(self.mesh.edge_next_right[self.row])
+
+    @property
+    def prev_right(self):
+        return self.mesh._edge_view(self.mesh.edge_prev_right[self.row])
+
+    def __eq__(self, other):
+        return isinstance(other, CompactEdge) and other.mesh is self.mesh and other.row == self.row
+
+    def __hash__(self):
+        return hash((id(self.mesh), self.row))
+
+class CompactFace:
+    __slots__ = ('mesh', 'row')
+
+    def __init__(self, mesh, row):
+        self.mesh = mesh
+        self.row = row
+
+    @property
+    def index(self):
+        return self.row + 1
+
+    @property
+    def edge(self):
+        return self.mesh._edge_view(self.mesh.face_edge[self.row])
+
+    def __eq__(self, other):
+        return isinstance(other, CompactFace) and other.mesh is self.mesh and other.row == self.row
 
-def save_mesh_to_obj(mesh_obj, filename):
+    def __hash__(self):
+        return hash((id(self.mesh), self.row))
+
+class _VertexTable(Mapping):
+    # read-only dict-like view: vertex id (1..N) -> CompactVertex
+    def __init__(self, mesh):
+        self.mesh = mesh
+
+    def __getitem__(self, v_id):
+        if not isinstance(v_id, (int, np.integer)) or not 1 <= v_id <= len(self.mesh.coords):
+            raise KeyError(v_id)
+        return CompactVertex(self.mesh, int(v_id) - 1)
+
+    def __iter__(self):
+        return iter(range(1, len(self.mesh.coords) + 1))
+
+    def __len__(self):
+        return len(self.mesh.coords)
+
+class _FaceTable(Mapping):
+    # read-only dict-like view: face id (1..F) -> CompactFace
+    def __init__(self, mesh):
+        self.mesh = mesh
+
+    def __getitem__(self, f_id):
+        if not isinstance(f_id, (int, np.integer)) or not 1 <= f_id <= len(self.mesh.face_edge):
+            raise KeyError(f_id)
+        return CompactFace(self.mesh, int(f_id) - 1)
+
+    def __iter__(self):
+        return iter(range(1, len(self.mesh.face_edge) + 1))
+
+    def __len__(self):
+        return len(self.mesh.face_edge)
+
+class _EdgeTable(Mapping):
+    # read-only dict-like view: (v_start_id, v_end_id) -> CompactEdge
+    # the lookup uses a sorted key array instead of a dict of tuples
+    def __init__(self, mesh):
+        self.mesh = mesh
+
+    def __getitem__(self, key):
+        # like the EdgeMesh dict, only the sorted (canonical) key is present
+        row = -1
+        if isinstance(key, tuple) and len(key) == 2 and key[0] <= key[1]:
+            row = self.mesh.find_edge(*key)
+        if row < 0:
+            raise KeyError(key)
+        return CompactEdge(self.mesh, row)
+
+    def __iter__(self):
+        starts = self.mesh.edge_vertex_start
+        ends = self.mesh.edge_vertex_end
+        for row in range(len(starts)):
+            yield (int(starts[row]) + 1, int(ends[row]) + 1)
+
+    def __len__(self):
+        return len(self.mesh.edge_vertex_start)
+
+class CompactEdgeMesh(EdgeMesh):
+    # every array that describes the mesh, used to save and load it as plain arrays
+    ARRAY_FIELDS = (
+        'coords', 'vertex_edge',
+        'edge_vertex_start', 'edge_vertex_end', 'edge_left_face', 'edge_right_face',
+        'edge_next_left', 'edge_prev_left', 'edge_next_right', 'edge_prev_right',
+        'face_edge',
+    )
+    OPTIONAL_ARRAY_FIELDS = ('texcoords', 'normals', 'face_texcoords', 'face_normals')
+
+    # struct-of-arrays version of EdgeMesh, meant for very big meshes
+    # coordinates live in an (N, 3) array and every winged-edge field is an int32
+    # array indexed by edge/face row (0-based, -1 means None)
+    # vertices, edges and faces are dict-like views, so get_face_vertices,
+    # save_mesh_to_obj and the queries in main.py work the same as with EdgeMesh
+    def __init__(self):
+        self._reset_arrays(np.zeros((0, 3), dtype=np.float64), 0, 0)
+        self._reset_attributes()
+
+    def _reset_arrays(self, coords, n_edges, n_faces):
+        self.coords = coords
+        self.vertex_edge = np.full(len(coords), -1, dtype=np.int32)
+        self.edge_vertex_start = np.zeros(n_edges, dtype=np.int32)
+        self.edge_vertex_end = np.zeros(n_edges, dtype=np.int32)
+        self.edge_left_face = np.full(n_edges, -1, dtype=np.int32)
+        self.edge_right_face = np.full(n_edges, -1, dtype=np.int32)
+        self.edge_next_left = np.full(n_edges, -1, dtype=np.int32)
+        self.edge_prev_left = np.full(n_edges, -1, dtype=np.int32)
+        self.edge_next_right = np.full(n_edges, -1, dtype=np.int32)
+        self.edge_prev_right = np.full(n_edges, -1, dtype=np.int32)
+        self.face_edge = np.full(n_faces, -1, dtype=np.int32)
+        self._edge_keys = None
+        self._edge_key_rows = None
+
+    @property
+    def vertices(self):
+        return _VertexTable(self)
+
+    def coords_array(self):
+        # no copy here, the coordinates already are an (N, 3) array
+        return self.coords
+
+    def set_coords_array(self, coords):
+        self.coords = np.ascontiguousarray(coords, dtype=np.float64)
+        self.invalidate_normals()
+
+    def vertex_rows(self, v_ids):
+        # vertex ids are the rows + 1, no lookup table needed
+        v_ids = np.asarray(v_ids, dtype=np.int64)
+        return np.where((v_ids >= 1) & (v_ids <= len(self.coords)), v_ids - 1, -1)
+
+    @property
+    def edges(self):
+        return _EdgeTable(self)
+
+    @property
+    def faces(self):
+        return _FaceTable(self)
+
+    def _edge_view(self, row):
+        return CompactEdge(self, int(row)) if row >= 0 else None
+
+    def _face_view(self, row):
+        return CompactFace(self, int(row)) if row >= 0 else None
+
+    def edge_arrays(self):
+        # same as EdgeMesh.edge_arrays, straight from the index arrays
+        return {
+            'vertex_start': self.edge_vertex_start.astype(np.int64) + 1,
+            'vertex_end': self.edge_vertex_end.astype(np.int64) + 1,
+            'left_face': self.edge_left_face.astype(np.int64) + 1,
+            'right_face': self.edge_right_face.astype(np.int64) + 1,
+        }
+
+    def edge_index_array(self):
+        if self._edge_index is None:
+            self._edge_index = np.stack([self.edge_vertex_start, self.edge_vertex_end], axis=1)
+        return self._edge_index
+
+    def find_edge(self, v1_id, v2_id):
+        # returns the edge row for the pair of vertex ids (in any order), or -1
+        if self._edge_keys is None:
+            keys = self.edge_vertex_start.astype(np.int64) * len(self.coords) + self.edge_vertex_end
+            self._edge_key_rows = np.argsort(keys, kind='stable').astype(np.int32)
+            self._edge_keys = keys[self._edge_key_rows]
+
+        lo, hi = sorted((int(v1_id) - 1, int(v2_id) - 1))
+        if lo < 0 or hi >= len(self.coords):
+            return -1
+        key = lo * len(self.coords) + hi
+        pos = np.searchsorted(self._edge_keys, key)
+        if pos < len(self._edge_keys) and self._edge_keys[pos] == key:
+            return int(self._edge_key_rows[pos])
+        return -1
+
+    def _build_face_loops(self):
+        # every face loop is walked at the same time, one step per iteration,
+        # so the loop runs as many times as the biggest face has edges
+        n_faces = len(self.face_edge)
+        current = self.face_edge.astype(np.int64)
+        faces = np.flatnonzero(current >= 0)
+        current = current[faces]
+        start = current.copy()
+        corner_faces, corner_vertices, corner_edges = [], [], []
+
+        for _ in range(len(self.edge_vertex_start) + 1):
+            if len(faces) == 0:
+                break
+            left = self.edge_left_face[current] == faces
+            right = ~left & (self.edge_right_face[current] == faces)
+            on_face = left | right
+            faces, current, start, left = faces[on_face], current[on_face], start[on_face], left[on_face]
+
+            corner_faces.append(faces)
+            corner_edges.append(current)
+            corner_vertices.append(np.where(left, self.edge_vertex_start[current], self.edge_vertex_end[current]))
+            current = np.where(left, self.edge_next_left[current], self.edge_next_right[current]).astype(np.int64)
+
+            going_on = (current >= 0) & (current != start)
+            faces, current, start = faces[going_on], current[going_on], start[going_on]
+
+        corner_faces = _concat(corner_faces, 0, np.int64)
+        # the corners were found step by step, a stable sort puts them back face by face
+        order = np.argsort(corner_faces, kind='stable')
+        offsets = np.zeros(n_faces + 1, dtype=np.int64)
+        np.cumsum(np.bincount(corner_faces, minlength=n_faces), out=offsets[1:])
+        return FaceLoops(np.arange(1, n_faces + 1), offsets,
+                         _concat(corner_vertices, 0, np.int64)[order] + 1,
+                         _concat(corner_edges, 0, np.int64)[order], self.edge_arrays())
+
+    def build_from_arrays(self, coords, face_offsets, face_vertices):
+        # builds the winged-edge arrays from a flat face list:
+        # face i uses the vertex rows face_vertices[face_offsets[i]:face_offsets[i + 1]]
+        n_verts = len(coords)
+        face_offsets = np.asarray(face_offsets, dtype=np.int64)
+        face_vertices = np.asarray(face_vertices, dtype=np.int64)
+        sizes = np.diff(face_offsets)
+
+        # drop faces with less than 3 vertices or with vertices that don't exist
+        corner_face = np.repeat(np.arange(len(sizes)), sizes)
+        bad_corner = (face_vertices < 0) | (face_vertices >= n_verts)
+        bad_face = sizes < 3
+        bad_face[corner_face[bad_corner]] = True
+        if bad_face.any():
+            print(f"Warning: {int(bad_face.sum())} faces with less than 3 vertexes or missing vertexes, ignored.")
+            keep_corner = ~bad_face[corner_face]
+            face_vertices = face_vertices[keep_corner]
+            sizes = sizes[~bad_face]
+            face_offsets = np.zeros(len(sizes) + 1, dtype=np.int64)
+            np.cumsum(sizes, out=face_offsets[1:])
+            corner_face = np.repeat(np.arange(len(sizes)), sizes)
+
+        n_faces = len(sizes)
+        n_corners = len(face_vertices)
+
+        # every corner i is the half-edge face_vertices[i] -> face_vertices[next_corner[i]]
+        corners = np.arange(n_corners)
+        next_corner = corners + 1
+        next_corner[face_offsets[1:] - 1] = face_offsets[:-1]
+        prev_corner = corners - 1
+        prev_corner[face_offsets[:-1]] = face_offsets[1:] - 1
+
+        v_start = face_vertices
+        v_end = face_vertices[next_corner]
+        lo = np.minimum(v_start, v_end)
+        hi = np.maximum(v_start, v_end)
+        # same rule as EdgeMesh: the face is left of the edge when it runs along lo -> hi
+        aligned = v_start == lo
+
+        # one edge per vertex pair, numbered in the order they first show up in the file
+        keys = lo * max(n_verts, 1) + hi
+        _, first_corner, inverse = np.unique(keys, return_index=True, return_inverse=True)
+        order = np.argsort(first_corner, kind='stable')
+        rank = np.empty(len(order), dtype=np.int64)
+        rank[order] = np.arange(len(order))
+        corner_edge = rank[inverse.reshape(-1)]
+        n_edges = len(order)
+
+        self._reset_arrays(np.ascontiguousarray(coords, dtype=np.float64), n_edges, n_faces)
+        self.invalidate_topology()
+        self.edge_vertex_start[:] = lo[first_corner[order]]
+        self.edge_vertex_end[:] = hi[first_corner[order]]
+
+        # the first face that uses an edge side keeps it (fancy assignment keeps the
+        # last write, so the corners are written in reverse order)
+        for side_corners, side_face, side_next, side_prev in (
+                (np.flatnonzero(aligned), self.edge_left_face, self.edge_next_left, self.edge_prev_left),
+                (np.flatnonzero(~aligned), self.edge_right_face, self.edge_next_right, self.edge_prev_right)):
+            rev = side_corners[::-1]
+            owner = np.full(n_edges, -1, dtype=np.int64)
+            owner[corner_edge[rev]] = rev
+            owned = owner[owner >= 0]
+
+            side_face[corner_edge[owned]] = corner_face[owned]
+            side_next[corner_edge[owned]] = corner_edge[next_corner[owned]]
+            side_prev[corner_edge[owned]] = corner_edge[prev_corner[owned]]
+
+        self.face_edge[:] = corner_edge[face_offsets[:-1]]
+        self.vertex_edge[self.edge_vertex_end[::-1]] = np.arange(n_edges, dtype=np.int32)[::-1]
+        self.vertex_edge[self.edge_vertex_start[::-1]] = np.arange(n_edges, dtype=np.int32)[::-1]
+
+    def to_arrays(self):
+        # name -> array for every field, the optional ones only when present
+        arrays = {name: getattr(self, name) for name in self.ARRAY_FIELDS}
+        for name in self.OPTIONAL_ARRAY_FIELDS:
+            if getattr(self, name) is not None:
+                arrays[name] = getattr(self, name)
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        # the arrays are used as they are (no copy), so memory-mapped arrays stay mapped
+        mesh = cls()
+        for name in cls.ARRAY_FIELDS:
+            setattr(mesh, name, arrays[name])
+        for name in cls.OPTIONAL_ARRAY_FIELDS:
+            setattr(mesh, name, arrays.get(name))
+        return mesh
+
+    def to_edge_mesh(self):
+        # builds the Vertex/Edge/Face objects of an EdgeMesh with the same ids
+        mesh = EdgeMesh()
+        for v_id, coord in enumerate(self.coords.tolist(), start=1):
+            mesh.vertices[v_id] = Vertex(v_id, tuple(coord))
+
+        faces = [Face(f_id) for f_id in range(1, len(self.face_edge) + 1)]
+        edges = [Edge(s + 1, e + 1) for s, e in zip(self.edge_vertex_start.tolist(), self.edge_vertex_end.tolist())]
+
+        def lookup(table, rows):
+            return [table[row] if row >= 0 else None for row in rows.tolist()]
+
+        for edge, left, right, next_left, prev_left, next_right, prev_right in zip(
+                edges,
+                lookup(faces, self.edge_left_face), lookup(faces, self.edge_right_face),
+                lookup(edges, self.edge_next_left), lookup(edges, self.edge_prev_left),
+                lookup(edges, self.edge_next_right), lookup(edges, self.edge_prev_right)):
+            edge.left_face = left
+            edge.right_face = right
+            edge.next_left = next_left
+            edge.prev_left = prev_left
+            edge.next_right = next_right
+            edge.prev_right = prev_right
+            mesh.edges[(edge.vertex_start, edge.vertex_end)] = edge
+
+        for face, edge in zip(faces, lookup(edges, self.face_edge)):
+            face.edge = edge
+            mesh.faces[face.index] = face
+
+        for name in self.OPTIONAL_ARRAY_FIELDS:
+            setattr(mesh, name, getattr(self, name))
+        mesh.validation = self.validation
+        return mesh
+
+def _face_format(sizes, templates):
+    # one "f %d %d %d\n"-like template per face, templates are reused by size
+    if len(sizes) and (sizes == sizes[0]).all():
+        size = int(sizes[0])
+        return templates.setdefault(size, "f" + " %d" * size + "\n") * len(sizes)
+    return "".join(templates.setdefault(size, "f" + " %d" * size + "\n") for size in sizes.tolist())
+
+def _write_obj(f, coords, face_offsets, face_vertices, n_faces):
+    # writes the vertex and face blocks, OBJ_WRITE_ROWS rows at a time:
+    # every block is formatted by one "%" operation and written with one call
+    f.write("# Saved from Python script\n")
+    f.write(f"# Vertices: {len(coords)}\n")
+    f.write(f"# Faces: {n_faces}\n")
+
+    vertex_format = "v %.6f %.6f %.6f\n"
+    for start in range(0, len(coords), OBJ_WRITE_ROWS):
+        block = coords[start:start + OBJ_WRITE_ROWS]
+        f.write((vertex_format * len(block)) % tuple(block.ravel().tolist()))
+
+    sizes = np.diff(face_offsets)
+    templates = {}
+    for start in range(0, len(sizes), OBJ_WRITE_ROWS):
+        block_sizes = sizes[start:start + OBJ_WRITE_ROWS]
+        corners = face_vertices[face_offsets[start]:face_offsets[start + len(block_sizes)]]
+        f.write(_face_format(block_sizes, templates) % tuple(corners.tolist()))
+
+def _open_for_writing(path, compress, binary=False):
+    mode = 'wb' if binary else 'wt'
+    if compress:
+        return gzip.open(path, mode, compresslevel=OBJ_GZIP_LEVEL, newline=None if binary else '\n')
+    if binary:
+        return open(path, 'wb', buffering=OBJ_WRITE_BUFFER)
+    return open(path, 'w', buffering=OBJ_WRITE_BUFFER, newline='\n')
+
+def _save_atomically(filename, write, compress=False, binary=False):
+    # the file is written next to the target first and then renamed over it,
+    # so an interrupted save never leaves a half written file behind
+    target = os.path.abspath(filename)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(target), prefix=f".{os.path.basename(target)}-", suffix='.tmp')
+    os.close(fd)
+    try:
+        with _open_for_writing(tmp_path, compress, binary) as f:
+            write(f)
+
+        # mkstemp makes the file private, the saved file keeps the usual permissions
+        if os.path.exists(target):
+            os.chmod(tmp_path, os.stat(target).st_mode & 0o7777)
+        else:
+            umask = os.umask(0)
+            os.umask(umask)
+            os.chmod(tmp_path, 0o666 & ~umask)
+        os.replace(tmp_path, target)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def _export_arrays(mesh_obj):
+    # flat arrays of what the writers save: (coords, face_offsets, face_rows)
+    # vertices sorted by id (with the model matrix of the mesh applied) and faces sorted
+    # by id, face_rows are 0-based rows of coords; faces without vertices, or with an id
+    # that isn't in mesh_obj.vertices, are left out
+    v_ids = np.fromiter(mesh_obj.vertices.keys(), dtype=np.int64, count=len(mesh_obj.vertices))
+    vertex_order = np.argsort(v_ids, kind='stable')
+    sorted_ids = v_ids[vertex_order]
+
+    if hasattr(mesh_obj, 'world_coords_array'):
+        coords = mesh_obj.world_coords_array()
+    else:
+        coords = np.array([v.coord for v in mesh_obj.vertices.values()], dtype=np.float64).reshape(-1, 3)
+    coords = np.asarray(coords, dtype=np.float64)[vertex_order]
+
+    if hasattr(mesh_obj, 'face_vertex_arrays'):
+        face_offsets, face_ids = mesh_obj.face_vertex_arrays()
+    else:
+        loops = [get_face_vertices(face, mesh_obj) for face in mesh_obj.faces.values()]
+        face_offsets = np.concatenate([[0], np.cumsum([len(loop) for loop in loops])]).astype(np.int64)
+        face_ids = np.fromiter(chain.from_iterable(loops), dtype=np.int64, count=int(face_offsets[-1]))
+
+    f_ids = np.fromiter(mesh_obj.faces.keys(), dtype=np.int64, count=len(mesh_obj.faces))
+    sizes = np.diff(face_offsets)
+    rows = np.searchsorted(sorted_ids, face_ids)
+    missing = rows >= len(sorted_ids)
+    missing[~missing] = sorted_ids[rows[~missing]] != face_ids[~missing]
+    corner_face = np.repeat(np.arange(len(sizes)), sizes)
+    bad_face = sizes == 0
+    bad_face[corner_face[missing]] = True
+
+    face_order = np.argsort(f_ids, kind='stable')
+    face_order = face_order[~bad_face[face_order]]
+    out_offsets, out_rows = _csr_gather(face_offsets, rows, face_order)
+    return coords, out_offsets, out_rows
+
+def save_mesh_to_obj(mesh_obj, filename, compress=None):
+    # writes the mesh (with its model matrix applied) as an .obj file
+    # compress=None gzips the file when filename ends in .gz
     if not mesh_obj:
         print("No mesh data to save.")
         return
-    
+
+    if compress is None:
+        compress = str(filename).endswith('.gz')
+
     try:
-        with open(filename, 'w') as f:
-            f.write(f"# Saved from Python script\n")
-            f.write(f"# Vertices: {len(mesh_obj.vertices)}\n")
-            f.write(f"# Faces: {len(mesh_obj.faces)}\n")
-            
-            vertex_map = {}
-            for i, v_id in enumerate(sorted(mesh_obj.vertices.keys()), start=1):
-                vertex = mesh_obj.vertices[v_id]
-                f.write(f"v {vertex.coord[0]:.6f} {vertex.coord[1]:.6f} {vertex.coord[2]:.6f}\n")
-                vertex_map[v_id] = i
-
-            for face_id in sorted(mesh_obj.faces.keys()):
-                face = mesh_obj.faces[face_id]
-                face_vertex_original_ids = get_face_vertices(face, mesh_obj) 
-                
-                if not face_vertex_original_ids:
-                    # print(f"Warning: Face {face_id} has no vertices, skipping.")
-                    continue
+        coords, face_offsets, face_rows = _export_arrays(mesh_obj)
+        # the header counts every face of the mesh, like it always did
+        _save_atomically(filename, lambda f: _write_obj(f, coords, face_offsets, face_rows + 1, len(mesh_obj.faces)), compress)
+        print(f"Mesh saved to {filename}")
 
-                face_vertex_file_indices = [vertex_map.get(original_id) for original_id in face_vertex_original_ids]
-                
-                if None in face_vertex_file_indices:
-                    # this might happen if get_face_vertices returns an ID not in vertex_map
-                    continue
+    except Exception as e:
+        print(f"Error saving mesh to {filename}: {e}")
+
+# binary PLY and STL
+# both formats are read and written as whole numpy blocks (np.frombuffer / tobytes),
+# there is no per-vertex or per-face Python code unless a PLY file has mixed
+# face sizes with other face properties
+
+_PLY_TYPES = {
+    'char': 'i1', 'int8': 'i1', 'uchar': 'u1', 'uint8': 'u1',
+    'short': 'i2', 'int16': 'i2', 'ushort': 'u2', 'uint16': 'u2',
+    'int': 'i4', 'int32': 'i4', 'uint': 'u4', 'uint32': 'u4',
+    'float': 'f4', 'float32': 'f4', 'double': 'f8', 'float64': 'f8',
+}
+_PLY_FORMATS = {'binary_little_endian': '<', 'binary_big_endian': '>'}
+# one binary STL triangle: normal, 3 corners and the "attribute byte count"
+_STL_TRIANGLE = np.dtype([('normal', '<f4', (3,)), ('corners', '<f4', (3, 3)), ('attributes', '<u2')])
+_STL_HEADER_SIZE = 84
+
+def _read_ply_header(data):
+    # returns (byte order, [(element name, count, [(property, type or (count type, item type))])], body offset)
+    end = data.find(b'end_header')
+    if not data.startswith(b'ply') or end < 0:
+        raise ValueError("Not a PLY file.")
+    body = data.index(b'\n', end) + 1
+
+    byte_order = None
+    elements = []
+    for line in data[:end].decode('ascii', 'replace').splitlines()[1:]:
+        words = line.split()
+        if not words or words[0] in ('comment', 'obj_info'):
+            continue
+        if words[0] == 'format':
+            if words[1] not in _PLY_FORMATS:
+                raise ValueError(f"PLY format '{words[1]}' is not supported, only binary PLY files are.")
+            byte_order = _PLY_FORMATS[words[1]]
+        elif words[0] == 'element':
+            elements.append((words[1], int(words[2]), []))
+        elif words[0] == 'property':
+            if words[1] == 'list':
+                elements[-1][2].append((words[4], (_PLY_TYPES[words[2]], _PLY_TYPES[words[3]])))
+            else:
+                elements[-1][2].append((words[2], _PLY_TYPES[words[1]]))
+
+    if byte_order is None:
+        raise ValueError("PLY file without a format line.")
+    return byte_order, elements, body
+
+def _read_ply_element(data, offset, byte_order, count, properties):
+    # returns ({property: array}, offset after the element)
+    # list properties give (offsets, values) like the face arrays of ObjData
+    if not any(isinstance(kind, tuple) for _, kind in properties):
+        dtype = np.dtype([(name, byte_order + kind) for name, kind in properties])
+        block = np.frombuffer(data, dtype=dtype, count=count, offset=offset)
+        return {name: block[name] for name, _ in properties}, offset + dtype.itemsize * count
+
+    if len(properties) == 1 and count:
+        # the usual face element: only one list, read it as a fixed size block when
+        # every face has as many corners as the first one
+        name, (count_type, item_type) = properties[0]
+        count_type, item_type = np.dtype(byte_order + count_type), np.dtype(byte_order + item_type)
+        size = int(np.frombuffer(data, dtype=count_type, count=1, offset=offset)[0])
+        dtype = np.dtype([('n', count_type), ('items', item_type, (size,))])
+        if offset + dtype.itemsize * count <= len(data):
+            block = np.frombuffer(data, dtype=dtype, count=count, offset=offset)
+            if (block['n'] == size).all():
+                offsets = np.arange(count + 1, dtype=np.int64) * size
+                return {name: (offsets, block['items'].reshape(-1))}, offset + dtype.itemsize * count
+
+    # mixed list sizes: each row is read on its own
+    values = {name: [] for name, _ in properties}
+    for _ in range(count):
+        for name, kind in properties:
+            if isinstance(kind, tuple):
+                count_type, item_type = np.dtype(byte_order + kind[0]), np.dtype(byte_order + kind[1])
+                n = int(np.frombuffer(data, dtype=count_type, count=1, offset=offset)[0])
+                offset += count_type.itemsize
+                values[name].append(np.frombuffer(data, dtype=item_type, count=n, offset=offset))
+                offset += item_type.itemsize * n
+            else:
+                item_type = np.dtype(byte_order + kind)
+                values[name].append(np.frombuffer(data, dtype=item_type, count=1, offset=offset)[0])
+                offset += item_type.itemsize
+
+    arrays = {}
+    for name, kind in properties:
+        if isinstance(kind, tuple):
+            sizes = [len(v) for v in values[name]]
+            offsets = np.zeros(count + 1, dtype=np.int64)
+            np.cumsum(sizes, out=offsets[1:])
+            arrays[name] = (offsets, _concat(values[name], 0, kind[1]))
+        else:
+            arrays[name] = np.array(values[name])
+    return arrays, offset
+
+def parse_ply(filename):
+    # reads a binary PLY file (little or big endian) and returns an ObjData
+    # vertex x/y/z and the face vertex_indices (or vertex_index) list are used, the rest is skipped
+    with open(filename, 'rb') as f:
+        data = f.read()
+
+    byte_order, elements, offset = _read_ply_header(data)
+    vertices = np.zeros((0, 3), dtype=np.float64)
+    face_offsets = np.zeros(1, dtype=np.int64)
+    face_vertices = np.zeros(0, dtype=np.int32)
+
+    for name, count, properties in elements:
+        arrays, offset = _read_ply_element(data, offset, byte_order, count, properties)
+        if name == 'vertex':
+            vertices = np.column_stack([arrays[axis] for axis in ('x', 'y', 'z')]).astype(np.float64)
+        elif name == 'face':
+            key = 'vertex_indices' if 'vertex_indices' in arrays else 'vertex_index'
+            face_offsets, face_vertices = arrays[key]
+            face_vertices = face_vertices.astype(np.int32)
+
+    return ObjData(vertices, face_offsets, face_vertices)
+
+def parse_stl(filename):
+    # reads a binary STL file and returns an ObjData
+    # STL repeats the corners of every triangle, equal corners are merged into one vertex
+    with open(filename, 'rb') as f:
+        data = f.read()
+
+    if len(data) < _STL_HEADER_SIZE:
+        raise ValueError("Not a binary STL file.")
+    count = int(np.frombuffer(data, dtype='<u4', count=1, offset=80)[0])
+    if len(data) != _STL_HEADER_SIZE + count * _STL_TRIANGLE.itemsize:
+        if data.lstrip().startswith(b'solid'):
+            raise ValueError("ASCII STL files are not supported, only binary STL files are.")
+        raise ValueError("Binary STL file with the wrong size.")
+
+    triangles = np.frombuffer(data, dtype=_STL_TRIANGLE, count=count, offset=_STL_HEADER_SIZE)
+    corners = np.ascontiguousarray(triangles['corners']).reshape(-1, 3)
+    # the rows are compared as raw bytes, that's a lot faster than np.unique(axis=0)
+    keys = corners.view(np.dtype((np.void, corners.dtype.itemsize * 3))).reshape(-1)
+    _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    # vertices keep the order in which they first appear in the file
+    order = np.argsort(first, kind='stable')
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+
+    vertices = corners[first[order]].astype(np.float64)
+    face_vertices = rank[inverse.reshape(-1)].astype(np.int32)
+    face_offsets = np.arange(count + 1, dtype=np.int64) * 3
+    return ObjData(vertices, face_offsets, face_vertices)
+
+def _write_ply(f, coords, face_offsets, face_rows):
+    sizes = np.diff(face_offsets)
+    header = (
+        "ply\n"
+        "format binary_little_endian 1.0\n"
+        "comment Saved from Python script\n"
+        f"element vertex {len(coords)}\n"
+        "property double x\nproperty double y\nproperty double z\n"
+        f"element face {len(sizes)}\n"
+        "property list uchar int vertex_indices\n"
+        "end_header\n"
+    )
+    f.write(header.encode('ascii'))
+    f.write(np.ascontiguousarray(coords, dtype='<f8').tobytes())
+
+    if len(sizes) and (sizes == sizes[0]).all():
+        block = np.empty(len(sizes), dtype=[('n', 'u1'), ('items', '<i4', (int(sizes[0]),))])
+        block['n'] = sizes[0]
+        block['items'] = face_rows.reshape(len(sizes), -1)
+        f.write(block.tobytes())
+        return
 
-                f.write("f")
-                for v_idx in face_vertex_file_indices:
-                    f.write(f" {v_idx}")
-                f.write("\n")
+    # mixed sizes: every face is one count byte then 4 bytes per corner,
+    # the count bytes and the corners are scattered in one byte buffer
+    buffer = np.empty(len(sizes) + 4 * len(face_rows), dtype=np.uint8)
+    count_at = 4 * face_offsets[:-1] + np.arange(len(sizes))
+    buffer[count_at] = sizes
+    corner_at = np.repeat(count_at + 1, sizes) + 4 * (np.arange(len(face_rows)) - np.repeat(face_offsets[:-1], sizes))
+    corner_bytes = np.ascontiguousarray(face_rows, dtype='<i4').view(np.uint8).reshape(-1, 4)
+    buffer[corner_at[:, None] + np.arange(4)] = corner_bytes
+    f.write(buffer.tobytes())
+
+def _is_affine(matrix):
+    return np.array_equal(matrix[3], [0, 0, 0, 1])
+
+def _cofactor_matrix(m):
+    # det(m) * inverse(m).T for a 3x3 matrix, from cross products of its rows
+    return np.stack([np.cross(m[1], m[2]), np.cross(m[2], m[0]), np.cross(m[0], m[1])])
+
+def _unit_rows(vectors):
+    lengths = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return np.divide(vectors, lengths, out=np.zeros_like(vectors), where=lengths > 0)
+
+def _triangulate(face_offsets, face_rows):
+    # fan triangulation of every face, returns a (T, 3) array of rows
+    sizes = np.diff(face_offsets)
+    n_triangles = np.maximum(sizes - 2, 0)
+    first = np.repeat(face_offsets[:-1], n_triangles)
+    # index of every triangle inside its face
+    tri_offsets = np.zeros(len(sizes) + 1, dtype=np.int64)
+    np.cumsum(n_triangles, out=tri_offsets[1:])
+    within = np.arange(tri_offsets[-1]) - np.repeat(tri_offsets[:-1], n_triangles)
+    return np.column_stack([face_rows[first], face_rows[first + within + 1], face_rows[first + within + 2]])
+
+def _write_stl(f, coords, face_offsets, face_rows):
+    triangles = _triangulate(face_offsets, face_rows)
+    corners = coords[triangles]
+    normals = np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+    lengths = np.linalg.norm(normals, axis=1, keepdims=True)
+    np.divide(normals, lengths, out=normals, where=lengths > 0)
+
+    block = np.zeros(len(triangles), dtype=_STL_TRIANGLE)
+    block['normal'] = normals
+    block['corners'] = corners
+    f.write(b'Saved from Python script'.ljust(80, b' '))
+    f.write(np.array([len(triangles)], dtype='<u4').tobytes())
+    f.write(block.tobytes())
+
+def save_mesh_to_ply(mesh_obj, filename):
+    # writes the mesh (with its model matrix applied) as a binary little-endian PLY file
+    if not mesh_obj:
+        print("No mesh data to save.")
+        return
+    try:
+        coords, face_offsets, face_rows = _export_arrays(mesh_obj)
+        if len(face_offsets) > 1 and np.diff(face_offsets).max() > 255:
+            raise ValueError("PLY faces can't have more than 255 vertices.")
+        _save_atomically(filename, lambda f: _write_ply(f, coords, face_offsets, face_rows), binary=True)
         print(f"Mesh saved to {filename}")
+    except Exception as e:
+        print(f"Error saving mesh to {filename}: {e}")
 
+def save_mesh_to_stl(mesh_obj, filename):
+    # writes the mesh (with its model matrix applied) as a binary STL file
+    # STL only has triangles, bigger faces are split in a fan
+    if not mesh_obj:
+        print("No mesh data to save.")
+        return
+    try:
+        coords, face_offsets, face_rows = _export_arrays(mesh_obj)
+        _save_atomically(filename, lambda f: _write_stl(f, coords, face_offsets, face_rows), binary=True)
+        print(f"Mesh saved to {filename}")
     except Exception as e:
         print(f"Error saving mesh to {filename}: {e}")
 
+# every file type the meshes can be read from and written to
+MESH_EXTENSIONS = ('.obj', '.obj.gz', '.ply', '.stl')
+
+def mesh_format(filename):
+    # 'obj', 'ply' or 'stl' from the file name, None for anything else
+    name = str(filename).lower()
+    for extension in MESH_EXTENSIONS:
+        if name.endswith(extension):
+            return extension.split('.')[1]
+    return None
+
+def parse_mesh_file(filename, progress=None):
+    # parse_obj, parse_ply or parse_stl, by extension
+    # progress is only reported for .obj files, the other readers load the file at once
+    parsers = {'obj': parse_obj, 'ply': parse_ply, 'stl': parse_stl}
+    kind = mesh_format(filename)
+    if kind is None:
+        raise ValueError(f"Unknown mesh file type: '{filename}'")
+    if kind == 'obj':
+        return parse_obj(filename, progress=progress)
+    return parsers[kind](filename)
+
+def save_mesh(mesh_obj, filename):
+    # save_mesh_to_obj, save_mesh_to_ply or save_mesh_to_stl, by extension
+    savers = {'obj': save_mesh_to_obj, 'ply': save_mesh_to_ply, 'stl': save_mesh_to_stl}
+    kind = mesh_format(filename)
+    if kind is None:
+        print(f"Error saving mesh to {filename}: unknown file type.")
+        return
+    savers[kind](mesh_obj, filename)
+
 def get_face_vertices(face, mesh_obj):
-    vertices = []
     if not face.edge:
-        return vertices
+        return []
+
+    # the meshes keep every face loop in a cached table (EdgeMesh.face_loops),
+    # the pointers are only walked for a face that isn't part of mesh_obj
+    if isinstance(mesh_obj, EdgeMesh) and mesh_obj.faces.get(face.index) == face:
+        return mesh_obj.face_vertex_ids(face.index)
 
-    start_edge = face.edge
-    current_edge = start_edge
-    
     # security limit for edges in a face
     MAX_EDGES_PER_FACE = 256 
-    if hasattr(mesh_obj, 'edges') and isinstance(mesh_obj.edges, dict) and mesh_obj.edges:
+    if hasattr(mesh_obj, 'edges') and isinstance(mesh_obj.edges, (dict, Mapping)) and mesh_obj.edges:
         MAX_EDGES_PER_FACE = len(mesh_obj.edges) + 1
 
-    for _ in range(MAX_EDGES_PER_FACE):
+    return _walk_face_loop(face, MAX_EDGES_PER_FACE)[0]
+
+def _walk_face_loop(face, max_edges):
+    # follows next_left / next_right around the face, returns (vertex ids, edges)
+    vertices, edges = [], []
+    start_edge = face.edge
+    current_edge = start_edge
+
+    for _ in range(max_edges):
         if not current_edge: 
             break
         
@@ -207,13 +1596,12 @@ def get_face_vertices(face, mesh_obj):
         else:
             break 
 
+        edges.append(current_edge)
         if not next_e:
             break 
             
         current_edge = next_e
         if current_edge == start_edge:
             break 
-    else:
-        pass
 
-    return vertices
\ No newline at end of file
+    return vertices, edges